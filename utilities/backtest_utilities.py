@@ -0,0 +1,210 @@
+from imports import *
+from config import *
+
+##################
+# --- SERIES --- #
+##################
+
+'''
+Description: Return the predictions of several series (e.g. models x horizons x features) as NumPy arrays aligned on the same timestamps
+Args:
+    predictions: Pandas dataset of the predictions in long format (the key columns, timestamp, market-price, target and prediction)
+    keys: Columns identifying each series (e.g. ["Model", "Dataset"])
+    target_label: The column name of target variable
+    prediction_label: The column name of the predictions
+Return:
+    labels: Pandas dataset with the keys of each series (one row per series)
+    timestamps: Array of the timestamps (T)
+    price: Array of the market prices (T)
+    target: Array of the next market prices (T)
+    predicted: Array of the predictions (S x T), NaN where a series has no prediction
+'''
+def series_matrix(predictions, keys, target_label=TARGET_LABEL, prediction_label="prediction"):
+    predicted = predictions.pivot_table(index=keys, columns='timestamp', values=prediction_label, aggfunc='last')
+    prices = predictions.drop_duplicates('timestamp', keep='last').set_index('timestamp').reindex(predicted.columns)
+
+    labels = predicted.index.to_frame(index=False)
+    timestamps = predicted.columns.to_numpy()
+
+    return labels, timestamps, prices['market-price'].to_numpy(dtype=float), prices[target_label].to_numpy(dtype=float), predicted.to_numpy(dtype=float)
+
+###################
+# --- SIGNALS --- #
+###################
+
+'''
+Description: Return the percentage of correct predictions of the price direction of each series (as model_accuracy, without Spark)
+Args:
+    price: Market prices (T)
+    target: Next market prices (T)
+    predicted: Predictions (T or S x T), NaN values are ignored
+Return:
+    accuracy: Percentage of correct predictions (a number or one value per series)
+'''
+def directional_accuracy(price, target, predicted):
+    price = np.asarray(price, dtype=float)
+    target = np.asarray(target, dtype=float)
+    predicted = np.asarray(predicted, dtype=float)
+
+    # Correct if both the price and the prediction go up or both go down
+    correct = ((price < target) & (price < predicted)) | ((price > target) & (price > predicted))
+    valid = ~np.isnan(predicted)
+
+    return correct.sum(axis=-1) / valid.sum(axis=-1) * 100
+
+'''
+Description: Return the positions taken by the strategy: long if the predicted return is above the threshold, short if it is below minus the threshold
+             (flat for long only strategies), flat otherwise
+Args:
+    price: Market prices (T)
+    predicted: Predictions (S x T)
+    threshold: Minimum absolute predicted return to open a position (a number or an array broadcastable to the predictions)
+    long_only: Indicates whether short positions are allowed (a boolean or an array broadcastable to the predictions)
+Return:
+    positions: Positions (1: long, -1: short, 0: flat)
+'''
+def strategy_positions(price, predicted, threshold, long_only):
+    with np.errstate(invalid='ignore'):
+        predicted_return = predicted / price - 1
+        long = predicted_return > threshold
+        short = (predicted_return < -threshold) & ~np.asarray(long_only)
+
+    return long.astype(np.int8) - short.astype(np.int8)
+
+'''
+Description: Return the net return of each bar of the strategy. A position is held from the current price to the next one and changing it
+             costs the fee and the slippage for each unit traded
+Args:
+    price: Market prices (T)
+    target: Next market prices (T)
+    positions: Positions of the strategy (... x S x T)
+    cost: Fee plus slippage as a fraction of the traded value (a number or an array broadcastable to the positions)
+Return:
+    returns: Net returns (... x S x T)
+'''
+def strategy_returns(price, target, positions, cost):
+    market_return = target / price - 1
+
+    # Units traded at each bar (the strategy starts flat)
+    turnover = np.abs(np.diff(positions, axis=-1, prepend=0))
+
+    return positions * market_return - cost * turnover
+
+'''
+Description: Return the equity curve and the drawdown curve of the net returns
+Args:
+    returns: Net returns (... x T)
+Return:
+    equity: Value of one unit invested at the beginning (... x T)
+    drawdown: Loss from the previous maximum of the equity, as a fraction (... x T)
+'''
+def equity_drawdown(returns):
+    equity = np.cumprod(1 + returns, axis=-1)
+    drawdown = equity / np.maximum(np.maximum.accumulate(equity, axis=-1), 1) - 1
+
+    return equity, drawdown
+
+####################
+# --- BACKTEST --- #
+####################
+
+'''
+Description: Return the curves of a strategy for each series, to be plotted over time
+Args:
+    labels: Keys of each series (as returned by series_matrix)
+    timestamps: Timestamps (T)
+    price: Market prices (T)
+    target: Next market prices (T)
+    predicted: Predictions (S x T)
+    threshold: Minimum absolute predicted return to open a position
+    fee: Fee as a fraction of the traded value
+    slippage: Slippage as a fraction of the traded value
+    long_only: Indicates whether short positions are allowed
+Return:
+    curves: Dictionary (equity | drawdown | hit_rate -> Pandas dataset with the timestamp and one column per series)
+'''
+def backtest_curves(labels, timestamps, price, target, predicted, threshold=0.0, fee=BACKTEST_FEE, slippage=BACKTEST_SLIPPAGE, long_only=False):
+    valid = ~np.isnan(predicted)
+    positions = strategy_positions(price, predicted, threshold, long_only)
+    returns = strategy_returns(price, target, positions, fee + slippage)
+    equity, drawdown = equity_drawdown(returns)
+
+    # Running percentage of correct predictions of the price direction
+    correct = ((price < target) & (price < predicted)) | ((price > target) & (price > predicted))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hit_rate = np.cumsum(correct, axis=-1) / np.cumsum(valid, axis=-1) * 100
+
+    names = [" - ".join(str(value) for value in row) for row in labels.itertuples(index=False)]
+
+    return {
+        name: pd.DataFrame(values.T, columns=names).assign(timestamp=timestamps)
+        for name, values in [('equity', equity), ('drawdown', drawdown), ('hit_rate', hit_rate)]
+    }
+
+'''
+Description: Backtest the strategy of every series for every combination of parameters. The combinations are evaluated in chunks,
+             each chunk at once as a (combinations x series x bars) array, so thousands of combinations take a few seconds
+Args:
+    labels: Keys of each series (as returned by series_matrix)
+    price: Market prices (T)
+    target: Next market prices (T)
+    predicted: Predictions (S x T)
+    params: Dictionary (threshold | fee | slippage | long_only -> list of values)
+    chunk_size: Maximum number of values of the arrays of a chunk
+Return:
+    results: Pandas dataset with one row per series and combination of parameters (keys, parameters, Accuracy, Return, Max_drawdown, Sharpe, Trades, Hit_rate)
+'''
+def backtest_sweep(labels, price, target, predicted, params=BACKTEST_PARAMS, chunk_size=BACKTEST_CHUNK_SIZE):
+    combinations = pd.DataFrame([dict(zip(params, values)) for values in product(*params.values())])
+    num_series, num_bars = predicted.shape
+
+    valid = ~np.isnan(predicted)
+    valid_bars = valid.sum(axis=-1)
+    accuracy = directional_accuracy(price, target, predicted)
+    bars_per_year = 365 * BARS_PER_DAY[DATASET_RESOLUTION]
+
+    chunk_combinations = builtins.max(1, chunk_size // (num_series * num_bars))
+    summaries = []
+
+    for first in range(0, len(combinations), chunk_combinations):
+        chunk = combinations.iloc[first:first + chunk_combinations]
+
+        # Parameters as (combinations x 1 x 1) arrays, broadcast over the series and the bars
+        threshold = chunk['threshold'].to_numpy(dtype=float)[:, None, None]
+        cost = (chunk['fee'].to_numpy(dtype=float) + chunk['slippage'].to_numpy(dtype=float))[:, None, None]
+        long_only = chunk['long_only'].to_numpy(dtype=bool)[:, None, None]
+
+        positions = strategy_positions(price, predicted, threshold, long_only) * valid
+        returns = strategy_returns(price, target, positions, cost)
+        equity, drawdown = equity_drawdown(returns)
+
+        in_market = positions != 0
+        trades = np.count_nonzero(np.diff(positions, axis=-1, prepend=0), axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Mean and standard deviation of the returns of the bars with a prediction only (the other bars of the series are not traded),
+            # annualized from the number of these bars in a year
+            mean = np.where(valid, returns, 0).sum(axis=-1) / valid_bars
+            std = np.sqrt(np.where(valid, (returns - mean[..., None]) ** 2, 0).sum(axis=-1) / valid_bars)
+            sharpe = mean / std * np.sqrt(bars_per_year)
+            hit_rate = np.count_nonzero(in_market & (returns > 0), axis=-1) / np.count_nonzero(in_market, axis=-1) * 100
+
+        summaries.append({
+            'Return': (equity[..., -1] - 1) * 100,
+            'Max_drawdown': drawdown.min(axis=-1) * 100,
+            'Sharpe': sharpe,
+            'Trades': trades,
+            'Hit_rate': hit_rate
+        })
+
+    metrics = {name: np.concatenate([summary[name] for summary in summaries]).ravel() for name in summaries[0]}
+
+    # One row per (combination, series)
+    results = pd.concat([
+        combinations.loc[combinations.index.repeat(num_series)].reset_index(drop=True),
+        pd.concat([labels] * len(combinations), ignore_index=True)
+    ], axis=1)
+    results['Accuracy'] = np.tile(accuracy, len(combinations))
+    for name, values in metrics.items():
+        results[name] = values
+
+    return results[list(labels.columns) + list(params) + ['Accuracy', 'Return', 'Max_drawdown', 'Sharpe', 'Trades', 'Hit_rate']]
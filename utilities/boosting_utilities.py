@@ -0,0 +1,397 @@
+from imports import *
+from config import *
+from collection_utilities import collect_pandas
+
+# Names starting with an underscore are not exported by the wildcard imports
+from multiprocessing.pool import ThreadPool as _ThreadPool
+from pyspark import keyword_only as _keyword_only
+from pyspark.ml import Estimator as _Estimator, Model as _Model
+from pyspark.ml.functions import vector_to_array as _vector_to_array
+from pyspark.ml.param import Param as _Param, Params as _Params, TypeConverters as _TypeConverters
+from pyspark.ml.param.shared import HasFeaturesCol as _HasFeaturesCol, HasLabelCol as _HasLabelCol, HasPredictionCol as _HasPredictionCol, \
+    HasMaxIter as _HasMaxIter, HasStepSize as _HasStepSize, HasSeed as _HasSeed
+from pyspark.ml.util import DefaultParamsReadable as _DefaultParamsReadable, DefaultParamsWritable as _DefaultParamsWritable
+from pyspark.sql.functions import pandas_udf as _pandas_udf
+
+###################
+# --- BINNING --- #
+###################
+
+'''
+Description: Return the bin thresholds of each feature, the quantiles of a sample of its values
+Args:
+    x: Features values (rows x features)
+    max_bins: Maximum number of bins of each feature (at most 256, so that the bins fit in uint8 codes)
+    seed: Seed of the sample
+Return:
+    thresholds: List of the sorted thresholds of each feature (at most max_bins - 1)
+'''
+def bin_thresholds(x, max_bins, seed):
+    rng = np.random.default_rng(seed)
+    sample = x if len(x) <= HGBT_BINNING_SAMPLE else x[rng.choice(len(x), HGBT_BINNING_SAMPLE, replace=False)]
+    quantiles = np.linspace(0, 1, max_bins + 1)[1:-1]
+
+    return [np.unique(np.quantile(sample[:, i], quantiles)) for i in range(x.shape[1])]
+
+'''
+Description: Return the bin of each value: the number of thresholds of its feature lower or equal to it
+Args:
+    x: Features values (rows x features)
+    thresholds: Thresholds of each feature (as returned by bin_thresholds)
+Return:
+    codes: Bins of the values (rows x features, uint8)
+'''
+def bin_features(x, thresholds):
+    codes = np.empty(x.shape, dtype=np.uint8)
+    for i, feature_thresholds in enumerate(thresholds):
+        codes[:, i] = np.searchsorted(feature_thresholds, x[:, i], side='right')
+
+    return codes
+
+# Binned train sets ((Spark plan, columns, bins, seed) -> (thresholds, codes, labels)), least recently used first
+binned_datasets = OrderedDict()
+
+'''
+Description: Return the binned features of a Spark dataset. The dataset is collected and binned only once: the result is cached
+             and reused by all the fits on the same dataset (e.g. all the parameters of a split)
+Args:
+    dataset: Spark dataset
+    features_col: The column name of features
+    label_col: The column name of target variable
+    max_bins: Maximum number of bins of each feature
+    seed: Seed of the sample used to compute the thresholds
+Return:
+    thresholds: Thresholds of each feature
+    codes: Bins of the features (rows x features, uint8)
+    labels: Target values
+'''
+def binned_dataset(dataset, features_col, label_col, max_bins, seed):
+    key = (dataset.semanticHash(), features_col, label_col, max_bins, seed)
+
+    if key in binned_datasets:
+        binned_datasets.move_to_end(key)
+    else:
+        rows = collect_pandas(dataset.select(_vector_to_array(col(features_col)).alias("features"), col(label_col).alias("label")), "binning")
+        x = np.stack(rows["features"].to_numpy()).astype(np.float64)
+        thresholds = bin_thresholds(x, max_bins, seed)
+        binned_datasets[key] = (thresholds, bin_features(x, thresholds), rows["label"].to_numpy(dtype=np.float64))
+
+        # Keep only the most recent datasets
+        if len(binned_datasets) > HGBT_CACHE_SIZE:
+            binned_datasets.popitem(last=False)
+
+    return binned_datasets[key]
+
+#################
+# --- TREES --- #
+#################
+
+'''
+Description: Return the sums of the gradients and the number of rows of each (node, feature, bin) of some rows
+Args:
+    codes: Bins of the features (rows x features)
+    gradients: Gradients of the rows
+    nodes: Node of the level of each row (-1 for the rows of the leaves)
+    num_nodes: Number of nodes of the level
+    num_bins: Number of bins of each feature
+    rows: Slice of the rows to be counted
+Return:
+    gradient_hist: Sums of the gradients (nodes x features x bins)
+    count_hist: Number of rows (nodes x features x bins)
+'''
+def node_histograms(codes, gradients, nodes, num_nodes, num_bins, rows):
+    num_features = codes.shape[1]
+    active = nodes[rows] >= 0
+
+    # Position of each (row, feature) in the flattened histograms
+    positions = codes[rows][active].astype(np.int64) + np.arange(num_features) * num_bins
+    positions += (nodes[rows][active] * (num_features * num_bins))[:, None]
+
+    size = num_nodes * num_features * num_bins
+    gradient_hist = np.bincount(positions.ravel(), weights=np.repeat(gradients[rows][active], num_features), minlength=size)
+    count_hist = np.bincount(positions.ravel(), minlength=size)
+
+    shape = (num_nodes, num_features, num_bins)
+
+    return gradient_hist.reshape(shape), count_hist.reshape(shape)
+
+'''
+Description: Return the best split of each node from its histograms (the rows with a bin lower or equal to the split bin go to the left child)
+Args:
+    gradient_hist: Sums of the gradients (nodes x features x bins)
+    count_hist: Number of rows (nodes x features x bins)
+    min_instances: Minimum number of rows of each child
+Return:
+    feature: Feature of the best split of each node
+    split_bin: Bin of the best split of each node
+    gain: Reduction of the squared error of the best split of each node (not positive if the node can't be splitted)
+'''
+def best_splits(gradient_hist, count_hist, min_instances):
+    left_gradient = np.cumsum(gradient_hist, axis=2)
+    left_count = np.cumsum(count_hist, axis=2)
+    total_gradient = left_gradient[:, :1, -1:]
+    total_count = left_count[:, :1, -1:]
+    right_count = total_count - left_count
+
+    # Squared error of the children (up to a constant), only where both children have enough rows
+    allowed = (left_count >= min_instances) & (right_count >= min_instances)
+    score = np.full(gradient_hist.shape, -np.inf)
+    score[allowed] = left_gradient[allowed] ** 2 / left_count[allowed] + (total_gradient - left_gradient)[allowed] ** 2 / right_count[allowed]
+
+    flat_score = score.reshape(len(score), -1)
+    best = flat_score.argmax(axis=1)
+    feature, split_bin = np.unravel_index(best, score.shape[1:])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gain = flat_score[np.arange(len(score)), best] - total_gradient.ravel() ** 2 / total_count.ravel()
+
+    return feature, split_bin, gain
+
+'''
+Description: Grow a regression tree on the gradients level by level. The histograms of all the nodes of a level are built in one pass
+             over the rows, split in chunks which are counted in parallel
+Args:
+    codes: Bins of the features (rows x features)
+    gradients: Negative gradients of the rows (the residuals of the squared error)
+    thresholds: Thresholds of each feature
+    max_depth: Maximum depth of the tree
+    step_size: Learning rate, which shrinks the values of the leaves
+    min_instances: Minimum number of rows of each leaf
+    num_bins: Number of bins of each feature
+    pool: Thread pool used to count the chunks of rows
+    chunks: Slices of the rows counted by each thread
+Return:
+    tree: Dictionary of the flattened arrays of the nodes (feature, threshold, left, right, value, cover), -1 as feature for the leaves
+    update: Value of the leaf of each row
+'''
+def grow_tree(codes, gradients, thresholds, max_depth, step_size, min_instances, num_bins, pool, chunks):
+    tree = {"feature": [], "threshold": [], "left": [], "right": [], "value": [], "cover": []}
+    update = np.zeros(len(codes))
+
+    # Node of the level of each row, nodes of the tree of the current level
+    nodes = np.zeros(len(codes), dtype=np.int64)
+    level_ids = [0]
+    for name in tree:
+        tree[name].append(-1 if name in ("feature", "left", "right") else 0.0)
+
+    for depth in range(max_depth + 1):
+        active = np.flatnonzero(nodes >= 0)
+        slots = nodes[active]
+
+        # Value of each node: mean gradient of its rows, shrinked by the learning rate
+        node_gradient = np.bincount(slots, weights=gradients[active], minlength=len(level_ids))
+        node_count = np.bincount(slots, minlength=len(level_ids))
+        node_value = node_gradient / np.maximum(node_count, 1) * step_size
+
+        if depth < max_depth:
+            histograms = pool.map(lambda rows: node_histograms(codes, gradients, nodes, len(level_ids), num_bins, rows), chunks)
+            gradient_hist = builtins.sum(gradient for gradient, _ in histograms)
+            count_hist = builtins.sum(count for _, count in histograms)
+
+            feature, split_bin, gain = best_splits(gradient_hist, count_hist, min_instances)
+            splitted = gain > 0
+        else:
+            feature = split_bin = np.zeros(len(level_ids), dtype=np.int64)
+            splitted = np.zeros(len(level_ids), dtype=bool)
+
+        # Children of the splitted nodes, in the order of the next level
+        child_slot = np.full(len(level_ids), -1, dtype=np.int64)
+        child_slot[splitted] = np.arange(np.count_nonzero(splitted)) * 2
+        next_ids = []
+
+        for slot, node_id in enumerate(level_ids):
+            tree["value"][node_id] = node_value[slot]
+            tree["cover"][node_id] = float(node_count[slot])
+            if not splitted[slot]:
+                continue
+
+            tree["feature"][node_id] = int(feature[slot])
+            tree["threshold"][node_id] = float(thresholds[feature[slot]][split_bin[slot]])
+            for side in ("left", "right"):
+                tree[side][node_id] = len(tree["feature"])
+                next_ids.append(len(tree["feature"]))
+                for name in tree:
+                    tree[name].append(-1 if name in ("feature", "left", "right") else 0.0)
+
+        # Rows of the leaves take their value, the other ones move to the child of their node
+        leaf_rows = ~splitted[slots]
+        update[active[leaf_rows]] = node_value[slots[leaf_rows]]
+
+        go_left = codes[active, feature[slots]] <= split_bin[slots]
+        nodes[active] = np.where(leaf_rows, -1, child_slot[slots] + np.where(go_left, 0, 1))
+
+        level_ids = next_ids
+        if not level_ids:
+            break
+
+    return {name: np.array(values) for name, values in tree.items()}, update
+
+'''
+Description: Train the gradient boosted trees on the binned features (squared error)
+Args:
+    codes: Bins of the features (rows x features)
+    labels: Target values
+    thresholds: Thresholds of each feature
+    max_iter: Number of trees
+    max_depth: Maximum depth of each tree
+    step_size: Learning rate
+    max_bins: Number of bins of each feature
+    deadline: Time (as returned by time.time()) after which no tree is grown (None for no deadline)
+Return:
+    base: Initial prediction (mean of the target)
+    trees: Flattened arrays of all the trees (the node ids of each tree are offset by its first node) and the root of each tree
+'''
+def boost_trees(codes, labels, thresholds, max_iter, max_depth, step_size, max_bins, deadline=None):
+    # One chunk of rows for each thread
+    threads = HGBT_THREADS or os.cpu_count()
+    chunk_rows = -(-len(codes) // threads)
+    chunks = [builtins.slice(start, start + chunk_rows) for start in range(0, len(codes), chunk_rows)]
+
+    base = float(labels.mean())
+    predictions = np.full(len(labels), base)
+    trees = []
+
+    with _ThreadPool(processes=threads) as pool:
+        for _ in range(max_iter):
+            if deadline is not None and time.time() >= deadline:
+                raise TimeoutError("The fit has reached its deadline")
+
+            tree, update = grow_tree(codes, labels - predictions, thresholds, max_depth, step_size, HGBT_MIN_INSTANCES, max_bins, pool, chunks)
+            predictions += update
+            trees.append(tree)
+
+    # Flatten the trees, offsetting the ids of the children
+    offsets = np.cumsum([0] + [len(tree["feature"]) for tree in trees[:-1]])
+    flat = {name: np.concatenate([tree[name] for tree in trees]) for name in trees[0]}
+    for side in ("left", "right"):
+        flat[side] = np.concatenate([np.where(tree[side] >= 0, tree[side] + offset, -1) for tree, offset in zip(trees, offsets)])
+    flat["roots"] = offsets
+
+    return base, flat
+
+'''
+Description: Return the predictions of the trees, all the trees are traversed at once one level at a time
+Args:
+    x: Features values (rows x features)
+    base: Initial prediction
+    trees: Flattened arrays of the trees (as returned by boost_trees)
+Return:
+    predictions: Predictions of the rows
+'''
+def predict_trees(x, base, trees):
+    nodes = np.broadcast_to(trees["roots"], (len(x), len(trees["roots"]))).copy()
+
+    while True:
+        feature = trees["feature"][nodes]
+        internal = feature >= 0
+        if not internal.any():
+            break
+
+        rows, columns = np.nonzero(internal)
+        current = nodes[rows, columns]
+        go_left = x[rows, feature[rows, columns]] < trees["threshold"][current]
+        nodes[rows, columns] = np.where(go_left, trees["left"][current], trees["right"][current])
+
+    return base + trees["value"][nodes].sum(axis=1)
+
+#################
+# --- MODEL --- #
+#################
+
+'''
+Description: Gradient boosted trees regressor trained on binned features (squared error). Each feature is binned once into at most maxBins
+             uint8 codes, the binned train set is cached and shared by all the fits on the same dataset, and each tree is grown from
+             per-bin gradient histograms counted in parallel on the driver. It can be used in a Pipeline as the Spark regressors
+Args:
+    featuresCol: The column name of features
+    labelCol: The column name of target variable
+    predictionCol: The column name of the predictions
+    maxIter: Number of trees
+    maxDepth: Maximum depth of each tree
+    stepSize: Learning rate, in interval (0, 1]
+    maxBins: Maximum number of bins of each feature (at most 256)
+    seed: Seed of the sample used to compute the bins
+'''
+class HistGradientBoostingRegressor(_Estimator, _HasFeaturesCol, _HasLabelCol, _HasPredictionCol, _HasMaxIter, _HasStepSize, _HasSeed, _DefaultParamsReadable, _DefaultParamsWritable):
+    maxDepth = _Param(_Params._dummy(), "maxDepth", "maximum depth of each tree", typeConverter=_TypeConverters.toInt)
+    maxBins = _Param(_Params._dummy(), "maxBins", "maximum number of bins of each feature (at most 256)", typeConverter=_TypeConverters.toInt)
+
+    @_keyword_only
+    def __init__(self, *, featuresCol="features", labelCol="label", predictionCol="prediction", maxIter=20, maxDepth=5, stepSize=0.1, maxBins=HGBT_MAX_BINS, seed=RANDOM_SEED):
+        super().__init__()
+        self._setDefault(featuresCol="features", labelCol="label", predictionCol="prediction", maxIter=20, maxDepth=5, stepSize=0.1, maxBins=HGBT_MAX_BINS, seed=RANDOM_SEED)
+
+        kwargs = self._input_kwargs
+        self._set(**kwargs)
+
+    def setFeaturesCol(self, value):
+        return self._set(featuresCol=value)
+
+    def setLabelCol(self, value):
+        return self._set(labelCol=value)
+
+    def setPredictionCol(self, value):
+        return self._set(predictionCol=value)
+
+    def _fit(self, dataset):
+        max_bins = self.getOrDefault(self.maxBins)
+        if not 2 <= max_bins <= 256:
+            raise ValueError("maxBins must be in [2, 256]")
+
+        # The trees are grown on the driver, where cancelling the job group has no effect, so the deadline of the fit is checked before each tree
+        deadline = dataset.sparkSession.sparkContext.getLocalProperty(FIT_DEADLINE_PROPERTY)
+
+        thresholds, codes, labels = binned_dataset(dataset, self.getFeaturesCol(), self.getLabelCol(), max_bins, self.getSeed())
+        base, trees = boost_trees(codes, labels, thresholds, self.getMaxIter(), self.getOrDefault(self.maxDepth), self.getStepSize(), max_bins, float(deadline) if deadline else None)
+
+        model = HistGradientBoostingRegressionModel(featuresCol=self.getFeaturesCol(), predictionCol=self.getPredictionCol(),
+                                                    base=base, trees=json.dumps({name: values.tolist() for name, values in trees.items()}))
+
+        return self._copyValues(model)
+
+'''
+Description: Model trained by HistGradientBoostingRegressor, the trees are saved with its parameters so it can be saved and loaded in a PipelineModel
+Args:
+    featuresCol: The column name of features
+    predictionCol: The column name of the predictions
+    base: Initial prediction (mean of the target)
+    trees: Flattened arrays of the trees as a JSON string
+'''
+class HistGradientBoostingRegressionModel(_Model, _HasFeaturesCol, _HasLabelCol, _HasPredictionCol, _HasMaxIter, _HasStepSize, _HasSeed, _DefaultParamsReadable, _DefaultParamsWritable):
+    maxDepth = _Param(_Params._dummy(), "maxDepth", "maximum depth of each tree", typeConverter=_TypeConverters.toInt)
+    maxBins = _Param(_Params._dummy(), "maxBins", "maximum number of bins of each feature (at most 256)", typeConverter=_TypeConverters.toInt)
+    base = _Param(_Params._dummy(), "base", "initial prediction", typeConverter=_TypeConverters.toFloat)
+    trees = _Param(_Params._dummy(), "trees", "flattened arrays of the trees (JSON)", typeConverter=_TypeConverters.toString)
+
+    @_keyword_only
+    def __init__(self, *, featuresCol="features", predictionCol="prediction", base=0.0, trees=None):
+        super().__init__()
+        self._setDefault(featuresCol="features", predictionCol="prediction", base=0.0)
+
+        kwargs = self._input_kwargs
+        self._set(**kwargs)
+
+    def setFeaturesCol(self, value):
+        return self._set(featuresCol=value)
+
+    def setPredictionCol(self, value):
+        return self._set(predictionCol=value)
+
+    '''
+    Description: Return the flattened arrays of the trees
+    Args: None
+    Return:
+        trees: Dictionary (array name -> NumPy array)
+    '''
+    def getTrees(self):
+        return {name: np.array(values) for name, values in json.loads(self.getOrDefault(self.trees)).items()}
+
+    def _transform(self, dataset):
+        base = self.getOrDefault(self.base)
+        trees = self.getTrees()
+
+        @_pandas_udf(DoubleType())
+        def predict(features: pd.Series) -> pd.Series:
+            return pd.Series(predict_trees(np.stack(features.to_numpy()), base, trees))
+
+        return dataset.withColumn(self.getPredictionCol(), predict(_vector_to_array(col(self.getFeaturesCol()))))
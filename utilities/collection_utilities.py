@@ -0,0 +1,224 @@
+from imports import *
+from config import *
+
+##################
+# --- MEMORY --- #
+##################
+
+'''
+Description: Return the resident memory of the driver (the Python process)
+Args: None
+Return:
+    rss_mb: Resident memory (MB), None if it cannot be measured on this platform
+'''
+def driver_rss_mb():
+    # Current resident memory on Linux
+    if os.path.exists("/proc/self/statm"):
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # Peak resident memory on the other Unix systems
+        return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024 # Bytes on macOS, kilobytes on Linux
+    except ImportError:
+        return None # Not available on Windows
+
+'''
+Description: Return the heap memory used by the JVM of the driver
+Args:
+    spark: Spark session
+Return:
+    used_mb: Used heap memory (MB), None if the JVM is not reachable (e.g. remote sessions)
+'''
+def driver_jvm_mb(spark):
+    try:
+        runtime = spark._jvm.java.lang.Runtime.getRuntime()
+        return (runtime.totalMemory() - runtime.freeMemory()) / (1024 * 1024)
+    except Exception:
+        return None
+
+'''
+Description: Estimate the memory needed by a Spark dataset once collected as a Pandas dataset, from the size of a sample of its rows
+Args:
+    dataset: Spark dataset
+    rows: Number of rows of the dataset
+Return:
+    size_mb: Estimated size (MB)
+    sample: Pandas dataset with the sampled rows (used to choose the types of the columns)
+'''
+def estimate_size_mb(dataset, rows):
+    sample = dataset.limit(COLLECT_SAMPLE_ROWS).toPandas()
+    if sample.empty:
+        return 0.0, sample
+
+    row_bytes = sample.memory_usage(deep=True, index=False).sum() / len(sample)
+
+    return rows * row_bytes / (1024 * 1024), sample
+
+######################
+# --- COLLECTION --- #
+######################
+
+# Memory used by each collection (one dictionary per call)
+collection_log = []
+
+# Directories of the datasets streamed to disk
+spill_dirs = []
+
+'''
+Description: Write a batch of rows to the columns of a dataset streamed to disk
+Args:
+    columns: Dictionary (column -> row of a memory mapped array or list of values)
+    names: Names of the columns of the rows
+    batch: List of Spark rows
+    position: Position of the first row of the batch
+Return: None
+'''
+def write_batch(columns, names, batch, position):
+    frame = pd.DataFrame.from_records(batch, columns=names)
+    for name, values in columns.items():
+        if isinstance(values, list):
+            values.extend(frame[name].tolist())
+        else:
+            values[position:position + len(frame)] = frame[name].to_numpy(dtype=values.dtype)
+
+'''
+Description: Stream a Spark dataset to disk, one batch of rows at a time, and return it as a Pandas dataset whose numeric and timestamp columns
+             are memory mapped files: the driver only holds one batch while streaming and the pages of the result can be released by the system.
+             The columns of the same type are stored in a single file, which is the block of the Pandas dataset, so Pandas never consolidates
+             (copies in memory) the memory mapped columns. The columns of the same type are kept together (in the order of the dataset if they are
+             already contiguous)
+Args:
+    dataset: Spark dataset
+    rows: Number of rows of the dataset
+    sample: Pandas dataset with some rows of the dataset (as returned by estimate_size_mb)
+    spill_dir: Directory where the files are written (None for the temporary directory of the system)
+Return:
+    dataset: Pandas dataset backed by the files
+'''
+def stream_to_disk(dataset, rows, sample, spill_dir=COLLECT_SPILL_DIR):
+    directory = tempfile.mkdtemp(prefix="collection-", dir=spill_dir)
+    spill_dirs.append(directory)
+
+    # Columns of each type, in order of appearance. Numeric and timestamp columns are written to the files, the other ones (e.g. vectors)
+    # are kept in memory
+    groups = {}
+    for field in dataset.schema.fields:
+        dtype = sample[field.name].dtype if field.name in sample else np.dtype(object)
+
+        # The sample may have missed the nulls: the nullable integers are stored as floats (NaN for the nulls, as toPandas does)
+        # and the nullable booleans as objects
+        if field.nullable and dtype.kind in "biu":
+            dtype = np.dtype(float) if dtype.kind in "iu" else np.dtype(object)
+
+        groups.setdefault(dtype if dtype.kind in "biufM" else np.dtype(object), []).append(field.name)
+
+    files = {}
+    columns = {}
+    for i, (dtype, names) in enumerate(groups.items()):
+        if dtype.kind in "biufM":
+            # One row of the file for each column, so that each column is contiguous
+            files[dtype] = np.lib.format.open_memmap(os.path.join(directory, f"{i}.npy"), mode='w+', dtype=dtype, shape=(len(names), rows))
+            columns.update({name: files[dtype][j] for j, name in enumerate(names)})
+        else:
+            columns.update({name: [] for name in names})
+
+    position = 0
+    batch = []
+    for row in dataset.toLocalIterator(prefetchPartitions=False):
+        batch.append(row)
+        if len(batch) == COLLECT_BATCH_ROWS:
+            write_batch(columns, dataset.columns, batch, position)
+            position += len(batch)
+            batch = []
+    if batch:
+        write_batch(columns, dataset.columns, batch, position)
+        position += len(batch)
+
+    for values in files.values():
+        values.flush()
+
+    # Each file becomes a block of the Pandas dataset as it is (the transposed file is not copied) and the blocks are concatenated without copies
+    parts = []
+    for dtype, names in groups.items():
+        if dtype in files:
+            parts.append(pd.DataFrame(files[dtype][:, :position].T, columns=names, copy=False))
+        else:
+            parts.append(pd.DataFrame({name: columns[name] for name in names}, dtype=object))
+
+    return pd.concat(parts, axis=1, copy=False)
+
+'''
+Description: Collect a Spark dataset as a Pandas dataset without exceeding the memory budget of the driver: its size is estimated before collecting it
+             and, if it doesn't fit in the memory left, it is streamed to disk instead. The memory used by each call is recorded (see collection_report)
+Args:
+    dataset: Spark dataset (Pandas datasets are returned as they are)
+    label: Name of the collection shown in the report
+    budget_mb: Driver memory (MB) the collected datasets can use
+Return:
+    dataset: Pandas dataset
+'''
+def collect_pandas(dataset, label="", budget_mb=COLLECT_MEMORY_BUDGET_MB):
+    if isinstance(dataset, pd.DataFrame):
+        return dataset
+
+    start = time.time()
+    rss_before = driver_rss_mb()
+    jvm_before = driver_jvm_mb(dataset.sparkSession)
+
+    # The dataset is cached while it is counted, sampled and collected, so that its plan runs only once
+    cache = not dataset.is_cached
+    if cache:
+        dataset.cache()
+
+    try:
+        rows = dataset.count()
+        estimated_mb, sample = estimate_size_mb(dataset, rows)
+
+        # The rows are collected at once only if the peak of toPandas fits in the memory left
+        if (rss_before or 0) + estimated_mb * COLLECT_OVERHEAD <= budget_mb:
+            result = dataset.toPandas()
+            mode = "memory"
+        else:
+            result = stream_to_disk(dataset, rows, sample)
+            mode = "disk"
+    finally:
+        if cache:
+            dataset.unpersist()
+
+    rss_after = driver_rss_mb()
+    jvm_after = driver_jvm_mb(dataset.sparkSession)
+
+    collection_log.append({
+        "Label": label,
+        "Rows": len(result),
+        "Mode": mode,
+        "Estimated_MB": estimated_mb,
+        "RSS_before_MB": rss_before,
+        "RSS_after_MB": rss_after,
+        "RSS_delta_MB": None if rss_before is None or rss_after is None else rss_after - rss_before,
+        "JVM_delta_MB": None if jvm_before is None or jvm_after is None else jvm_after - jvm_before,
+        "Seconds": time.time() - start
+    })
+
+    return result
+
+'''
+Description: Return the memory used by each collection
+Args: None
+Return:
+    report: Pandas dataset with one row per collection (rows, mode [memory | disk], estimated size, driver memory before and after)
+'''
+def collection_report():
+    return pd.DataFrame(collection_log)
+
+'''
+Description: Delete the files of the datasets streamed to disk (the Pandas datasets backed by them can no longer be used)
+Args: None
+Return: None
+'''
+def release_spills():
+    for directory in spill_dirs:
+        shutil.rmtree(directory, ignore_errors=True)
+    spill_dirs.clear()
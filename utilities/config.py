@@ -7,6 +7,7 @@ LR = "LinearRegression"
 GLR = "GeneralizedLinearRegression"
 RF = "RandomForestRegressor"
 GBTR = "GradientBoostingTreeRegressor"
+HGBT = "HistGradientBoostingRegressor"
 
 #Spltting methods
 BS = "block_splits"
@@ -16,14 +17,48 @@ SS = "single_split"
 # For reproducibility
 RANDOM_SEED = 42
 
+###################
+# --- SESSION --- #
+###################
+
+# Spark session shared by all the notebooks
+SPARK_APP_NAME = "BitcoinPricePrediction"
+SPARK_MASTER = "local[*]"
+SPARK_CONF = {
+    "spark.ui.port": "4050",
+    "spark.executor.memory": "12G",
+    "spark.driver.memory": "12G",
+    "spark.driver.maxResultSize": "109G",
+    "spark.kryoserializer.buffer.max": "1G"
+}
+
+# Spark Connect server (long-lived, started once and attached by the notebooks)
+SPARK_REMOTE = False # Attach to the server instead of starting a local session (in Spark 3.4 pyspark.ml needs a local session)
+SPARK_CONNECT_PORT = 15002
+SPARK_CONNECT_PACKAGE = "org.apache.spark:spark-connect_2.12:3.4.1" # Same version as pyspark
+SPARK_CONNECT_TIMEOUT = 120 # Seconds waited for the server to start
+
 ###################
 # --- DATASET --- #
 ###################
 
+# Datasets resolution [1d | 15min], the raw data is daily and it is upsampled only with 15min (the features and the targets are computed
+# on the bars, so the processed datasets are saved at this resolution: 1d keeps every phase on the daily rows)
+DATASET_RESOLUTION = "15min"
+BARS_PER_DAY = {"1d": 1, "15min": 96}
+
 # Datasets names
-DATASET_NAME = "bitcoin_blockchain_data_15min"
-DATASET_TRAIN_VALID_NAME = "bitcoin_blockchain_data_15min_train_valid"
-DATASET_TEST_NAME = "bitcoin_blockchain_data_15min_test"
+DATASET_RAW_NAME = "bitcoin_blockchain_data_1d"
+DATASET_NAME = "bitcoin_blockchain_data_" + DATASET_RESOLUTION
+DATASET_TRAIN_VALID_NAME = DATASET_NAME + "_train_valid"
+DATASET_TEST_NAME = DATASET_NAME + "_test"
+
+# Datasets layout
+PARTITION_COLUMN = "month" # Column used to partition the datasets
+PARTITION_FORMAT = "yyyy-MM" # Spark format of the partition column
+PARTITION_STRFTIME_FORMAT = "%Y-%m" # Python format of the partition column
+PARQUET_COMPRESSION = "zstd" # Compression codec of the parquet files
+PARQUET_ROW_GROUP_SIZE = 128 * 1024 # Size of the parquet row groups (bytes), about one week of 15 minutes rows
 
 ####################
 # --- FEATURES --- #
@@ -33,12 +68,27 @@ DATASET_TEST_NAME = "bitcoin_blockchain_data_15min_test"
 FEATURES_LABEL = "features"
 TARGET_LABEL = "next-market-price"
 
+# Horizons of the additional targets (minutes ahead), only the ones which are a whole number of bars of the dataset resolution are used
+TARGET_HORIZONS = {"1h": 60, "4h": 4 * 60, "1d": 24 * 60, "1w": 7 * 24 * 60}
+
 # Features names
 FEATURES_CORRELATION_LABEL = "features_correlation"
 BASE_FEATURES_LABEL = "base_features"
 BASE_AND_MOST_CORR_FEATURES_LABEL = "base_and_most_corr_features"
 BASE_AND_LEAST_CORR_FEATURES_LABEL = "base_and_least_corr_features"
 
+# Technical indicators of the market price (periods in days, converted to bars based on the dataset resolution)
+INDICATORS = {
+    "ema": [12, 26], # Exponential moving averages
+    "rsi": [14], # Relative strength index
+    "macd": [(12, 26, 9)], # Moving average convergence divergence (fast period, slow period, signal period)
+    "bollinger": [(20, 2)], # Bollinger bands (period, number of standard deviations)
+    "volatility": [7, 30], # Rolling standard deviation of the log returns
+    "log-return": [1] # Log return over the period
+}
+INDICATORS_CHUNK_ROWS = 200000 # Rows of each chunk processed at once (without the halo rows)
+INDICATORS_HALO_FACTOR = 10 # Halo rows of each chunk, as a multiple of the longest period (the recursive indicators forget the older rows by at least e^-10)
+
 ##################
 # --- MODELS --- #
 ##################
@@ -48,6 +98,89 @@ LR_MODEL_NAME = "LinearRegression"
 GLR_MODEL_NAME = "GeneralizedLinearRegression"
 RF_MODEL_NAME = "RandomForestRegressor"
 GBTR_MODEL_NAME = "GradientBoostingTreeRegressor"
+HGBT_MODEL_NAME = "HistGradientBoostingRegressor"
+
+# Parameters of each model, in the order in which they are saved in the results
+MODEL_PARAMETERS = {
+    LR: ["maxIter", "regParam", "elasticNetParam"],
+    GLR: ["maxIter", "regParam", "family", "link"],
+    RF: ["numTrees", "maxDepth", "seed"],
+    GBTR: ["maxIter", "maxDepth", "stepSize", "seed"],
+    HGBT: ["maxIter", "maxDepth", "stepSize", "seed"]
+}
+
+# Links supported by each family of the generalized linear regression (as in Spark, tweedie uses linkPower instead)
+GLR_FAMILY_LINKS = {
+    "gaussian": ["identity", "log", "inverse"],
+    "binomial": ["logit", "probit", "cloglog"],
+    "poisson": ["log", "identity", "sqrt"],
+    "gamma": ["inverse", "identity", "log"]
+}
+
+# Family and link combinations which fail to converge on this data (the identity link gives negative means to the gamma family)
+GLR_INVALID_COMBINATIONS = [("gamma", "identity")]
+
+# Histogram gradient boosting
+HGBT_MAX_BINS = 256 # Maximum number of bins of each feature (the bins are stored as uint8 codes)
+HGBT_MIN_INSTANCES = 1 # Minimum number of rows of each leaf (as minInstancesPerNode of the Spark trees)
+HGBT_BINNING_SAMPLE = 200000 # Rows sampled to compute the bins of each feature
+HGBT_CACHE_SIZE = 2 # Number of binned train sets kept in memory
+HGBT_THREADS = None # Threads counting the gradient histograms (None for all the cores)
+
+# Number of parameter maps evaluated at the same time by the time series cross validator
+TUNING_PARALLELISM = 4
+
+# Sampled evaluation of the hyperparameter tuning (the cross validation and the test are always evaluated on all the rows)
+TUNING_SAMPLED_EVALUATION = True # Score the candidates of each split on a sample of the validation rows
+TUNING_SAMPLE_FRACTION = 0.1 # Fraction of the validation rows in the sample (one row out of each block of 1 / fraction consecutive rows)
+TUNING_SAMPLE_MIN_ROWS = 2000 # Validation sets whose sample would be smaller are evaluated on all the rows
+TUNING_CONFIDENCE = 0.95 # Confidence level of the intervals of the sampled metrics
+
+# Time budgets of the hyperparameter tuning (the Spark jobs of a configuration run in their own job group, cancelled when the budget is over)
+TUNING_CONFIG_BUDGET_SECONDS = 15 * 60 # Fit and scoring of a configuration on a split
+TUNING_BUDGET_SECONDS = 8 * 60 * 60 # Whole tuning of a model, no configuration runs after it
+FIT_DEADLINE_PROPERTY = "fit.deadline" # Spark local property with the deadline of the current fit (read by the models fitted on the driver)
+
+# Models registry
+MODEL_REGISTRY_NAME = "registry.json" # File recording the saved models (parameters, features, training data and metrics)
+MODEL_CACHE_SIZE = 4 # Number of models kept in memory
+
+# Rows reduced at once by the executors when computing the Gram matrices of the linear models
+GRAM_BATCH_ROWS = 10000
+
+###################
+# --- RETRAIN --- #
+###################
+
+RETRAIN_WINDOW_DAYS = 365 # Days of the rolling window the models are retrained on
+RETRAIN_EVERY_BARS = BARS_PER_DAY[DATASET_RESOLUTION] # A retrain starts when this number of new bars has arrived...
+RETRAIN_EVERY_SECONDS = 24 * 60 * 60 # ...or when this time has passed since the previous one (if there are new bars)
+RETRAIN_DEADLINE_SECONDS = 60 * 60 # Maximum duration of a retrain (it is also never longer than the interval between two retrains)
+RETRAIN_POLL_SECONDS = 60 # Seconds between two checks of the scheduler
+RETRAIN_STATE_NAME = "retrain_state.json" # File recording the last retrain
+RETRAIN_LOG_NAME = "retrain_log.jsonl" # File recording the outcome and the fit latency of each retrained model
+
+###################
+# --- MONITOR --- #
+###################
+
+MONITOR_HALF_LIFE_BARS = BARS_PER_DAY[DATASET_RESOLUTION] # Half life of the exponentially weighted metrics
+MONITOR_WINDOW_BARS = 7 * BARS_PER_DAY[DATASET_RESOLUTION] # Bars of the sliding window metrics
+MONITOR_MIN_BARS = BARS_PER_DAY[DATASET_RESOLUTION] # Bars monitored before the first alert
+MONITOR_ERROR_RATIO = 1.5 # An alert is raised when the RMSE, MAE or MAPE is above this multiple of its validation value...
+MONITOR_ACCURACY_DROP = 10 # ...when the directional accuracy is this number of points below its validation value...
+MONITOR_DRIFT_Z = 3 # ...when the mean of a feature moves by this number of standard deviations of the train set...
+MONITOR_VARIANCE_RATIO = 4 # ...or when the variance of a feature is this multiple (or fraction) of the one of the train set
+MONITOR_ALERT_COOLDOWN_BARS = BARS_PER_DAY[DATASET_RESOLUTION] # Bars before the same alert is raised again
+MONITOR_ALERTS_NAME = "monitor_alerts.jsonl" # File recording the alerts (one JSON object per line)
+
+###################
+# --- EXPLAIN --- #
+###################
+
+SHAP_BATCH_ROWS = 2000 # Rows explained at once by each process (the paths of the trees are walked by all the rows of a batch together)
+SHAP_WORKERS = None # Processes computing the SHAP values (None for all the cores)
+SHAP_SAMPLE_ROWS = 20000 # Rows sampled to compute the global importance of the features
 
 ###################
 # --- RESULTS --- #
@@ -56,4 +189,49 @@ GBTR_MODEL_NAME = "GradientBoostingTreeRegressor"
 # Splits names
 BLOCK_SPLITS_NAME = "block_splits"
 WALK_FORWARD_SPLITS_NAME = "walk_forward_splits"
-SHORT_TERM_SPLITS_NAME = "single_split"
\ No newline at end of file
+SHORT_TERM_SPLITS_NAME = "single_split"
+
+# Results warehouse
+RESULTS_DB_NAME = "results.db"
+
+####################
+# --- BACKTEST --- #
+####################
+
+BACKTEST_FEE = 0.001 # Fee of each trade as a fraction of the traded value
+BACKTEST_SLIPPAGE = 0.0005 # Slippage of each trade as a fraction of the traded value
+
+# Parameters compared by the backtest (all the combinations)
+BACKTEST_PARAMS = {
+    "threshold": [0.0, 0.0005, 0.001, 0.0025, 0.005, 0.01], # Minimum absolute predicted return to open a position
+    "fee": [0.0, BACKTEST_FEE],
+    "slippage": [0.0, BACKTEST_SLIPPAGE],
+    "long_only": [False, True]
+}
+BACKTEST_CHUNK_SIZE = 2_000_000 # Maximum number of values of the arrays evaluated at once (small chunks are faster than a single large array)
+
+######################
+# --- COLLECTION --- #
+######################
+
+COLLECT_MEMORY_BUDGET_MB = 4 * 1024 # Driver memory (MB) the collected datasets can use, above it they are streamed to disk
+COLLECT_OVERHEAD = 3 # Peak memory of toPandas as a multiple of the size of the result (Arrow batches and Pandas copy)
+COLLECT_SAMPLE_ROWS = 1000 # Rows collected to estimate the size of a row
+COLLECT_BATCH_ROWS = 100000 # Rows written to disk at once when a dataset is streamed
+COLLECT_SPILL_DIR = None # Directory of the datasets streamed to disk (None for the temporary directory of the system)
+
+##################
+# --- WRITER --- #
+##################
+
+WRITER_QUEUE_SIZE = 8 # Artifacts waiting to be written in the background, when the queue is full the caller waits (backpressure)
+WRITER_THREADS = 1 # Threads writing the artifacts (with one thread they are written in the order they are submitted)
+
+#################
+# --- PLOTS --- #
+#################
+
+PLOT_MAX_POINTS = 2000 # Maximum number of points of each trace (about two points per pixel)
+PLOT_CACHE_SIZE = 8 # Number of datasets collected for the plots kept in memory
+EXPORT_WORKERS = 4 # Number of processes used to export the images
+EXPORT_MANIFEST_NAME = ".export_manifest.json" # File containing the hashes of the exported images
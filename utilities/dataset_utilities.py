@@ -0,0 +1,326 @@
+from imports import *
+from config import *
+
+#################
+# --- WRITE --- #
+#################
+
+'''
+Description: Set a configuration of the Spark session only for the duration of a block, the previous value is restored at the end
+             (these settings are session-wide configurations, not options of a single read or write)
+Args:
+    spark: Spark session
+    key: Configuration key
+    value: Value used by the block
+Return: None
+'''
+@contextmanager
+def session_conf(spark, key, value):
+    previous = spark.conf.get(key, None)
+    spark.conf.set(key, value)
+
+    try:
+        yield
+    finally:
+        if previous is None:
+            spark.conf.unset(key)
+        else:
+            spark.conf.set(key, previous)
+
+'''
+Description: Return the versions of a dataset written by write_dataset (each version is a directory next to the path, e.g. path.v3)
+Args:
+    path: Path of the dataset
+Return:
+    versions: List of the version numbers
+'''
+def dataset_versions(path):
+    directory, name = os.path.split(path)
+    prefix = name + ".v"
+
+    return [int(entry[len(prefix):]) for entry in os.listdir(directory or ".") if entry.startswith(prefix) and entry[len(prefix):].isdigit()]
+
+'''
+Description: Save the dataset as a date-partitioned Parquet dataset. Rows are partitioned by month and sorted by timestamp inside each file,
+             so that the min/max statistics written in every row group can be used to skip files and row groups when filtering by time.
+             The write is atomic: each write goes to a new version directory (path.v<N>) which is published by replacing the pointer file
+             (path.current) with os.replace, so the readers see either the old or the new version and a failed write never leaves
+             a partial dataset. The previous versions are removed once the new one is published
+Args:
+    dataset: Dataset to be saved
+    path: Path of the output dataset
+Return: None
+'''
+def write_dataset(dataset, path):
+    # Add the partition column and put all the rows of the same month in the same file, ordered by timestamp
+    dataset = dataset.withColumn(PARTITION_COLUMN, F.date_format(col("timestamp"), PARTITION_FORMAT)) \
+                     .repartition(PARTITION_COLUMN) \
+                     .sortWithinPartitions("timestamp")
+
+    versions = dataset_versions(path)
+    version_path = f"{path}.v{builtins.max(versions, default=0) + 1}"
+    pointer_path = path + ".current"
+
+    # Write the new version. Timestamps are stored as INT64 (instead of the default INT96) so that they get min/max statistics
+    # and filters can be pushed down
+    with session_conf(dataset.sparkSession, "spark.sql.parquet.outputTimestampType", "TIMESTAMP_MICROS"):
+        dataset.write \
+            .partitionBy(PARTITION_COLUMN) \
+            .option("compression", PARQUET_COMPRESSION) \
+            .option("parquet.block.size", PARQUET_ROW_GROUP_SIZE) \
+            .option("parquet.enable.dictionary", "true") \
+            .parquet(version_path, mode='overwrite')
+
+    # Publish it: the pointer file is written aside and then replaces the old one in a single step
+    with open(pointer_path + ".tmp", 'w') as file:
+        file.write(os.path.basename(version_path))
+    os.replace(pointer_path + ".tmp", pointer_path)
+
+    # Remove the previous versions (including the ones left by the failed writes) and the dataset saved by the previous versions of write_dataset
+    # (a directory or a single file)
+    for version in versions:
+        shutil.rmtree(f"{path}.v{version}", ignore_errors=True)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.isfile(path):
+        os.remove(path)
+
+    print("Dataset saved successfully in:", version_path)
+
+################
+# --- READ --- #
+################
+
+'''
+Description: Return the path of the published version of a dataset
+Args:
+    path: Path of the dataset
+Return:
+    path: Path of the version the pointer file refers to (the path itself for the datasets saved by the previous versions of write_dataset)
+'''
+def current_version(path):
+    pointer_path = path + ".current"
+    if not os.path.isfile(pointer_path):
+        return path
+
+    with open(pointer_path) as file:
+        return os.path.join(os.path.dirname(path), file.read().strip())
+
+'''
+Description: Load a dataset saved with write_dataset (the version it has published). The rows are not ordered (the files are not read
+             in chronological order), the callers which need the chronological order sort the rows they use
+Args:
+    spark: Spark session
+    path: Path of the dataset
+Return:
+    dataset: Loaded dataset
+'''
+def read_dataset(spark, path):
+    path = current_version(path)
+
+    # Keep the partition column as a string ("yyyy-MM"), so that it can be compared with the formatted bounds (the partitions are inferred
+    # when the dataset is loaded, so the setting is needed only here)
+    with session_conf(spark, "spark.sql.sources.partitionColumnTypeInference.enabled", "false"):
+        dataset = spark.read.parquet(path)
+
+    return dataset
+
+'''
+Description: Return the rows whose timestamp is in the interval (start, end]. If the dataset has the partition column,
+             the same interval is applied to it as well so that the months outside the interval are not read at all
+Args:
+    dataset: Dataset to be filtered
+    start: Lower bound (excluded), None for no lower bound
+    end: Upper bound (included), None for no upper bound
+Return:
+    dataset: Filtered dataset
+'''
+def filter_by_timestamp(dataset, start=None, end=None):
+    partitioned = PARTITION_COLUMN in dataset.columns
+
+    if start is not None:
+        dataset = dataset.filter(col("timestamp") > start)
+        if partitioned:
+            dataset = dataset.filter(col(PARTITION_COLUMN) >= start.strftime(PARTITION_STRFTIME_FORMAT))
+
+    if end is not None:
+        dataset = dataset.filter(col("timestamp") <= end)
+        if partitioned:
+            dataset = dataset.filter(col(PARTITION_COLUMN) <= end.strftime(PARTITION_STRFTIME_FORMAT))
+
+    return dataset
+
+'''
+Description: Return the first and the last timestamp of the dataset
+Args:
+    dataset: Dataset to be considered
+Return:
+    first_timestamp: First timestamp of the dataset
+    last_timestamp: Last timestamp of the dataset
+'''
+def timestamp_bounds(dataset):
+    bounds = dataset.agg(F.min("timestamp"), F.max("timestamp")).collect()[0]
+
+    return bounds[0], bounds[1]
+
+######################
+# --- RESOLUTION --- #
+######################
+
+'''
+Description: Upsample the daily dataset to the selected resolution by linear interpolation. The new rows are generated lazily
+             by Spark, so the interpolated dataset is never stored and it is produced only by the phases which need it
+Args:
+    dataset: Dataset with one row per day
+    resolution: Resolution of the returned dataset [1d | 15min]
+Return:
+    dataset: Upsampled dataset
+'''
+def upsample(dataset, resolution):
+    bars_per_day = BARS_PER_DAY[resolution]
+    if bars_per_day == 1:
+        return dataset
+
+    # Seconds between two consecutive bars
+    bar_seconds = 24 * 60 * 60 // bars_per_day
+
+    value_columns = [column for column in dataset.columns if column != "timestamp"]
+
+    # Pair each row with the next one (the data is daily, so the window is small)
+    window = Window.orderBy("timestamp")
+    for column in value_columns:
+        dataset = dataset.withColumn("next_" + column, F.lead(column).over(window))
+    dataset = dataset.withColumn("next_timestamp", F.lead("timestamp").over(window))
+
+    # Number of bars between the two rows (the last row has no next one, so it is kept as it is)
+    steps = F.coalesce(((col("next_timestamp").cast("long") - col("timestamp").cast("long")) / bar_seconds).cast("int"), F.lit(1))
+
+    # Generate one row for each bar
+    dataset = dataset.withColumn("steps", steps) \
+                     .withColumn("step", F.explode(F.sequence(F.lit(0), col("steps") - 1)))
+
+    # Interpolate the timestamp and the values of each bar
+    fraction = col("step") / col("steps")
+    interpolated_columns = [(col("timestamp").cast("long") + col("step") * bar_seconds).cast("timestamp").alias("timestamp")]
+    for column in value_columns:
+        interpolated_columns.append(
+            F.when(col("next_" + column).isNull(), col(column).cast("double"))
+             .otherwise(col(column) + (col("next_" + column) - col(column)) * fraction)
+             .alias(column)
+        )
+
+    return dataset.select(*interpolated_columns)
+
+'''
+Description: Convert a number of 15 minutes bars into the equivalent number of bars of the selected resolution
+Args:
+    bars: Number of 15 minutes bars
+    resolution: Resolution of the dataset [1d | 15min]
+Return:
+    bars: Number of bars at the selected resolution
+'''
+def rescale_bars(bars, resolution=DATASET_RESOLUTION):
+    return bars * BARS_PER_DAY[resolution] // BARS_PER_DAY["15min"]
+
+'''
+Description: Return the additional targets of the selected resolution (the horizons shorter than a bar or not a whole number of bars are skipped)
+Args:
+    resolution: Resolution of the dataset [1d | 15min]
+Return:
+    targets: Dictionary (horizon -> (target column, number of bars ahead))
+'''
+def horizon_targets(resolution=DATASET_RESOLUTION):
+    bar_minutes = 24 * 60 // BARS_PER_DAY[resolution]
+
+    return {
+        horizon: (TARGET_LABEL + "-" + horizon, minutes // bar_minutes)
+        for horizon, minutes in TARGET_HORIZONS.items() if minutes % bar_minutes == 0
+    }
+
+###############
+# --- IDS --- #
+###############
+
+'''
+Description: Add the "id" column (0, 1, 2, ...) following the order of the timestamps, without moving all the rows in a single partition.
+             If the timestamps are on a regular grid of the dataset resolution the id is computed directly from the timestamp,
+             otherwise the gaps are reported and the ids are computed from the number of rows of each partition (in this case the returned
+             dataset is cached, see assign_ids_by_partition)
+Args:
+    dataset: Dataset without the "id" column
+    resolution: Resolution of the dataset [1d | 15min]
+Return:
+    dataset: Dataset with the "id" column
+'''
+def assign_ids(dataset, resolution=DATASET_RESOLUTION):
+    # Seconds between two consecutive bars
+    bar_seconds = 24 * 60 * 60 // BARS_PER_DAY[resolution]
+    seconds = col("timestamp").cast("long")
+
+    # Check whether the timestamps are a regular grid
+    stats = dataset.agg(
+        F.min(seconds).alias("first"),
+        F.max(seconds).alias("last"),
+        F.count("*").alias("rows"),
+        F.countDistinct("timestamp").alias("distinct_rows"),
+        F.min(seconds % bar_seconds).alias("min_offset"),
+        F.max(seconds % bar_seconds).alias("max_offset")
+    ).collect()[0]
+
+    # Nothing to number (the bounds are null)
+    if stats["rows"] == 0:
+        return dataset.withColumn("id", F.lit(None).cast("long"))
+
+    expected_rows = (stats["last"] - stats["first"]) // bar_seconds + 1
+    regular_grid = stats["rows"] == stats["distinct_rows"] == expected_rows and stats["min_offset"] == stats["max_offset"]
+
+    if regular_grid:
+        # Each row is the n-th bar after the first one
+        return dataset.withColumn("id", ((seconds - stats["first"]) / bar_seconds).cast("long"))
+
+    print(f"The timestamps are not a regular {resolution} grid: {stats['rows']} rows ({stats['distinct_rows']} distinct) instead of {expected_rows}, the ids are assigned by partition")
+
+    return assign_ids_by_partition(dataset)
+
+'''
+Description: Add the "id" column following the order of the timestamps by computing the offset of each partition from the number of rows of the previous ones.
+             The returned dataset is cached (the ids must not change if it is computed again), the caller releases it with unpersist when it
+             is no longer needed
+Args:
+    dataset: Dataset without the "id" column
+Return:
+    dataset: Dataset with the "id" column (cached)
+'''
+def assign_ids_by_partition(dataset):
+    # Sort the rows (range partitioning, so the partitions are ordered too) and give them an increasing index inside each partition
+    indexed = dataset.orderBy("timestamp") \
+                     .withColumn("partition", F.spark_partition_id()) \
+                     .withColumn("partition_index", F.monotonically_increasing_id())
+
+    # The indexes must not change between the two jobs below
+    indexed.cache()
+
+    # Number of rows and first index of each partition
+    partitions = indexed.groupBy("partition") \
+                        .agg(F.count("*").alias("rows"), F.min("partition_index").alias("first_index")) \
+                        .orderBy("partition") \
+                        .collect()
+
+    # Offset of each partition
+    offsets = {}
+    rows = 0
+    for partition in partitions:
+        offsets[partition["partition"]] = rows - partition["first_index"]
+        rows += partition["rows"]
+
+    offset = F.create_map(*[value for partition, partition_offset in offsets.items() for value in (F.lit(partition), F.lit(partition_offset).cast("long"))])
+
+    dataset = indexed.withColumn("id", col("partition_index") + offset[col("partition")]) \
+                     .drop("partition", "partition_index")
+
+    # Keep only the dataset with the ids: it is cached and computed before the sorted rows are released
+    dataset.cache()
+    dataset.count()
+    indexed.unpersist()
+
+    return dataset
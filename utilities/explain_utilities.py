@@ -0,0 +1,381 @@
+from imports import *
+from config import *
+from collection_utilities import collect_pandas
+from registry_utilities import load_registry, get_model_params
+
+# Saved tree ensembles which can be explained, with the way the predictions of their trees are combined
+tree_ensembles = {
+    "org.apache.spark.ml.regression.RandomForestRegressionModel": "mean",
+    "org.apache.spark.ml.regression.GBTRegressionModel": "sum"
+}
+
+#################
+# --- TREES --- #
+#################
+
+'''
+Description: Read the metadata of a saved Spark ML object (class, parameters and, for the pipelines, the ids of the stages)
+Args:
+    path: Path of the saved object
+Return:
+    metadata: Dictionary of the metadata
+'''
+def read_metadata(path):
+    with open(path + "/metadata/part-00000") as file:
+        return json.loads(file.readline())
+
+'''
+Description: Return the path and the metadata of the tree ensemble of a saved pipeline model (a directory can contain the stages of the
+             previous saves too, only the one listed in the metadata of the pipeline is used)
+Args:
+    model_path: Path of the pipeline model
+Return:
+    stage_path: Path of the tree ensemble
+    metadata: Metadata of the tree ensemble
+'''
+def ensemble_stage(model_path):
+    stage_uids = read_metadata(model_path)["paramMap"]["stageUids"]
+
+    for idx, uid in enumerate(stage_uids):
+        stage_path = model_path + "/stages/" + str(idx) + "_" + uid
+        metadata = read_metadata(stage_path)
+        if metadata["class"] in tree_ensembles:
+            return stage_path, metadata
+
+    raise ValueError(f"The model in {model_path} has no random forest or gradient boosted trees stage")
+
+'''
+Description: Load the trees of a saved random forest or gradient boosted trees model into flattened arrays (as the ones of the histogram gradient
+             boosting), without Spark: the node data is read from the parquet files of the model. The values of each tree are multiplied by
+             its weight in the ensemble, so the prediction is the sum of the leaves reached in all the trees
+Args:
+    model_path: Path of the pipeline model
+Return:
+    trees: Dictionary of the flattened arrays of the nodes (feature, threshold, left, right, value, cover, -1 as feature for the leaves)
+           and the root of each tree, the rows go left when their feature is lower or equal to the threshold (as in Spark)
+'''
+def load_trees(model_path):
+    stage_path, metadata = ensemble_stage(model_path)
+
+    data = pd.read_parquet(stage_path + "/data")
+    weights = pd.read_parquet(stage_path + "/treesMetadata").set_index("treeID")["weights"]
+
+    # The nodes of each tree are saved with consecutive ids in preorder
+    nodes = pd.DataFrame(list(data["nodeData"]))
+    nodes["treeID"] = data["treeID"].to_numpy()
+    nodes = nodes.sort_values(["treeID", "id"], ignore_index=True)
+
+    tree_ids, tree_sizes = np.unique(nodes["treeID"].to_numpy(), return_counts=True)
+    roots = np.concatenate([[0], np.cumsum(tree_sizes)[:-1]])
+    offsets = np.repeat(roots, tree_sizes)
+    if not np.array_equal(nodes["id"].to_numpy(), np.arange(len(nodes)) - offsets):
+        raise ValueError(f"The trees in {stage_path} don't have consecutive node ids")
+
+    # The leaves have an empty split
+    leaf = nodes["leftChild"].to_numpy() < 0
+    splits = [None if is_leaf else split for is_leaf, split in zip(leaf, nodes["split"])]
+    if any(split["numCategories"] != -1 for split in splits if split is not None):
+        raise ValueError(f"The trees in {stage_path} have categorical splits, which are not supported")
+
+    # The random forest averages its trees, the gradient boosting adds them (the first one with weight 1, the other ones with the step size)
+    scale = weights.loc[tree_ids].to_numpy() / (len(tree_ids) if tree_ensembles[metadata["class"]] == "mean" else 1)
+
+    trees = {
+        "feature": np.array([split["featureIndex"] if split is not None else -1 for split in splits], dtype=np.int64),
+        "threshold": np.array([split["leftCategoriesOrThreshold"][0] if split is not None else 0.0 for split in splits], dtype=float),
+        "left": np.where(leaf, -1, nodes["leftChild"].to_numpy() + offsets),
+        "right": np.where(leaf, -1, nodes["rightChild"].to_numpy() + offsets),
+        "value": nodes["prediction"].to_numpy() * np.repeat(scale, tree_sizes),
+        "cover": np.array([stats[0] for stats in nodes["impurityStats"]], dtype=float), # Weighted number of train rows of each node
+        "roots": roots
+    }
+
+    return trees
+
+'''
+Description: Return the predictions of the trees (the sum of the leaves reached in all the trees)
+Args:
+    x: Features values (rows x features)
+    trees: Flattened arrays of the trees (as returned by load_trees)
+Return:
+    predictions: Predictions of the rows
+'''
+def predict_ensemble(x, trees):
+    nodes = np.broadcast_to(trees["roots"], (len(x), len(trees["roots"]))).copy()
+
+    while True:
+        feature = trees["feature"][nodes]
+        internal = feature >= 0
+        if not internal.any():
+            break
+
+        rows, columns = np.nonzero(internal)
+        current = nodes[rows, columns]
+        go_left = x[rows, feature[rows, columns]] <= trees["threshold"][current]
+        nodes[rows, columns] = np.where(go_left, trees["left"][current], trees["right"][current])
+
+    return trees["value"][nodes].sum(axis=1)
+
+'''
+Description: Return the expected value of the trees, the prediction when no feature is known (the mean of the leaves weighted by their cover)
+Args:
+    trees: Flattened arrays of the trees (as returned by load_trees)
+Return:
+    expected_value: Expected value of the predictions
+'''
+def expected_value(trees):
+    tree_of_node = np.searchsorted(trees["roots"], np.arange(len(trees["feature"])), side="right") - 1
+    leaves = trees["feature"] < 0
+
+    return float(np.sum(trees["value"][leaves] * trees["cover"][leaves] / trees["cover"][trees["roots"]][tree_of_node[leaves]]))
+
+####################
+# --- TREESHAP --- #
+####################
+
+# The paths of TreeSHAP (Lundberg et al., Consistent individualized feature attribution for tree ensembles, algorithm 2) are walked for a batch
+# of rows at once: the features and the zero fractions of a path only depend on the tree, while the one fractions and the weights of the
+# permutations depend on the row, so they are arrays of path length x rows (the rows of each element of the path are contiguous)
+
+'''
+Description: Extend a path with a new split
+Args:
+    path: Features, zero fractions, one fractions (length x rows) and weights (length x rows) of the path
+    feature: Feature of the split
+    zero_fraction: Fraction of the train rows going through the split
+    one_fraction: Rows going through the split (1 or 0 for each row)
+Return:
+    path: Extended path
+'''
+def extend_path(path, feature, zero_fraction, one_fraction):
+    features, zeros, ones, weights = path
+    length = len(features)
+
+    extended = np.empty((length + 1, len(one_fraction)))
+    if length == 0:
+        extended[0] = 1.0
+    else:
+        positions = np.arange(length)
+        np.multiply(weights, (zero_fraction * (length - positions) / (length + 1))[:, None], out=extended[:length])
+        extended[length] = 0.0
+        extended[1:] += one_fraction * (weights * ((positions + 1) / (length + 1))[:, None])
+
+    return features + [feature], zeros + [zero_fraction], np.vstack([ones, one_fraction]), extended
+
+'''
+Description: Remove a split from a path (when the same feature is split again deeper in the tree)
+Args:
+    path: Features, zero fractions, one fractions and weights of the path
+    i: Position of the split in the path
+Return:
+    path: Path without the split
+'''
+def unwind_path(path, i):
+    features, zeros, ones, weights = path
+    length = len(features) - 1
+    zero_fraction, one_fraction = zeros[i], ones[i] != 0
+
+    # The rows which don't go through the split are unwound in closed form, the other ones by the recurrence of the algorithm
+    positions = np.arange(length)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        unwound = weights[:length] * ((length + 1) / (zero_fraction * (length - positions)))[:, None]
+
+    next_weight = weights[length]
+    for j in range(length - 1, -1, -1):
+        hot = next_weight * ((length + 1) / (j + 1))
+        next_weight = weights[j] - hot * (zero_fraction * (length - j) / (length + 1))
+        unwound[j] = np.where(one_fraction, hot, unwound[j])
+
+    return features[:i] + features[i + 1:], zeros[:i] + zeros[i + 1:], np.delete(ones, i, axis=0), unwound
+
+'''
+Description: Return the total weight of the permutations of a path with each of its splits removed (all the splits of the path at once)
+Args:
+    path: Features, zero fractions, one fractions and weights of the path
+Return:
+    sums: Total weights (splits of the path x rows, the first element of the path is not a split)
+'''
+def unwound_sums(path):
+    features, zeros, ones, weights = path
+    length = len(features) - 1
+    zero_fraction, one_fraction = np.array(zeros[1:])[:, None], ones[1:] != 0
+
+    # Without the split the sum is the same for all the splits of the path up to their zero fraction, with it the recurrence is run for all of them
+    hot_sums = np.zeros((length, weights.shape[1]))
+    next_weight = np.broadcast_to(weights[length], hot_sums.shape)
+    for j in range(length - 1, -1, -1):
+        hot = next_weight * ((length + 1) / (j + 1))
+        hot_sums += hot
+        next_weight = weights[j] - hot * (zero_fraction * ((length - j) / (length + 1)))
+
+    cold_sum = ((length + 1) / (length - np.arange(length))) @ weights[:length]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sums = np.where(one_fraction, hot_sums, cold_sum / zero_fraction)
+
+    return sums
+
+'''
+Description: Add to the SHAP values the contributions of the leaves below a node
+Args:
+    x: Features values (rows x features)
+    trees: Flattened arrays of the trees
+    node: Node to be visited
+    path: Path from the root to the parent of the node
+    zero_fraction: Fraction of the train rows of the parent going to the node
+    one_fraction: Rows of the batch going to the node (1 or 0 for each row)
+    feature: Feature of the split of the parent
+    phi: SHAP values (features x rows), updated in place
+Return: None
+'''
+def visit_node(x, trees, node, path, zero_fraction, one_fraction, feature, phi):
+    path = extend_path(path, feature, zero_fraction, one_fraction)
+    features, zeros, ones, _ = path
+    split = trees["feature"][node]
+
+    if split < 0:
+        if len(features) > 1:
+            # A feature appears at most once in the path, so its contribution is added with a single assignment
+            phi[features[1:]] += unwound_sums(path) * (ones[1:] - np.array(zeros[1:])[:, None]) * trees["value"][node]
+        return
+
+    # A feature already split above is removed from the path, its fractions are carried to the children
+    zero_fraction, one_fraction = 1.0, np.ones(len(x))
+    if split in features[1:]:
+        i = features.index(split, 1)
+        zero_fraction, one_fraction = zeros[i], ones[i]
+        path = unwind_path(path, i)
+
+    go_left = x[:, split] <= trees["threshold"][node]
+    for child, go_child in ((trees["left"][node], go_left), (trees["right"][node], ~go_left)):
+        visit_node(x, trees, child, path, zero_fraction * trees["cover"][child] / trees["cover"][node], one_fraction * go_child, split, phi)
+
+'''
+Description: Return the exact SHAP values of a batch of rows (path dependent TreeSHAP, the features which are not known follow the train rows
+             of the trees), all the rows of the batch walk the paths of the trees together. The time is polynomial in the depth of the trees
+Args:
+    x: Features values (rows x features)
+    trees: Flattened arrays of the trees (as returned by load_trees)
+Return:
+    phi: SHAP values (rows x features), for each row their sum plus the expected value of the trees is its prediction
+'''
+def tree_shap(x, trees):
+    x = np.asarray(x, dtype=float)
+    phi = np.zeros((x.shape[1], len(x)))
+    empty_path = ([], [], np.empty((0, len(x))), np.empty((0, len(x))))
+
+    for root in trees["roots"]:
+        visit_node(x, trees, root, empty_path, 1.0, np.ones(len(x)), -1, phi)
+
+    return phi.T.copy()
+
+'''
+Description: Return the exact SHAP values of many rows, the batches of rows are explained in parallel by several processes
+Args:
+    x: Features values (rows x features)
+    trees: Flattened arrays of the trees (as returned by load_trees)
+    batch_rows: Rows explained at once by each process
+    workers: Number of processes (None for all the cores)
+Return:
+    phi: SHAP values (rows x features)
+'''
+def shap_values(x, trees, batch_rows=SHAP_BATCH_ROWS, workers=SHAP_WORKERS):
+    x = np.asarray(x, dtype=float)
+    batches = [x[start:start + batch_rows] for start in range(0, len(x), batch_rows)]
+    workers = builtins.min(workers or os.cpu_count(), len(batches))
+
+    if workers <= 1:
+        return np.concatenate([tree_shap(batch, trees) for batch in batches]) if batches else np.zeros(x.shape)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return np.concatenate(list(executor.map(tree_shap, batches, [trees] * len(batches))))
+
+###################
+# --- EXPLAIN --- #
+###################
+
+'''
+Description: Return the features values of the rows of a dataset as the model sees them (in its order and, if the model uses normalized features,
+             scaled to unit L2 norm as by the Normalizer of the training)
+Args:
+    dataset: Spark or Pandas dataset containing the features
+    features: List of the features of the model
+    normalization: Indicates whether the features of the model are normalized or not
+Return:
+    x: Features values (rows x features)
+'''
+def model_inputs(dataset, features, normalization):
+    x = collect_pandas(dataset.select(*features) if not isinstance(dataset, pd.DataFrame) else dataset[features], "explained rows")[features].to_numpy(dtype=float)
+
+    if normalization:
+        norms = np.linalg.norm(x, axis=1, keepdims=True)
+        x = np.divide(x, norms, out=np.zeros_like(x), where=norms > 0)
+
+    return x
+
+'''
+Description: Explain the predictions of a registered random forest or gradient boosted trees model on the rows of a dataset
+Args:
+    models_dir: Directory containing the models and the registry
+    entry: Registered model
+    dataset: Spark or Pandas dataset containing the features (and the timestamp)
+Return:
+    explanations: Pandas dataset with the SHAP value of each feature for each row (and its timestamp), the prediction of the row is the sum of
+                  its SHAP values plus the expected value
+    expected_value: Prediction of the model when no feature is known
+'''
+def explain_model(models_dir, entry, dataset):
+    model_params = get_model_params(models_dir, entry)
+    trees = load_trees(model_params["Model_path"])
+
+    # The features and the timestamp are collected together, so that they are in the same order (the rows of a Spark dataset are not ordered)
+    columns = model_params["Features"] + (["timestamp"] if "timestamp" in dataset.columns else [])
+    rows = dataset[columns] if isinstance(dataset, pd.DataFrame) else collect_pandas(dataset.select(*columns), "explained rows")
+
+    x = model_inputs(rows, model_params["Features"], model_params["Normalization"])
+    explanations = pd.DataFrame(shap_values(x, trees), columns=model_params["Features"])
+
+    if "timestamp" in rows.columns:
+        explanations.insert(0, "timestamp", rows["timestamp"].to_numpy())
+
+    return explanations, expected_value(trees)
+
+'''
+Description: Return the global importance of the features of the registered tree models, for each model and features set (the latest version of each),
+             as the mean absolute SHAP value of each feature on a sample of the rows of a dataset
+Args:
+    models_dir: Directory containing the models and the registry
+    dataset: Spark dataset containing the features
+    model_names: Names of the models to be explained
+    sample_rows: Rows sampled from the dataset (all the rows if it is smaller)
+Return:
+    importance: Pandas dataset with one row per model, features set and feature (Mean_abs_SHAP and its share of the model total, in percent),
+                the most important features first
+'''
+def global_importance(models_dir, dataset, model_names=[RF_MODEL_NAME, GBTR_MODEL_NAME], sample_rows=SHAP_SAMPLE_ROWS):
+    # Latest version of each model and features set
+    entries = {}
+    for entry in load_registry(models_dir):
+        key = (entry["Model_name"], entry["Features_label"])
+        if entry["Model_name"] in model_names and (key not in entries or entry["Version"] > entries[key]["Version"]):
+            entries[key] = entry
+
+    # The same rows are explained for all the models
+    num = dataset.count()
+    sample = dataset.sample(fraction=builtins.min(1.0, sample_rows / builtins.max(num, 1)), seed=RANDOM_SEED) if num > sample_rows else dataset
+    sample = collect_pandas(sample.select(*sorted(set(feature for entry in entries.values() for feature in entry["Features"]))), "explained sample")
+
+    importance = []
+    for (model_name, features_label), entry in sorted(entries.items()):
+        explanations, _ = explain_model(models_dir, entry, sample)
+        mean_abs = explanations[entry["Features"]].abs().mean()
+
+        for feature, value in mean_abs.sort_values(ascending=False).items():
+            importance.append({
+                "Model": model_name,
+                "Features": features_label,
+                "Feature": feature,
+                "Mean_abs_SHAP": value,
+                "Share": value / mean_abs.sum() * 100 if mean_abs.sum() > 0 else 0.0
+            })
+
+    return pd.DataFrame(importance)
@@ -1,5 +1,6 @@
 from imports import *
 from config import *
+from plotting_utilities import show_time_series
 
 ###################
 # --- COMMONS --- #
@@ -30,263 +31,232 @@ def dataset_info(dataset):
 '''
 Description: Plot the division of the main dataset
 Args:
-    train_valid: Train / validation portion of the dataset 
-    test: Test portion of the dataset 
+    train_valid: Train / validation portion of the dataset (Spark or Pandas)
+    test: Test portion of the dataset (Spark or Pandas)
     title: Chart title
 Return: None
 '''
 def dataset_visualization(train_valid, test, title):
-    trace1 = go.Scatter(
-        x = train_valid['timestamp'],
-        y = train_valid["market-price"].astype(float),
-        mode = 'lines',
-        name = "Train / Validation set"
-    )
-
-    trace2 = go.Scatter(
-        x = test['timestamp'],
-        y = test['market-price'].astype(float),
-        mode = 'lines',
-        name = "Test set"
-    )
-
-    layout = go.Layout(
-        title=title,
-        xaxis=dict(
-            rangeselector=dict(
-                buttons=list([
-                    # Change the count to desired amount of months.
-                    dict(count=1,
-                        label='1m',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=6,
-                        label='6m',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=12,
-                        label='1y',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=36,
-                        label='3y',
-                        step='month',
-                        stepmode='backward'),
-                    dict(step='all')
-                ])
-            ),
-            rangeslider=dict(
-                visible = True
-            ),
-            type='date'
-        )
-    )
+    traces = [
+        (train_valid, "market-price", "Train / Validation set"),
+        (test, "market-price", "Test set")
+    ]
 
-    data = [trace1, trace2]
-    fig = go.Figure(data=data, layout=layout)
-    fig.show()
+    show_time_series(traces, title)
 
 '''
 Description: Plot the ohlcv features
 Args:
-    dataset: Dataset to be considered
+    dataset: Dataset to be considered (Spark or Pandas)
     features: List of ohlcv features
     title: Chart title
 Return: None
 '''
 def ohlc_visualization(dataset, features, title):
-    trace1 = go.Scatter(
-        x = dataset['timestamp'],
-        y = dataset["market-price"].astype(float),
-        mode = 'lines',
-        name = "Market price (usd)"
-    )
-
-    trace2 = go.Scatter(
-        x = dataset['timestamp'],
-        y = dataset[features[0][1]].astype(float),
-        mode = 'lines',
-        name = features[0][0]
-    )
-
-    trace3 = go.Scatter(
-        x = dataset['timestamp'],
-        y = dataset[features[1][1]].astype(float),
-        mode = 'lines',
-        name = features[1][0]
-    )
+    traces = [(dataset, "market-price", "Market price (usd)")] + [(dataset, value, key) for key, value in features[:4]]
 
-    trace4 = go.Scatter(
-        x = dataset['timestamp'],
-        y = dataset[features[2][1]].astype(float),
-        mode = 'lines',
-        name = features[2][0]
-    )
-
-    trace5 = go.Scatter(
-        x = dataset['timestamp'],
-        y = dataset[features[3][1]].astype(float),
-        mode = 'lines',
-        name = features[3][0]
-    )
-
-    layout = go.Layout(
-        title=title,
-        xaxis=dict(
-            rangeselector=dict(
-                buttons=list([
-                    # Change the count to desired amount of months.
-                    dict(count=1,
-                        label='1m',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=6,
-                        label='6m',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=12,
-                        label='1y',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=36,
-                        label='3y',
-                        step='month',
-                        stepmode='backward'),
-                    dict(step='all')
-                ])
-            ),
-            rangeslider=dict(
-                visible = True
-            ),
-            type='date'
-        )
-    )
-
-    data = [trace1, trace2, trace3, trace4, trace5]
-    fig = go.Figure(data=data, layout=layout)
-    fig.show()
+    show_time_series(traces, title)
 
 '''
 Description: Plot the selected feature
 Args:
-    dataset: Dataset to be considered
+    dataset: Dataset to be considered (Spark or Pandas)
     key: Title of the feature to be inserted in the graph
     value: Title of the feature contained in the dataset
 Return: None
 '''
 def features_visualization(dataset, key, value):
-    trace = go.Scatter(
-        x = dataset['timestamp'],
-        y = dataset[value].astype(float),
-        mode = 'lines',
-        name = key
-    )
-
-    layout = dict(
-        title=key,
-        xaxis=dict(
-            rangeselector=dict(
-                buttons=list([
-                    # Change the count to desired amount of months.
-                    dict(count=1,
-                        label='1m',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=6,
-                        label='6m',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=12,
-                        label='1y',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=36,
-                        label='3y',
-                        step='month',
-                        stepmode='backward'),
-                    dict(step='all')
-                ])
-            ),
-            rangeslider=dict(
-                visible = True
-            ),
-            type='date'
-        )
-    )
-
-    data = [trace]
-    fig = go.Figure(data=data, layout=layout)
-    fig.show()
+    show_time_series([(dataset, value, key)], key)
 
 '''
 Description: Plot the sma features
 Args:
-    dataset: Dataset to be considered
+    dataset: Dataset to be considered (Spark or Pandas)
     features: List of sma features
     title: Chart title
 Return: None
 '''
 def sma_visualization(dataset, features, title):
-    trace1 = go.Scatter(
-        x = dataset['timestamp'],
-        y = dataset["market-price"].astype(float),
-        mode = 'lines',
-        name = "Market price (usd)"
-    )
+    traces = [(dataset, "market-price", "Market price (usd)")] + [(dataset, value, key) for key, value in features[:3]]
 
-    trace2 = go.Scatter(
-        x = dataset['timestamp'],
-        y = dataset[features[0][1]].astype(float),
-        mode = 'lines',
-        name = features[0][0]
-    )
+    show_time_series(traces, title)
 
-    trace3 = go.Scatter(
-        x = dataset['timestamp'],
-        y = dataset[features[1][1]].astype(float),
-        mode = 'lines',
-        name = features[1][0]
-    )
+######################
+# --- INDICATORS --- #
+######################
 
-    trace4 = go.Scatter(
-        x = dataset['timestamp'],
-        y = dataset[features[2][1]].astype(float),
-        mode = 'lines',
-        name = features[2][0]
-    )
+'''
+Description: Return the names of the columns of the technical indicators
+Args:
+    indicators: Dictionary (indicator -> list of periods, as INDICATORS)
+Return:
+    columns: List of the columns names
+'''
+def indicator_columns(indicators):
+    columns = []
+    for days in indicators.get("ema", []):
+        columns.append(f"ema-{days}-days")
+    for days in indicators.get("rsi", []):
+        columns.append(f"rsi-{days}-days")
+    for fast, slow, signal in indicators.get("macd", []):
+        columns += [f"macd-{fast}-{slow}-days", f"macd-signal-{fast}-{slow}-{signal}-days", f"macd-histogram-{fast}-{slow}-{signal}-days"]
+    for days, deviations in indicators.get("bollinger", []):
+        columns += [f"bollinger-upper-{days}-days", f"bollinger-lower-{days}-days"]
+    for days in indicators.get("volatility", []):
+        columns.append(f"volatility-{days}-days")
+    for days in indicators.get("log-return", []):
+        columns.append(f"log-return-{days}-days")
 
-    layout = go.Layout(
-        title=title,
-        xaxis=dict(
-            rangeselector=dict(
-                buttons=list([
-                    # Change the count to desired amount of months.
-                    dict(count=1,
-                        label='1m',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=6,
-                        label='6m',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=12,
-                        label='1y',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=36,
-                        label='3y',
-                        step='month',
-                        stepmode='backward'),
-                    dict(step='all')
-                ])
-            ),
-            rangeslider=dict(
-                visible = True
-            ),
-            type='date'
-        )
+    return columns
+
+'''
+Description: Return the longest period of the technical indicators in days (the MACD signal is computed on the slow moving average)
+Args:
+    indicators: Dictionary (indicator -> list of periods, as INDICATORS)
+Return:
+    days: Longest period
+'''
+def longest_period(indicators):
+    periods = indicators.get("ema", []) + indicators.get("rsi", []) + indicators.get("volatility", []) + indicators.get("log-return", [])
+    periods += [slow + signal for _, slow, signal in indicators.get("macd", [])]
+    periods += [days for days, _ in indicators.get("bollinger", [])]
+
+    return builtins.max(periods, default=0)
+
+'''
+Description: Compute the technical indicators of a chunk of consecutive rows with vectorized kernels. The recursive indicators (EMA, RSI, MACD)
+             start from the first row of the chunk, so the halo rows before it make them match the ones computed on the whole series
+Args:
+    prices: NumPy array of the prices (ordered by time)
+    indicators: Dictionary (indicator -> list of periods, as INDICATORS)
+    bars_per_day: Number of bars per day of the dataset resolution
+Return:
+    values: Dictionary (column name -> NumPy array of the indicator)
+'''
+def compute_indicators(prices, indicators, bars_per_day):
+    price = pd.Series(prices, dtype="float64")
+    log_price = np.log(price)
+    returns = log_price.diff().fillna(0.0)
+
+    values = {}
+    for days in indicators.get("ema", []):
+        values[f"ema-{days}-days"] = price.ewm(span=days * bars_per_day, adjust=False).mean()
+
+    for days in indicators.get("rsi", []):
+        # Wilder's smoothing of the gains and of the losses
+        change = price.diff().fillna(0.0)
+        gain = change.clip(lower=0).ewm(alpha=1 / (days * bars_per_day), adjust=False).mean()
+        loss = (-change).clip(lower=0).ewm(alpha=1 / (days * bars_per_day), adjust=False).mean()
+        rsi = 100 - 100 / (1 + gain / loss)
+        values[f"rsi-{days}-days"] = rsi.where(loss > 0, np.where(gain > 0, 100.0, 50.0))
+
+    for fast, slow, signal in indicators.get("macd", []):
+        macd = price.ewm(span=fast * bars_per_day, adjust=False).mean() - price.ewm(span=slow * bars_per_day, adjust=False).mean()
+        macd_signal = macd.ewm(span=signal * bars_per_day, adjust=False).mean()
+        values[f"macd-{fast}-{slow}-days"] = macd
+        values[f"macd-signal-{fast}-{slow}-{signal}-days"] = macd_signal
+        values[f"macd-histogram-{fast}-{slow}-{signal}-days"] = macd - macd_signal
+
+    for days, deviations in indicators.get("bollinger", []):
+        # Same window of the simple moving averages (the current row and the previous period)
+        rolling = price.rolling(days * bars_per_day + 1, min_periods=1)
+        mean = rolling.mean()
+        std = rolling.std(ddof=0)
+        values[f"bollinger-upper-{days}-days"] = mean + deviations * std
+        values[f"bollinger-lower-{days}-days"] = mean - deviations * std
+
+    for days in indicators.get("volatility", []):
+        values[f"volatility-{days}-days"] = returns.rolling(days * bars_per_day, min_periods=2).std().fillna(0.0)
+
+    for days in indicators.get("log-return", []):
+        values[f"log-return-{days}-days"] = (log_price - log_price.shift(days * bars_per_day)).fillna(0.0)
+
+    return {column: value.to_numpy() for column, value in values.items()}
+
+'''
+Description: Add some columns computed on chunks of consecutive rows in a single pass. The rows are divided into chunks of consecutive ids and each chunk
+             also receives the halo rows preceding and following it, then each chunk is processed at once as a Pandas dataset (Arrow batches),
+             so the columns which can't be expressed as Spark window functions don't need all the rows in a single partition
+Args:
+    dataset: Dataset with the "id" column
+    compute: Function returning the new columns of a chunk (Pandas dataset ordered by id -> dictionary (column name -> NumPy array))
+    columns: Names of the new columns
+    halo_before: Number of rows preceding each chunk needed to compute its columns
+    halo_after: Number of rows following each chunk needed to compute its columns
+Return:
+    dataset: Dataset with the new columns
+'''
+def apply_by_chunks(dataset, compute, columns, halo_before=0, halo_after=0):
+    chunk_rows = builtins.max(INDICATORS_CHUNK_ROWS, halo_before, halo_after) # The halo rows of a chunk all come from the adjacent ones
+
+    schema = StructType(dataset.schema.fields + [StructField(column, DoubleType()) for column in columns])
+    output_columns = dataset.columns + columns
+
+    # Each row belongs to its chunk and it is also a halo row of the next chunk (if it is among the last rows of its chunk)
+    # and of the previous one (if it is among the first rows of its chunk)
+    chunk = F.floor(col("id") / chunk_rows)
+    position = col("id") - chunk * chunk_rows
+    chunks = F.array(
+        chunk,
+        F.when(position >= chunk_rows - halo_before, chunk + 1),
+        F.when((position < halo_after) & (chunk > 0), chunk - 1)
     )
+    chunked = dataset.withColumn("chunk", F.explode(F.filter(chunks, lambda value: value.isNotNull())))
+
+    def chunk_columns(rows):
+        rows = rows.sort_values("id", ignore_index=True)
+        for column, values in compute(rows).items():
+            rows[column] = values
+
+        # Drop the halo rows
+        return rows[rows["id"] // chunk_rows == rows["chunk"]][output_columns]
+
+    return chunked.groupBy("chunk").applyInPandas(chunk_columns, schema)
+
+'''
+Description: Add the technical indicators of the market price in a single pass over chunks of consecutive rows. The recursive indicators
+             start from the first halo row, which makes them match the ones computed on the whole series
+Args:
+    dataset: Dataset with the "id" column
+    indicators: Dictionary (indicator -> list of periods, as INDICATORS)
+    resolution: Resolution of the dataset [1d | 15min]
+    price_column: Column used to compute the indicators
+Return:
+    dataset: Dataset with the indicators columns
+'''
+def add_indicators(dataset, indicators=INDICATORS, resolution=DATASET_RESOLUTION, price_column="market-price"):
+    bars_per_day = BARS_PER_DAY[resolution]
+    halo = INDICATORS_HALO_FACTOR * longest_period(indicators) * bars_per_day
+
+    compute = lambda rows: compute_indicators(rows[price_column].to_numpy(), indicators, bars_per_day)
+
+    return apply_by_chunks(dataset, compute, indicator_columns(indicators), halo_before=halo)
+
+'''
+Description: Add the targets of all the horizons (the price some bars ahead) in a single pass over chunks of consecutive rows, instead of
+             one window over the whole dataset for each horizon. The last rows of the dataset have no target for the longest horizons (null)
+Args:
+    dataset: Dataset with the "id" column
+    targets: Dictionary (horizon -> (target column, number of bars ahead), as returned by horizon_targets)
+    price_column: Column to be predicted
+Return:
+    dataset: Dataset with the targets columns
+'''
+def add_horizon_targets(dataset, targets, price_column="market-price"):
+    compute = lambda rows: {column: rows[price_column].shift(-bars).to_numpy() for column, bars in targets.values()}
+    halo = builtins.max([bars for _, bars in targets.values()], default=0)
+
+    return apply_by_chunks(dataset, compute, [column for column, _ in targets.values()], halo_after=halo)
+
+'''
+Description: Plot the technical indicators
+Args:
+    dataset: Dataset to be considered (Spark or Pandas)
+    features: List of indicators features
+    title: Chart title
+Return: None
+'''
+def indicators_visualization(dataset, features, title):
+    traces = [(dataset, value, key) for key, value in features]
 
-    data = [trace1, trace2, trace3, trace4]
-    fig = go.Figure(data=data, layout=layout)
-    fig.show()
\ No newline at end of file
+    show_time_series(traces, title)
@@ -1,5 +1,9 @@
 from imports import *
 from config import *
+from dataset_utilities import filter_by_timestamp
+from plotting_utilities import show_time_series, queue_image
+from registry_utilities import load_model
+from collection_utilities import collect_pandas
 
 #############################
 # --- USEFUL PARAMETERS --- #
@@ -12,7 +16,7 @@ type_order = ["Default", "Tuned"]
 # Define the order for 'Splitting', 'Dataset', 'Model' columns
 splitting_order = ['Block splits', 'Walk-forward splits', 'Single split']
 features_order = ['Base features', 'Base + most corr. features', 'Base + least corr. features', 'Base features (norm.)', 'Base + most corr. features (norm.)', 'Base + least corr. features (norm.)']
-model_order = ['LR', 'GLR', 'RF', 'GBTR']
+model_order = ['LR', 'GLR', 'RF', 'GBTR', 'HGBT']
 dataset_order = ['One week', 'Fifteen days', 'One month', 'Three months']
 
 # Mapping for models names
@@ -21,6 +25,7 @@ model_mapping = {
     "GeneralizedLinearRegression": "GLR",
     "RandomForestRegressor": "RF",
     "GradientBoostingTreeRegressor": "GBTR",
+    "HistGradientBoostingRegressor": "HGBT",
 }
 
 # Mapping for type names
@@ -81,55 +86,6 @@ def dataset_info(dataset):
   # Print the schema of the dataset
   dataset.printSchema()
 
-''' 
-Description: Retrieves all results obtained during the train/validation phase
-Args:
-    splits_list: List of splitting methods used
-    models_list: List of models used
-    result_dir: Directory containing the results
-Return:
-    dataset: Dataset containing all results obtained during the train/validation phase
-'''
-def get_all_results(splits_list, models_list, result_dir):
-    dataset = pd.DataFrame(columns=['Model', 'Type', 'Dataset', 'Splitting', 'Features', 'Parameters', 'RMSE', 'MSE', 'MAE', 'MAPE', 'R2', 'Adjusted_R2', 'Time'])
-
-    for split in splits_list:
-        for model in models_list:
-            if split == splits_list[0]: # block_splits
-                dataset = pd.concat([dataset, pd.read_csv(result_dir + "/" + split + "/" + model + "_all.csv")], ignore_index=True)
-            elif split == splits_list[1]: # walk_forward_splits
-                dataset = pd.concat([dataset, pd.read_csv(result_dir + "/" + split + "/" + model + "_all.csv")], ignore_index=True)
-            elif split == splits_list[2]: # single_split
-                dataset = pd.concat([dataset, pd.read_csv(result_dir + "/" + split + "/" + model + "_all.csv")], ignore_index=True)
-    
-    return dataset
-
-''' 
-Description: Retrieves all the most relevant results obtained during the train/validation phase (those of the best default model and the tuned model)
-Args:
-    splits_list: List of splitting methods used
-    models_list: List of models used
-    result_dir: Directory containing the results
-Return:
-    dataset: Dataset containing all results obtained during the train/validation phase
-'''
-def get_rel_results(splits_list, models_list, result_dir):
-    results = pd.DataFrame(columns=['Model', 'Type', 'Dataset', 'Splitting', 'Features', 'Parameters', 'RMSE', 'MSE', 'MAE', 'MAPE', 'R2', 'Adjusted_R2', 'Time'])
-    accuracy = pd.DataFrame(columns=['Model', 'Features', 'Splitting', 'Accuracy (default)', 'Accuracy (tuned)'])
-    for split in splits_list:
-        for model in models_list:
-            if split == splits_list[0]: # block_splits
-                results = pd.concat([results, pd.read_csv(result_dir + "/" + split + "/" + model + "_rel.csv")], ignore_index=True)
-                accuracy = pd.concat([accuracy, pd.read_csv(result_dir + "/" + split + "/" + model + "_accuracy.csv")], ignore_index=True)
-            elif split == splits_list[1]: # walk_forward_splits
-                results = pd.concat([results, pd.read_csv(result_dir + "/" + split + "/" + model + "_rel.csv")], ignore_index=True)
-                accuracy = pd.concat([accuracy, pd.read_csv(result_dir + "/" + split + "/" + model + "_accuracy.csv")], ignore_index=True)
-            elif split == splits_list[2]: # single_split
-                results = pd.concat([results, pd.read_csv(result_dir + "/" + split + "/" + model + "_rel.csv")], ignore_index=True)
-                accuracy = pd.concat([accuracy, pd.read_csv(result_dir + "/" + split + "/" + model + "_accuracy.csv")], ignore_index=True)
-    
-    return results, accuracy
-
 '''
 Description: Return the dataset containing the train/validation results with the values renamed
 Args:
@@ -179,8 +135,8 @@ def train_val_rmse_r2_plot(grouped, feature, model, rmse, r2, splitting, rmse_ti
     fig_r2 = train_val_r2_plot(grouped, feature, model, r2, splitting, r2_title)
     fig_r2.show()
 
-    fig_rmse.write_image(f"{save_path}train_val_rmse.png")  # Save the RMSE plot as an image
-    fig_r2.write_image(f"{save_path}train_val_r2.png")  # Save the R2 plot as an image
+    queue_image(fig_rmse, f"{save_path}train_val_rmse.png")  # Save the RMSE plot as an image
+    queue_image(fig_r2, f"{save_path}train_val_r2.png")  # Save the R2 plot as an image
 
 ''' Create a bar chart for RMSE  '''
 def train_val_rmse_plot(grouped, feature, model, rmse, splitting, title):
@@ -231,7 +187,7 @@ def train_val_accuracy_plot(grouped, x, y1, y2, title, save_path):
         fig.update_yaxes(title_text='Accuracy', row=row, col=col)
 
     fig.update_layout(title=title, showlegend=True, width=1500, height=500, title_font=dict(size=24, color='black'))
-    fig.write_image(f"{save_path}train_val_accuracy.png")  # Save the accuracy plot as an image
+    queue_image(fig, f"{save_path}train_val_accuracy.png")  # Save the accuracy plot as an image
     fig.show()
 
 ########################
@@ -239,211 +195,184 @@ def train_val_accuracy_plot(grouped, x, y1, y2, title, save_path):
 ########################
 
 '''
-Description: Return the model parameters
+Description: Return the indexes [first, last) of the rows of a time window
 Args:
-    train_valid_results_raw: The dataset containing the results of the train / validation phase
-    models_list: List of models
-    features_list: List of features
+    timestamps: Ordered timestamps of the rows
+    start: Lower bound (excluded), None for no lower bound
+    end: Upper bound (included), None for no upper bound
 Return:
-    model_params_list: List of model parameters
+    first: Index of the first row of the window
+    last: Index following the last row of the window
 '''
-def get_model_parameters(train_valid_results_raw, models_list, features_list):
-  # Filter train_valid_results based on Type column
-  filtered_results = train_valid_results_raw[
-      (train_valid_results_raw['Type'].isin(['cross_val', 'tuned'])) &
-      (train_valid_results_raw['Splitting'] == 'single_split')
-  ]
-
-  model_params_list = []
-  for index, row in filtered_results.iterrows():
-    # Select model
-    if row['Model'] == LR_MODEL_NAME:
-      model = models_list[0]
-    elif row['Model'] == GLR_MODEL_NAME:
-      model = models_list[1]
-    elif row['Model'] == RF_MODEL_NAME:
-      model = models_list[2]
-    elif row['Model'] == GBTR_MODEL_NAME:
-      model = models_list[3]
-
-    model_name = row['Model']
-    features_label = row['Features']
-
-    if features_label.endswith('_norm'):
-      features_normalization = True
-      features_label_tmp = features_label.replace("_norm", "")
-    else:
-      features_normalization = False
-      features_label_tmp = features_label
-
-    # Select feature
-    if features_label_tmp == BASE_FEATURES_LABEL:
-      features = features_list[0]
-    elif features_label_tmp == BASE_AND_MOST_CORR_FEATURES_LABEL:
-      features = features_list[1]
-    elif features_label_tmp == BASE_AND_LEAST_CORR_FEATURES_LABEL:
-      features = features_list[2]
-
-    model_params = {
-        "Model_name": model_name,
-        "Model": model,
-        "Features_label": features_label,
-        "Features": features,
-        "Normalization": features_normalization
-    }
+def window_bounds(timestamps, start, end):
+    first = 0 if start is None else np.searchsorted(timestamps, pd.Timestamp(start).to_datetime64(), side='right')
+    last = len(timestamps) if end is None else np.searchsorted(timestamps, pd.Timestamp(end).to_datetime64(), side='right')
 
-    model_params_list.append(model_params)
-
-  return model_params_list
+    return first, last
 
 '''
-Description: Return the dataset with the selected features
+Description: Return the metrics of the predictions for each time window. The metrics are computed from the cumulative sums of the errors of each row,
+             so the predictions are scanned once whatever the number of windows (nested horizons, rolling windows, ...)
 Args:
-    dataset: The dataset from which to extract the features
-    features_normalization: Indicates whether features should be normalized (True) or not (False)
-    features: list of features to be extracted
-    features_label: The column name of features
+    predictions: Pandas dataset of the predictions ordered by timestamp
+    windows: Dictionary (window name -> (start, end)), the rows in (start, end] are considered, None for no bound
     target_label: The column name of target variable
-Return: 
-    dataset: Dataset with the selected features
-'''
-def select_features(dataset, features_normalization, features, features_label, target_label):
-    if features_normalization:
-        # Assemble the columns into a vector column
-        assembler = VectorAssembler(inputCols = features, outputCol = "raw_features")
-        df_vector  = assembler.transform(dataset).select("timestamp", "id", "market-price", "raw_features", target_label)
-
-        # Create a Normalizer instance using L2 norm
-        normalizer = Normalizer(inputCol="raw_features", outputCol=features_label, p=2.0)
-
-        # Fit and transform the data
-        dataset = normalizer.transform(df_vector).select("timestamp", "id", "market-price", features_label, target_label)
-    else:
-        # Assemble the columns into a vector column
-        assembler = VectorAssembler(inputCols = features, outputCol = features_label)
-        dataset = assembler.transform(dataset).select("timestamp", "id", "market-price", features_label, target_label)
+    prediction_label: The column name of the predictions
+Return:
+    results: Dictionary (window name -> metrics)
+'''
+def windows_evaluation(predictions, windows, target_label, prediction_label="prediction"):
+    timestamps = predictions['timestamp'].to_numpy()
+    y = predictions[target_label].to_numpy(dtype=float)
+    y_pred = predictions[prediction_label].to_numpy(dtype=float)
+    price = predictions['market-price'].to_numpy(dtype=float)
+
+    error = y - y_pred
+
+    # The total sum of squares doesn't change if the target is centered, but its cumulative sums are more accurate
+    y_centered = y - y.mean()
+
+    # Correct predictions of the price direction (as in model_accuracy of the train / validation phase)
+    correct = ((price < y) & (price < y_pred)) | ((price > y) & (price > y_pred))
+
+    # Cumulative sums with a leading zero, so that the sum of the rows [first, last) is sums[last] - sums[first]
+    row_values = {
+        'squared_error': error ** 2,
+        'absolute_error': np.abs(error),
+        'percentage_error': np.abs(error) / np.maximum(np.abs(y), np.finfo(np.float64).eps),
+        'y': y_centered,
+        'squared_y': y_centered ** 2,
+        'correct': correct
+    }
+    sums = {key: np.concatenate([[0.0], np.cumsum(values, dtype=float)]) for key, values in row_values.items()}
+
+    # Number of columns used by the adjusted R-squared (target, market price, prediction and timestamp as in the evaluation of the train / validation phase)
+    p = 4
+
+    results = {}
+    for name, (start, end) in windows.items():
+        first, last = window_bounds(timestamps, start, end)
+        n = last - first
+        if n == 0:
+            raise ValueError(f"The window {name} doesn't contain any prediction")
+
+        window_sums = {key: values[last] - values[first] for key, values in sums.items()}
+
+        mse = window_sums['squared_error'] / n
+        total_sum_squares = window_sums['squared_y'] - window_sums['y'] ** 2 / n
+        r2 = 1 - window_sums['squared_error'] / total_sum_squares
+
+        results[name] = {
+            'rmse': np.sqrt(mse),
+            'mse': mse,
+            'mae': window_sums['absolute_error'] / n,
+            'mape': window_sums['percentage_error'] / n,
+            'r2': r2,
+            'adj_r2': 1-(1-r2)*(n-1)/(n-p-1),
+            'accuracy': window_sums['correct'] / n * 100
+        }
 
-    return dataset
+    return results
 
 '''
-Description: Return the metrics of the selected model
+Description: Group the models which use the same features with the same normalization
 Args:
-    target_label: The column name of target variable
-    predictions: predictions made by the model
+    model_params_list: List of model parameters
 Return:
-    results: Metrics obtained from the evaluation
+    groups: List of (features, normalization, list of model parameters)
 '''
-def model_evaluation(target_label, predictions):
-    mse_evaluator = RegressionEvaluator(labelCol=target_label, predictionCol="prediction", metricName='mse')
-    rmse_evaluator = RegressionEvaluator(labelCol=target_label, predictionCol="prediction", metricName='rmse')
-    mae_evaluator = RegressionEvaluator(labelCol=target_label, predictionCol="prediction", metricName='mae')
-    r2_evaluator = RegressionEvaluator(labelCol=target_label, predictionCol="prediction", metricName='r2')
-
-    mape = mean_absolute_percentage_error(predictions.toPandas()[target_label], predictions.toPandas()["prediction"])
-
-    mse = mse_evaluator.evaluate(predictions)
-    rmse = rmse_evaluator.evaluate(predictions)
-    mae = mae_evaluator.evaluate(predictions)
-    r2 = r2_evaluator.evaluate(predictions)
+def group_by_features(model_params_list):
+    groups = {}
+    for model_params in model_params_list:
+        key = (tuple(model_params['Features']), model_params['Normalization'])
+        groups.setdefault(key, []).append(model_params)
 
-    # Adjusted R-squared
-    n = predictions.count()
-    p = len(predictions.columns)
-    adj_r2 = 1-(1-r2)*(n-1)/(n-p-1)
-
-    results = {'rmse':rmse, 'mse':mse, 'mae':mae, 'mape':mape, 'r2':r2, 'adj_r2':adj_r2}
-
-    return results
+    return [(list(features), normalization, group) for (features, normalization), group in groups.items()]
 
 '''
-Description: Evaluate final model by making predictions on the test set
+Description: Return the predictions of all the models in a single wide dataset. The features of each group of models are assembled once
+             and all the models are applied in the same pass over the dataset
 Args:
-    dataset: The test set to be used
-    dataset_name: Name of selected dataset [one_week | fifteen_days | one_month | three_months]
-    model: Trained model
-    model_name: Name of the model selected
-    features_normalization: Indicates whether features should be normalized or not
-    features: Features to be used to make predictions
-    features_name: Name of features used
+    dataset: The dataset to be used
+    model_params_list: List of model parameters
     features_label: The column name of features
     target_label: The column name of target variable
 Return:
-    results_df: Results obtained from the evaluation
-    predictions: Predictions obtained from the model
+    predictions: Dataset with timestamp, market price, target and one column of predictions for each model (named as the model)
 '''
-def evaluate_final_model(dataset, dataset_name, model, model_name, features_normalization, features, features_name, features_label, target_label):
-    # Select the type of features to be used
-    dataset = select_features(dataset, features_normalization, features, features_label, target_label)
-
-    # Make predictions
-    predictions = model.transform(dataset).select(target_label, "market-price", "prediction", 'timestamp')
-
-    # Compute validation error by several evaluators
-    eval_res = model_evaluation(target_label, predictions)
-
-    # Use dict to store each result
-    results = {
-        "Model": model_name,
-        "Dataset": dataset_name,
-        "Features": features_name,
-        "RMSE": eval_res['rmse'],
-        "MSE": eval_res['mse'],
-        "MAE": eval_res['mae'],
-        "MAPE": eval_res['mape'],
-        "R2": eval_res['r2'],
-        "Adjusted_R2": eval_res['adj_r2'],
-    }
+def predict_all(dataset, model_params_list, features_label, target_label):
+    for i, (features, normalization, group) in enumerate(group_by_features(model_params_list)):
+        group_features_label = f"{features_label}_{i}"
+
+        # Assemble (and normalize) the features of the group
+        if normalization:
+            dataset = VectorAssembler(inputCols = features, outputCol = "raw_" + group_features_label).transform(dataset)
+            dataset = Normalizer(inputCol = "raw_" + group_features_label, outputCol = group_features_label, p=2.0).transform(dataset)
+        else:
+            dataset = VectorAssembler(inputCols = features, outputCol = group_features_label).transform(dataset)
 
-    # Transform dict to pandas dataset
-    results_pd = pd.DataFrame(results, index=[0])
+        # Apply the trained models (each pipeline contains only the model) to the features of the group
+        for model_params in group:
+            for stage in load_model(model_params['Model_path']).stages:
+                stage = stage.copy().setFeaturesCol(group_features_label).setPredictionCol(model_params['Model_name'])
+                dataset = stage.transform(dataset)
 
-    return results_pd, predictions
+    return dataset.select("timestamp", "market-price", target_label, *[model_params['Model_name'] for model_params in model_params_list])
 
 '''
-Description: Evaluate final model by making predictions on the test set
+Description: Evaluate final models by making predictions on the test set. The longest horizon is transformed once by all the models
+             and the metrics of all the horizons are computed from its predictions
 Args:
-    datasets_list: List of datasets
-    model_params_list: List of model parameters 
+    dataset: The test set to be used
+    horizons: Dictionary (horizon name -> (start, end)), the rows in (start, end] are considered, None for no bound
+    model_params_list: List of model parameters
 Return:
-    final_test_results: Results obtained from the evaluation 
+    final_test_results: Results obtained from the evaluation
     predictions_df: Predictions obtained from the model
 '''
-def models_testing(datasets_list, model_params_list):
-  datasets_name_list = ["one_week", "fifteen_days", "one_month", "three_months"]
-  predictions_df = pd.DataFrame(columns=[TARGET_LABEL, "market-price", "prediction", 'timestamp'])
-  test_results = pd.DataFrame(columns=['Model', 'Dataset', 'Features', 'RMSE', 'MSE', 'MAE', 'MAPE', 'R2', 'Adjusted_R2'])
-  test_accuracy = pd.DataFrame(columns=['Model', 'Features', 'Dataset', 'Accuracy'])
+def models_testing(dataset, horizons, model_params_list):
+  # Period containing all the horizons
+  starts = [start for start, _ in horizons.values()]
+  ends = [end for _, end in horizons.values()]
+  dataset = filter_by_timestamp(dataset, None if None in starts else builtins.min(starts), None if None in ends else builtins.max(ends))
 
-  # For each model makes predictions based on the dataset type
-  for model_params in model_params_list:
-      for j, dataset in enumerate(datasets_list):
-        model_name = model_params['Model_name']
-        model = model_params['Model']
-        chosen_features_label = model_params['Features_label']
-        chosen_features = model_params['Features']
-        features_normalization = model_params['Normalization']
-        
-        # Evaluate final model
-        results, predictions = evaluate_final_model(dataset, datasets_name_list[j], model, model_name, features_normalization, chosen_features, chosen_features_label, FEATURES_LABEL, TARGET_LABEL)
-        test_results = pd.concat([test_results, results], ignore_index=True)
-
-        predictions = predictions.withColumn("Model", lit(model_name)).withColumn("Dataset", lit(datasets_name_list[j]))
-        predictions_df = pd.concat([predictions_df, predictions.toPandas()], ignore_index=True)
-
-        accuracy = model_accuracy(predictions)
-        accuracy_data = {
-            'Model': model_name,
-            'Features': chosen_features_label,
-            'Dataset': datasets_name_list[j],
-            'Accuracy': accuracy
-        }
+  # Make the predictions of all the models
+  predictions = collect_pandas(predict_all(dataset, model_params_list, FEATURES_LABEL, TARGET_LABEL).orderBy('timestamp'), "test predictions")
+  timestamps = predictions['timestamp'].to_numpy()
 
-        # Transform dict to pandas dataset
-        accuracy_data_df = pd.DataFrame(accuracy_data, index=['Model'])
-        test_accuracy = pd.concat([test_accuracy, accuracy_data_df], ignore_index=True)
+  test_results = []
+  predictions_list = []
 
-  # Merge results and accuracy
-  final_test_results = pd.merge(test_results, test_accuracy)
+  for model_params in model_params_list:
+      model_name = model_params['Model_name']
+      chosen_features_label = model_params['Features_label']
+
+      # Compute the metrics of each horizon
+      horizons_results = windows_evaluation(predictions, horizons, TARGET_LABEL, model_name)
+
+      for horizon_name, (start, end) in horizons.items():
+        eval_res = horizons_results[horizon_name]
+
+        test_results.append({
+            "Model": model_name,
+            "Dataset": horizon_name,
+            "Features": chosen_features_label,
+            "RMSE": eval_res['rmse'],
+            "MSE": eval_res['mse'],
+            "MAE": eval_res['mae'],
+            "MAPE": eval_res['mape'],
+            "R2": eval_res['r2'],
+            "Adjusted_R2": eval_res['adj_r2'],
+            "Accuracy": eval_res['accuracy']
+        })
+
+        # Predictions of the model for the horizon
+        first, last = window_bounds(timestamps, start, end)
+        model_predictions = predictions.iloc[first:last][[TARGET_LABEL, "market-price", model_name, 'timestamp']].rename(columns={model_name: "prediction"})
+        predictions_list.append(model_predictions.assign(Model=model_name, Dataset=horizon_name))
+
+  final_test_results = pd.DataFrame(test_results)
+  predictions_df = pd.concat(predictions_list, ignore_index=True)
 
   return final_test_results, predictions_df
 
@@ -469,83 +398,27 @@ def test_dataset_fine_tuning(dataset):
 '''
 Description: Plot the splitted datasets
 Args:
-    one_week: Dataset containing the data for one week
-    fifteen_days: Dataset containing the data for fifteen days
-    one_month: Dataset containing the data one month
-    three_months: Dataset containing the data for three months
+    one_week: Dataset containing the data for one week (Spark or Pandas)
+    fifteen_days: Dataset containing the data for fifteen days (Spark or Pandas)
+    one_month: Dataset containing the data one month (Spark or Pandas)
+    three_months: Dataset containing the data for three months (Spark or Pandas)
     title: Title for the plot
 Return: None
 '''
 def show_datasets(one_week, fifteen_days, one_month, three_months, title):
-    trace1 = go.Scatter(
-        x = three_months['timestamp'],
-        y = three_months['market-price'].astype(float),
-        mode = 'lines',
-        name = 'Three months market price (usd)'
-    )
-
-    trace2 = go.Scatter(
-        x = one_month['timestamp'],
-        y = one_month['market-price'].astype(float),
-        mode = 'lines',
-        name = 'One month market price (usd)'
-    )
-
-    trace3 = go.Scatter(
-        x = fifteen_days['timestamp'],
-        y = fifteen_days['market-price'].astype(float),
-        mode = 'lines',
-        name = 'Fifteen days market price (usd)'
-    )
-
-    trace4 = go.Scatter(
-        x = one_week['timestamp'],
-        y = one_week['market-price'].astype(float),
-        mode = 'lines',
-        name = 'One week market price (usd)'
-    )
-
-    layout = go.Layout(
-        title=title,
-        xaxis=dict(
-            rangeselector=dict(
-                buttons=list([
-                    # Change the count to desired amount of months.
-                    dict(count=1,
-                        label='1m',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=6,
-                        label='6m',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=12,
-                        label='1y',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=36,
-                        label='3y',
-                        step='month',
-                        stepmode='backward'),
-                    dict(step='all')
-                ])
-            ),
-            rangeslider=dict(
-                visible = True
-            ),
-            type='date'
-        )
-    )
+    traces = [
+        (three_months, 'market-price', 'Three months market price (usd)'),
+        (one_month, 'market-price', 'One month market price (usd)'),
+        (fifteen_days, 'market-price', 'Fifteen days market price (usd)'),
+        (one_week, 'market-price', 'One week market price (usd)')
+    ]
 
-    data = [trace1, trace2, trace3, trace4]
-    fig = go.Figure(data=data, layout=layout)
+    show_time_series(traces, title)
 
-    fig.show()
-    
 '''
 Description: Plot the prediction obtained from the test phase
 Args:
-    dataset: The whole test dataset
+    dataset: The whole test dataset (Spark or Pandas)
     model0_name: Name of the first model
     model0_predictions: Predictions obtained from the first model
     model1_name: Name of the second model
@@ -558,104 +431,15 @@ Args:
 Return: None
 '''
 def show_results(dataset, model0_name, model0_predictions, model1_name, model1_predictions, model2_name, model2_predictions, model3_name, model3_predictions, title):
-    trace1 = go.Scatter(
-        x = dataset['timestamp'],
-        y = dataset['next-market-price'].astype(float),
-        mode = 'lines',
-        name = 'Actual market price'
-    )
-
-    trace2 = go.Scatter(
-        x = model0_predictions['timestamp'],
-        y = model0_predictions['prediction'].astype(float),
-        mode = 'lines',
-        name = model0_name + ' predictions'
-    )
-
-    trace3 = go.Scatter(
-        x = model1_predictions['timestamp'],
-        y = model1_predictions['prediction'].astype(float),
-        mode = 'lines',
-        name = model1_name + ' predictions'
-    )
-
-    trace4 = go.Scatter(
-        x = model2_predictions['timestamp'],
-        y = model2_predictions['prediction'].astype(float),
-        mode = 'lines',
-        name = model2_name + ' predictions'
-    )
-
-    trace5 = go.Scatter(
-        x = model3_predictions['timestamp'],
-        y = model3_predictions['prediction'].astype(float),
-        mode = 'lines',
-        name = model3_name + ' predictions'
-    )
-
-    layout = go.Layout(
-        title=title,
-        xaxis=dict(
-            rangeselector=dict(
-                buttons=list([
-                    # Change the count to desired amount of months.
-                    dict(count=1,
-                        label='1m',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=6,
-                        label='6m',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=12,
-                        label='1y',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=36,
-                        label='3y',
-                        step='month',
-                        stepmode='backward'),
-                    dict(step='all')
-                ])
-            ),
-            rangeslider=dict(
-                visible = True
-            ),
-            type='date'
-        )
-    )
-
-    data = [trace1, trace2, trace3, trace4, trace5]
-    fig = go.Figure(data=data, layout=layout)
-    fig.show()
-'''
-Description: Return the accuracy of the model (how good the models are at predicting whether the price will go up or down)
-Args:
-    predictions: Predictions made by the model
-Return: 
-    accuracy: Percentage of correct predictions
-'''
-def model_accuracy(dataset):
-    # Compute the number of total rows in the DataFrame.
-    total_rows = dataset.count()
-
-    # Create a column "correct_prediction" which is worth 1 if the prediction is correct, otherwise 0
-    dataset = dataset.withColumn(
-        "correct_prediction",
-        (
-            (col("market-price") < col("next-market-price")) & (col("market-price") < col("prediction"))
-        ) | (
-            (col("market-price") > col("next-market-price")) & (col("market-price") > col("prediction"))
-        )
-    )
-
-    # Count the number of correct predictions
-    correct_predictions = dataset.filter(col("correct_prediction")).count()
-
-    # Compite percentage of correct predictions
-    accuracy = (correct_predictions / total_rows) * 100
+    traces = [
+        (dataset, 'next-market-price', 'Actual market price'),
+        (model0_predictions, 'prediction', model0_name + ' predictions'),
+        (model1_predictions, 'prediction', model1_name + ' predictions'),
+        (model2_predictions, 'prediction', model2_name + ' predictions'),
+        (model3_predictions, 'prediction', model3_name + ' predictions')
+    ]
 
-    return accuracy
+    show_time_series(traces, title)
 
 '''
 Description: Show the results obtained during the test phase
@@ -678,8 +462,8 @@ def test_rmse_r2_plot(grouped, model, rmse, r2, dataset, rmse_title, r2_title, s
     fig_r2 = test_r2_plot(grouped, model, r2, dataset, r2_title)
     fig_r2.show()
 
-    fig_rmse.write_image(f"{save_path}test_rmse.png")  # Save the RMSE plot as an image
-    fig_r2.write_image(f"{save_path}test_r2.png")  # Save the R2 plot as an image
+    queue_image(fig_rmse, f"{save_path}test_rmse.png")  # Save the RMSE plot as an image
+    queue_image(fig_r2, f"{save_path}test_r2.png")  # Save the R2 plot as an image
 
 ''' Create a bar chart for RMSE  '''
 def test_rmse_plot(grouped, model, rmse, dataset, title):
@@ -724,5 +508,5 @@ def test_accuracy_plot(grouped, model, accuracy, title, save_path):
         fig.update_yaxes(title_text='Accuracy', row=row, col=col)
 
     fig.update_layout(title=title, showlegend=True, width=1500, height=500, title_font=dict(size=24, color='black'))
-    fig.write_image(f"{save_path}test_accuracy.png")  # Save the accuracy plot as an image
+    queue_image(fig, f"{save_path}test_accuracy.png")  # Save the accuracy plot as an image
     fig.show()
\ No newline at end of file
@@ -0,0 +1,320 @@
+from imports import *
+from config import *
+from dataset_utilities import timestamp_bounds
+from train_validation_utilities import block_splits, walk_forward_splits
+
+######################
+# --- STATISTICS --- #
+######################
+
+'''
+Description: Return the Gram matrix Z^T Z of some rows, where each row of Z is [1, features..., target]
+Args:
+    rows: List of rows (features values followed by the target value)
+Return:
+    gram: Gram matrix of the rows
+'''
+def gram_matrix(rows):
+    z = np.array(rows, dtype=np.float64)
+    z = np.hstack([np.ones((z.shape[0], 1)), z])
+
+    return z.T @ z
+
+'''
+Description: Return the Gram matrix of each segment of the dataset in a single pass. The segments are the intervals between consecutive
+             boundaries of the key column, so that the Gram matrix of any train / validation set can be obtained by adding its segments
+Args:
+    dataset: The dataset (with the features not assembled)
+    columns: Features to be used (the union of all the features subsets)
+    target_label: The column name of target variable
+    key_column: Column used to assign the rows to the segments [id | timestamp]
+    boundaries: Sorted boundaries of the segments
+    right: Segment of the rows equal to a boundary (True: the segment after the boundary, False: the segment before it)
+Return:
+    segment_grams: Dictionary (segment index -> Gram matrix), the segment i contains the rows between boundaries[i-1] and boundaries[i]
+'''
+def segment_grams(dataset, columns, target_label, key_column, boundaries, right=True):
+    locate = bisect.bisect_right if right else bisect.bisect_left
+
+    def partition_grams(rows):
+        buffers = {}
+        for row in rows:
+            buffer = buffers.setdefault(locate(boundaries, row[0]), [])
+            buffer.append(row[1:])
+
+            # Reduce the rows in batches to keep the memory of the executors bounded
+            if len(buffer) == GRAM_BATCH_ROWS:
+                yield locate(boundaries, row[0]), gram_matrix(buffer)
+                buffer.clear()
+
+        for segment, buffer in buffers.items():
+            if buffer:
+                yield segment, gram_matrix(buffer)
+
+    return dataset.select(key_column, *columns, target_label).rdd.mapPartitions(partition_grams).reduceByKey(np.add).collectAsMap()
+
+'''
+Description: Return the Gram matrices of the train and validation sets of each split, computed with a single pass over the dataset
+Args:
+    dataset: The dataset (with the features not assembled)
+    splitting_info: Splitting method selected (as returned by get_splitting_params)
+    columns: Features to be used (the union of all the features subsets)
+    target_label: The column name of target variable
+Return:
+    split_grams: List of (train Gram matrix, validation Gram matrix), one for each split
+'''
+def split_grams(dataset, splitting_info, columns, target_label):
+    size = len(columns) + 2
+    empty = np.zeros((size, size))
+
+    if splitting_info['split_type'] == SS:
+        # Same split date as short_term_split, the train set contains the rows up to the split date (included)
+        _, last_value = timestamp_bounds(dataset)
+        split_date = last_value - relativedelta(**{splitting_info['split_label']: splitting_info['split_value']})
+
+        grams = segment_grams(dataset, columns, target_label, "timestamp", [split_date], right=False)
+
+        return [(grams.get(0, empty), grams.get(1, empty))]
+
+    num = dataset.count()
+    if splitting_info['split_type'] == BS:
+        split_position_df = block_splits(num, splitting_info['splits'])
+    elif splitting_info['split_type'] == WFS:
+        split_position_df = walk_forward_splits(num, splitting_info['min_obser'], splitting_info['sliding_window'])
+    else:
+        raise ValueError("Invalid split type")
+
+    positions = list(split_position_df[['start', 'split', 'end']].itertuples(index=False, name=None))
+    boundaries = sorted(set(value for position in positions for value in position))
+
+    grams = segment_grams(dataset, columns, target_label, "id", boundaries)
+
+    # The ids in [start, end) are the segments after the start boundary up to the end boundary
+    def interval_gram(start, end):
+        return builtins.sum((grams.get(segment, empty) for segment in range(boundaries.index(start) + 1, boundaries.index(end) + 1)), empty)
+
+    return [(interval_gram(start, split), interval_gram(split, end)) for start, split, end in positions]
+
+#################
+# --- SOLVE --- #
+#################
+
+'''
+Description: Return the Gram matrix of a features subset (rows and columns of the intercept, of the subset and of the target)
+Args:
+    gram: Gram matrix of all the features
+    indexes: Positions of the subset features in the columns of the Gram matrix
+Return:
+    gram: Gram matrix of the subset
+'''
+def subset_gram(gram, indexes):
+    selected = [0] + [index + 1 for index in indexes] + [gram.shape[0] - 1]
+
+    return gram[np.ix_(selected, selected)]
+
+'''
+Description: Solve the least squares problem of a features subset on the driver. It has the same solution as the normal equations solver
+             of LinearRegression (elasticNetParam = 0) and of GeneralizedLinearRegression (gaussian family, identity link), which use standardized
+             features and target, so regParam penalizes the coefficients of the standardized features
+Args:
+    gram: Gram matrix of the train set for the subset (as returned by subset_gram)
+    reg_param: The regularization parameter
+Return:
+    intercept: Intercept of the model
+    coefficients: Coefficients of the features
+'''
+def solve_subset(gram, reg_param):
+    n = gram[0, 0]
+    features_mean = gram[0, 1:-1] / n
+    target_mean = gram[0, -1] / n
+
+    # Covariances of the features and between the features and the target
+    features_cov = gram[1:-1, 1:-1] / n - np.outer(features_mean, features_mean)
+    target_cov = gram[1:-1, -1] / n - features_mean * target_mean
+    features_var = np.diag(features_cov).copy()
+    target_std = np.sqrt(builtins.max(gram[-1, -1] / n - target_mean ** 2, 0.0))
+
+    # Constant features are not used, as Spark does
+    used = features_var > 0
+    coefficients = np.zeros(len(features_mean))
+
+    if used.any():
+        system = features_cov[np.ix_(used, used)]
+        if reg_param > 0 and target_std > 0:
+            system = system + np.diag(reg_param / target_std * features_var[used])
+
+        # Least squares solution, the features can be collinear
+        coefficients[used] = np.linalg.lstsq(system, target_cov[used], rcond=None)[0]
+
+    intercept = target_mean - features_mean @ coefficients
+
+    return intercept, coefficients
+
+'''
+Description: Return the metrics of a linear model on a dataset, given the Gram matrix of the dataset
+Args:
+    gram: Gram matrix of the dataset for the subset (as returned by subset_gram)
+    intercept: Intercept of the model
+    coefficients: Coefficients of the features
+Return:
+    results: Metrics obtained from the evaluation (rmse, mse, r2)
+'''
+def gram_evaluation(gram, intercept, coefficients):
+    n = gram[0, 0]
+
+    # The residuals are -Z w, so their sum of squares is w^T (Z^T Z) w
+    weights = np.concatenate([[intercept], coefficients, [-1.0]])
+    sse = builtins.max(weights @ gram @ weights, 0.0)
+    sst = gram[-1, -1] - gram[0, -1] ** 2 / n
+
+    mse = sse / n
+    r2 = 1 - sse / sst if sst > 0 else float('nan')
+
+    results = {'rmse': np.sqrt(mse), 'mse': mse, 'r2': r2}
+
+    return results
+
+###################
+# --- SUBSETS --- #
+###################
+
+'''
+Description: Check that the parameters can be solved with the Gram matrix
+Args:
+    model_name: Name of the model selected [LinearRegression | GeneralizedLinearRegression]
+    param: Parameters of the model
+Return: None
+'''
+def check_linear_params(model_name, param):
+    if model_name == LR:
+        if param.get('elasticNetParam', 0) != 0:
+            raise ValueError("The Gram matrix can only be used with elasticNetParam = 0")
+    elif model_name == GLR:
+        if param.get('family', 'gaussian') != 'gaussian' or param.get('link', 'identity') != 'identity':
+            raise ValueError("The Gram matrix can only be used with the gaussian family and the identity link")
+    else:
+        raise ValueError("The Gram matrix can only be used with " + LR + " and " + GLR)
+
+'''
+Description: Evaluate some features subsets on all the splits without training any Spark model. The Gram matrices are computed once
+             for the union of the features, then each subset is solved on the driver (the features must not be normalized)
+Args:
+    grams: Gram matrices of each split (as returned by split_grams)
+    columns: Features used to compute the Gram matrices
+    subsets: Dictionary (features name -> list of features)
+    params: Model's parameters to use
+    splitting_info: Splitting method selected
+    model_name: Name of the model selected [LinearRegression | GeneralizedLinearRegression]
+Return:
+    train_results_df: All the train splits performances in a pandas dataset
+    valid_results_df: All the validations splits performances in a pandas dataset
+'''
+def evaluate_subsets(grams, columns, subsets, params, splitting_info, model_name):
+    # All combination of params
+    param_lst = [dict(zip(params, param)) for param in product(*params.values())]
+
+    all_train_results = []
+    all_valid_results = []
+
+    for features_name, features in subsets.items():
+        indexes = [columns.index(feature) for feature in features]
+
+        for param in param_lst:
+            check_linear_params(model_name, param)
+
+            for idx, (train_gram, valid_gram) in enumerate(grams):
+                train_gram = subset_gram(train_gram, indexes)
+                valid_gram = subset_gram(valid_gram, indexes)
+
+                # Train a model and calculate running time
+                start = time.time()
+                intercept, coefficients = solve_subset(train_gram, param['regParam'])
+                end = time.time()
+
+                for dataset_name, gram, all_results in [('train', train_gram, all_train_results), ('valid', valid_gram, all_valid_results)]:
+                    eval_res = gram_evaluation(gram, intercept, coefficients)
+
+                    all_results.append({
+                        "Model": model_name,
+                        "Type": "gram",
+                        "Dataset": dataset_name,
+                        "Splitting": splitting_info['split_type'],
+                        "Features": features_name,
+                        "Splits": idx + 1,
+                        "Train / Validation": (int(train_gram[0, 0]), int(valid_gram[0, 0])),
+                        "Parameters": list(param.values()),
+                        "RMSE": eval_res['rmse'],
+                        "MSE": eval_res['mse'],
+                        "R2": eval_res['r2'],
+                        "Time": end - start,
+                    })
+
+    return pd.DataFrame(all_train_results), pd.DataFrame(all_valid_results)
+
+'''
+Description: Return the average validation RMSE of a features subset over all the splits
+Args:
+    grams: Gram matrices of each split (as returned by split_grams)
+    columns: Features used to compute the Gram matrices
+    features: Features of the subset
+    reg_param: The regularization parameter
+Return:
+    rmse: Average validation RMSE
+'''
+def subset_rmse(grams, columns, features, reg_param):
+    indexes = [columns.index(feature) for feature in features]
+
+    rmse = []
+    for train_gram, valid_gram in grams:
+        intercept, coefficients = solve_subset(subset_gram(train_gram, indexes), reg_param)
+        rmse.append(gram_evaluation(subset_gram(valid_gram, indexes), intercept, coefficients)['rmse'])
+
+    return float(np.mean(rmse))
+
+'''
+Description: Stepwise features selection by average validation RMSE. The forward selection adds at each step the feature which
+             reduces the RMSE the most, the backward selection removes the feature whose removal reduces the RMSE the most.
+             It stops when no step reduces the RMSE (or when the maximum number of features is reached)
+Args:
+    grams: Gram matrices of each split (as returned by split_grams)
+    columns: Features used to compute the Gram matrices (the candidates)
+    direction: Direction of the selection [forward | backward]
+    initial: Features the selection starts from (forward: nothing, backward: all the candidates, if None)
+    reg_param: The regularization parameter
+    max_features: Maximum number of features of the forward selection
+Return:
+    steps_df: Steps of the selection (Step, Action, Feature, Features, RMSE) in a pandas dataset, the last row is the selected subset
+'''
+def stepwise_selection(grams, columns, direction="forward", initial=None, reg_param=0.0, max_features=None):
+    if direction not in ["forward", "backward"]:
+        raise ValueError("Invalid direction: " + direction)
+
+    if initial is None:
+        initial = [] if direction == "forward" else columns
+    selected = list(initial)
+    max_features = max_features or len(columns)
+
+    best_rmse = subset_rmse(grams, columns, selected, reg_param) if selected else float('inf')
+    steps = [{"Step": 0, "Action": "start", "Feature": None, "Features": list(selected), "RMSE": best_rmse}]
+
+    while True:
+        if direction == "forward":
+            if len(selected) >= max_features:
+                break
+            candidates = [(feature, selected + [feature]) for feature in columns if feature not in selected]
+        else:
+            if len(selected) <= 1:
+                break
+            candidates = [(feature, [other for other in selected if other != feature]) for feature in selected]
+
+        if not candidates:
+            break
+
+        feature, features, rmse = builtins.min(((feature, features, subset_rmse(grams, columns, features, reg_param)) for feature, features in candidates), key=lambda candidate: candidate[2])
+        if rmse >= best_rmse:
+            break
+
+        selected, best_rmse = features, rmse
+        steps.append({"Step": len(steps), "Action": "add" if direction == "forward" else "remove", "Feature": feature, "Features": list(selected), "RMSE": rmse})
+
+    return pd.DataFrame(steps)
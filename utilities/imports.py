@@ -15,29 +15,100 @@ from pyspark.sql.window import Window
 import pyspark.sql.functions as F
 from pyspark.sql.functions import *
 from pyspark.ml import PipelineModel
+from py4j.protocol import Py4JJavaError
 
-# Graph packages
-import plotly.express as px
-import matplotlib.pyplot as plt
-from plotly.offline import init_notebook_mode, iplot, plot
-import plotly.io as pio
-from plotly.subplots import make_subplots
-import plotly.graph_objs as go
-import seaborn as sns
+# Lazy loading
+import importlib
+import os
+
+# Set EAGER_IMPORTS=1 to load all the packages at startup (e.g. to compare the startup time)
+EAGER_IMPORTS = os.environ.get("EAGER_IMPORTS") == "1"
+
+'''
+Description: Module imported on the first access to one of its attributes, so that the processes which never use it
+             (e.g. headless training and scoring) don't pay for its import time and memory
+Args:
+    name: Name of the module
+'''
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = importlib.import_module(name) if EAGER_IMPORTS else None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+
+        return getattr(self._module, attribute)
+
+    def __dir__(self):
+        return dir(importlib.import_module(self._name))
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}'>"
+
+'''
+Description: Return a function which imports its module on the first call
+Args:
+    module_name: Name of the module containing the function
+    function_name: Name of the function
+Return:
+    function: Lazy function
+'''
+def lazy_function(module_name, function_name):
+    if EAGER_IMPORTS:
+        return getattr(importlib.import_module(module_name), function_name)
+
+    def function(*args, **kwargs):
+        return getattr(importlib.import_module(module_name), function_name)(*args, **kwargs)
+    function.__name__ = function_name
+
+    return function
+
+# Graph packages (lazy)
+px = LazyModule("plotly.express")
+plt = LazyModule("matplotlib.pyplot")
+pio = LazyModule("plotly.io")
+go = LazyModule("plotly.graph_objs")
+sns = LazyModule("seaborn")
+init_notebook_mode = lazy_function("plotly.offline", "init_notebook_mode")
+iplot = lazy_function("plotly.offline", "iplot")
+plot = lazy_function("plotly.offline", "plot")
+make_subplots = lazy_function("plotly.subplots", "make_subplots")
+
+# Notebooks (lazy)
+get_ipython = lazy_function("IPython", "get_ipython")
 
 # Python
+import builtins # The pyspark wildcard imports shadow min, max, sum, abs and round
 import numpy as np
-import requests
 import pandas as pd
 from itertools import cycle, product
 import json
-import importlib
-import os
 import glob
 import time
 import shutil
 import functools
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, Future
+import hashlib
+import sqlite3
+import ast
+import bisect
+import threading
+import sys
+import tempfile
+import signal
+import socket
+import subprocess
+import queue
+import atexit
 from datetime import datetime, date
+from statistics import NormalDist
 from dateutil.relativedelta import relativedelta
-from sklearn.metrics import mean_absolute_percentage_error
-from tqdm import tqdm
\ No newline at end of file
+
+# Network, metrics and progress packages (lazy)
+requests = LazyModule("requests")
+mean_absolute_percentage_error = lazy_function("sklearn.metrics", "mean_absolute_percentage_error")
+tqdm = lazy_function("tqdm", "tqdm")
\ No newline at end of file
@@ -0,0 +1,324 @@
+from imports import *
+from config import *
+from results_utilities import query_results, query_accuracy
+
+# Monitored error streams (squared error, absolute error, absolute percentage error, correct direction)
+streams = ["SE", "AE", "APE", "Correct"]
+
+# Types of the tuned results (tuned by the single split, cross validated by the block and walk forward splits)
+tuned_types = ["tuned", "cross_val"]
+
+#####################
+# --- BASELINES --- #
+#####################
+
+'''
+Description: Return the validation metrics of a tuned model saved in the results warehouse (the results CSVs of the previous versions
+             are imported in it by import_csv_results), used as the baseline of the live metrics. Only the tuned results are considered
+             and, if several runs are saved, the latest one (the rows are returned in the order they have been saved)
+Args:
+    path: Path of the warehouse
+    model_name: Name of the model
+    splitting: Splitting method the model has been tuned with
+    features_name: Name of the features of the model (e.g. base_features_norm)
+Return:
+    baseline: Dictionary (RMSE | MAE | MAPE | Accuracy -> validation value)
+'''
+def error_baseline(path, model_name, splitting, features_name):
+    results = query_results(path, "rel", Model=model_name, Splitting=splitting, Features=features_name, Dataset="valid", Type=tuned_types)
+    if results.empty:
+        raise ValueError(f"No tuned validation results of {model_name} ({splitting}, {features_name}) in the warehouse")
+    accuracy = query_accuracy(path, Model=model_name, Splitting=splitting, Features=features_name).dropna(subset=["Accuracy (tuned)"])
+
+    # Latest run of the tuned model
+    tuned = results.iloc[-1]
+    baseline = {metric: float(tuned[metric]) for metric in ["RMSE", "MAE", "MAPE"]}
+    baseline["Accuracy"] = float(accuracy["Accuracy (tuned)"].iloc[-1]) if not accuracy.empty else None
+
+    return baseline
+
+'''
+Description: Return the mean and the standard deviation of each feature of the train set (computed in a single pass), used as the baseline of the drift
+Args:
+    dataset: Spark dataset the model has been trained on
+    features: List of features
+Return:
+    baseline: Dictionary (Features -> list of features, Mean -> array of the means, Std -> array of the standard deviations)
+'''
+def feature_baseline(dataset, features):
+    row = dataset.agg(*[F.avg(feature) for feature in features], *[F.stddev_pop(feature) for feature in features]).collect()[0]
+    values = np.array(row, dtype=float)
+
+    return {"Features": list(features), "Mean": values[:len(features)], "Std": values[len(features):]}
+
+###################
+# --- MONITOR --- #
+###################
+
+'''
+Description: Return the state of a new monitor. Its size does not depend on the number of monitored bars: the exponentially weighted sums,
+             the ring buffer of the sliding window and the exponentially weighted moments of the standardized features
+Args:
+    baseline: Validation metrics (as returned by error_baseline)
+    features_baseline: Mean and standard deviation of the features (as returned by feature_baseline), None to monitor only the errors
+    half_life: Half life (bars) of the exponentially weighted metrics
+    window: Bars of the sliding window metrics
+    sink: File the alerts are appended to (None to print them)
+Return:
+    monitor: Dictionary with the state of the monitor
+'''
+def new_monitor(baseline, features_baseline=None, half_life=MONITOR_HALF_LIFE_BARS, window=MONITOR_WINDOW_BARS, sink=None):
+    num_features = len(features_baseline["Features"]) if features_baseline is not None else 0
+
+    monitor = {
+        "Baseline": baseline,
+        "Features": features_baseline["Features"] if features_baseline is not None else [],
+        "Decay": 0.5 ** (1 / half_life),
+        "Bars": 0,
+        "EW_weight": 0.0, # Sum of the weights of the bars seen so far (to correct the bias of the first bars)
+        "EW": np.zeros(len(streams)),
+        "Window": np.zeros((window, len(streams))),
+        "Window_sum": np.zeros(len(streams)),
+        "EW_z": np.zeros(num_features),
+        "EW_z2": np.zeros(num_features),
+        "Drift_weight": 0.0, # Sum of the weights of the bars with features
+        "Last_alert": {}, # Alert -> bar at which it was raised
+        "Sink": sink
+    }
+
+    if features_baseline is not None:
+        monitor["Mean"] = np.asarray(features_baseline["Mean"], dtype=float)
+        std = np.asarray(features_baseline["Std"], dtype=float)
+        monitor["Std"] = np.where(std > 0, std, 1.0) # Constant features are only centered
+
+    return monitor
+
+'''
+Description: Return the values of the error streams of some bars
+Args:
+    price: Market prices (N)
+    target: Next market prices (N)
+    predicted: Predictions (N)
+Return:
+    values: Array (N x streams)
+'''
+def stream_values(price, target, predicted):
+    error = predicted - target
+    correct = ((price < target) & (price < predicted)) | ((price > target) & (price > predicted))
+
+    return np.column_stack([
+        error * error,
+        np.abs(error),
+        np.abs(error) / np.maximum(np.abs(target), np.finfo(np.float64).eps),
+        correct * 100.0
+    ])
+
+'''
+Description: Update the monitor with new bars and return the alerts raised. A single bar costs O(1) (O(features) with the drift), a batch of
+             bars is added at once with vectorized sums, so that very high bar rates can be monitored by passing the bars in batches
+Args:
+    monitor: State of the monitor (updated in place)
+    price: Market price of the bars (a number or an array)
+    target: Next market price of the bars
+    predicted: Predictions of the bars
+    features: Features of the bars (an array of features or a bars x features array), None to skip the drift
+    timestamp: Time of the last bar, written in the alerts (None for the current time)
+Return:
+    alerts: List of the alerts raised (dictionaries), already sent to the sink of the monitor
+'''
+def update_monitor(monitor, price, target, predicted, features=None, timestamp=None):
+    values = stream_values(np.atleast_1d(np.asarray(price, dtype=float)), np.atleast_1d(np.asarray(target, dtype=float)), np.atleast_1d(np.asarray(predicted, dtype=float)))
+    num_bars = len(values)
+    decay = monitor["Decay"]
+
+    # Weight of each new bar in the exponentially weighted sums (the last bar has weight 1 - decay)
+    decay_n = decay ** num_bars
+    weights = (1 - decay) * decay ** np.arange(num_bars - 1, -1, -1)
+
+    monitor["EW"] = decay_n * monitor["EW"] + weights @ values
+    monitor["EW_weight"] = decay_n * monitor["EW_weight"] + weights.sum()
+
+    # Sliding window: the new bars replace the oldest ones of the ring buffer
+    window = monitor["Window"]
+    size = len(window)
+    if num_bars >= size:
+        window[:] = np.roll(values[-size:], (monitor["Bars"] + num_bars) % size, axis=0)
+        monitor["Window_sum"] = window.sum(axis=0)
+    else:
+        positions = (monitor["Bars"] + np.arange(num_bars)) % size
+        monitor["Window_sum"] += values.sum(axis=0) - window[positions].sum(axis=0)
+        window[positions] = values
+        # The running sum is computed again once per window, so the rounding errors don't accumulate
+        if (monitor["Bars"] + num_bars) // size != monitor["Bars"] // size:
+            monitor["Window_sum"] = window.sum(axis=0)
+
+    if features is not None and monitor["Features"]:
+        z = (np.atleast_2d(np.asarray(features, dtype=float)) - monitor["Mean"]) / monitor["Std"]
+        monitor["EW_z"] = decay_n * monitor["EW_z"] + weights @ z
+        monitor["EW_z2"] = decay_n * monitor["EW_z2"] + weights @ (z * z)
+        monitor["Drift_weight"] = decay_n * monitor["Drift_weight"] + weights.sum()
+
+    monitor["Bars"] += num_bars
+
+    alerts = check_monitor(monitor, timestamp)
+    if alerts:
+        emit_alerts(alerts, monitor["Sink"])
+
+    return alerts
+
+'''
+Description: Return the exponentially weighted and the sliding window metrics of the monitor
+Args:
+    monitor: State of the monitor
+Return:
+    metrics: Dictionary (ew | window -> dictionary (RMSE | MAE | MAPE | Accuracy -> value)), None before the first bar
+'''
+def monitor_metrics(monitor):
+    if monitor["Bars"] == 0:
+        return None
+
+    ew = monitor["EW"] / monitor["EW_weight"]
+    window = monitor["Window_sum"] / builtins.min(monitor["Bars"], len(monitor["Window"]))
+
+    return {
+        name: {"RMSE": float(np.sqrt(builtins.max(means[0], 0.0))), "MAE": float(means[1]), "MAPE": float(means[2]), "Accuracy": float(means[3])}
+        for name, means in [("ew", ew), ("window", window)]
+    }
+
+'''
+Description: Return the drift of each feature from the train set: the exponentially weighted mean and variance of the feature standardized
+             with the mean and the standard deviation of the train set (0 and 1 without drift)
+Args:
+    monitor: State of the monitor
+Return:
+    mean_shift: Array of the means (in standard deviations of the train set)
+    variance_ratio: Array of the variances (as a multiple of the ones of the train set)
+'''
+def feature_drift(monitor):
+    mean_shift = monitor["EW_z"] / monitor["Drift_weight"]
+    variance_ratio = np.maximum(monitor["EW_z2"] / monitor["Drift_weight"] - mean_shift * mean_shift, 0.0)
+
+    return mean_shift, variance_ratio
+
+'''
+Description: Return the drift of each feature from the train set (see feature_drift)
+Args:
+    monitor: State of the monitor
+Return:
+    drift: Pandas dataset with one row per feature (Feature, Mean_shift, Variance_ratio)
+'''
+def drift_report(monitor):
+    if monitor["Drift_weight"] == 0:
+        return pd.DataFrame(columns=["Feature", "Mean_shift", "Variance_ratio"])
+
+    mean_shift, variance_ratio = feature_drift(monitor)
+
+    return pd.DataFrame({"Feature": monitor["Features"], "Mean_shift": mean_shift, "Variance_ratio": variance_ratio})
+
+##################
+# --- ALERTS --- #
+##################
+
+'''
+Description: Check the metrics of the monitor against the baselines and return the alerts to be raised. An alert is not raised again
+             until MONITOR_ALERT_COOLDOWN_BARS bars have passed, and no alert is raised during the first MONITOR_MIN_BARS bars
+Args:
+    monitor: State of the monitor (the time of the raised alerts is recorded)
+    timestamp: Time of the last bar (None for the current time)
+Return:
+    alerts: List of dictionaries (Time, Bar, Kind, Name, Window, Value, Baseline)
+'''
+def check_monitor(monitor, timestamp=None):
+    bars = monitor["Bars"]
+    if bars < MONITOR_MIN_BARS:
+        return []
+
+    candidates = []
+    baseline = monitor["Baseline"]
+
+    for window, metrics in monitor_metrics(monitor).items():
+        for metric in ["RMSE", "MAE", "MAPE"]:
+            if baseline.get(metric) is not None and metrics[metric] > baseline[metric] * MONITOR_ERROR_RATIO:
+                candidates.append(("error", metric, window, metrics[metric], baseline[metric]))
+        if baseline.get("Accuracy") is not None and metrics["Accuracy"] < baseline["Accuracy"] - MONITOR_ACCURACY_DROP:
+            candidates.append(("accuracy", "Accuracy", window, metrics["Accuracy"], baseline["Accuracy"]))
+
+    if monitor["Drift_weight"] > 0:
+        mean_shift, variance_ratio = feature_drift(monitor)
+        for i in np.flatnonzero(np.abs(mean_shift) > MONITOR_DRIFT_Z):
+            candidates.append(("drift", monitor["Features"][i], "ew", mean_shift[i], 0.0))
+        for i in np.flatnonzero((variance_ratio > MONITOR_VARIANCE_RATIO) | (variance_ratio < 1 / MONITOR_VARIANCE_RATIO)):
+            candidates.append(("variance", monitor["Features"][i], "ew", variance_ratio[i], 1.0))
+
+    time_value = (timestamp if timestamp is not None else datetime.now()).isoformat(timespec='seconds')
+    alerts = []
+    for kind, name, window, value, reference in candidates:
+        key = f"{kind}:{name}:{window}"
+        if key in monitor["Last_alert"] and bars - monitor["Last_alert"][key] < MONITOR_ALERT_COOLDOWN_BARS:
+            continue
+
+        monitor["Last_alert"][key] = bars
+        alerts.append({"Time": time_value, "Bar": bars, "Kind": kind, "Name": name, "Window": window, "Value": float(value), "Baseline": float(reference)})
+
+    return alerts
+
+'''
+Description: Send the alerts to the sink: appended to a file (one JSON object per line) or printed
+Args:
+    alerts: List of alerts
+    sink: Path of the file (None to print the alerts)
+Return: None
+'''
+def emit_alerts(alerts, sink=None):
+    if sink is None:
+        for alert in alerts:
+            print(f"[{alert['Time']}] {alert['Kind']} alert on {alert['Name']} ({alert['Window']}): {alert['Value']:.6g} (baseline: {alert['Baseline']:.6g})")
+        return
+
+    with open(sink, 'a') as file:
+        file.writelines(json.dumps(alert) + "\n" for alert in alerts)
+
+'''
+Description: Return the alerts saved in a file
+Args:
+    sink: Path of the file
+Return:
+    alerts: Pandas dataset with one row per alert
+'''
+def load_alerts(sink):
+    if not os.path.exists(sink):
+        return pd.DataFrame()
+
+    return pd.read_json(sink, lines=True)
+
+##################
+# --- REPLAY --- #
+##################
+
+'''
+Description: Feed the predictions of a model to the monitor in batches of bars (e.g. to replay the test set as if it were live),
+             returning the metrics after each batch
+Args:
+    monitor: State of the monitor (updated in place)
+    predictions: Pandas dataset with the timestamp, market-price, target, prediction and (optionally) the features of the monitor
+    batch_bars: Bars added at once
+    target_label: The column name of target variable
+Return:
+    history: Pandas dataset with one row per batch (timestamp of the last bar, the exponentially weighted and the sliding window metrics)
+'''
+def replay_predictions(monitor, predictions, batch_bars=1, target_label=TARGET_LABEL):
+    price = predictions['market-price'].to_numpy(dtype=float)
+    target = predictions[target_label].to_numpy(dtype=float)
+    predicted = predictions['prediction'].to_numpy(dtype=float)
+    features = predictions[monitor["Features"]].to_numpy(dtype=float) if monitor["Features"] and set(monitor["Features"]) <= set(predictions.columns) else None
+    timestamps = pd.to_datetime(predictions['timestamp']).tolist()
+
+    history = []
+    for first in range(0, len(predictions), batch_bars):
+        last = builtins.min(first + batch_bars, len(predictions))
+        update_monitor(monitor, price[first:last], target[first:last], predicted[first:last], features[first:last] if features is not None else None, timestamps[last - 1])
+
+        metrics = monitor_metrics(monitor)
+        history.append({"timestamp": timestamps[last - 1], **{f"{metric}_{name}": value for name, values in metrics.items() for metric, value in values.items()}})
+
+    return pd.DataFrame(history)
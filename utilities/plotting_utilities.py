@@ -0,0 +1,279 @@
+from imports import *
+from config import *
+from collection_utilities import collect_pandas
+
+######################
+# --- COLLECTION --- #
+######################
+
+# Sources already collected to the driver (least recently used first)
+collected_sources = OrderedDict()
+
+'''
+Description: Return the selected columns of the source as a Pandas dataset. Spark datasets are collected only once:
+             the result is cached (by the hash of the Spark plan) and reused by the next plots of the same source
+Args:
+    source: Spark or Pandas dataset
+    columns: Columns to be returned
+Return:
+    dataset: Pandas dataset containing only the selected columns
+'''
+def collect(source, columns):
+    if isinstance(source, pd.DataFrame):
+        return source[columns]
+
+    # Collect only the columns to be plotted, in chronological order (the datasets are not read in order)
+    source = source.select(*columns)
+    if "timestamp" in columns:
+        source = source.orderBy("timestamp")
+    key = (source.semanticHash(), tuple(columns))
+
+    if key in collected_sources:
+        collected_sources.move_to_end(key)
+    else:
+        collected_sources[key] = collect_pandas(source, "plot")
+
+        # Keep only the most recent sources
+        if len(collected_sources) > PLOT_CACHE_SIZE:
+            collected_sources.popitem(last=False)
+
+    return collected_sources[key]
+
+'''
+Description: Empty the cache of the collected sources
+Args: None
+Return: None
+'''
+def clear_cache():
+    collected_sources.clear()
+
+########################
+# --- DOWNSAMPLING --- #
+########################
+
+'''
+Description: Return the indexes of the points selected by the Largest-Triangle-Three-Buckets algorithm, which keeps the shape of the series
+             (peaks and drops included) using only a fraction of its points
+Args:
+    x: Values of the x axis (numeric)
+    y: Values of the y axis (numeric)
+    threshold: Number of points to be kept
+Return:
+    indexes: Indexes of the selected points
+'''
+def lttb(x, y, threshold):
+    num = len(x)
+    if threshold >= num or threshold < 3:
+        return np.arange(num)
+
+    # Size of each bucket (the first and the last points are always kept)
+    every = (num - 2) / (threshold - 2)
+
+    indexes = np.empty(threshold, dtype=np.int64)
+    indexes[0] = 0
+    indexes[-1] = num - 1
+
+    selected = 0
+    for i in range(threshold - 2):
+        # Average point of the next bucket
+        next_start = int((i + 1) * every) + 1
+        next_end = builtins.min(int((i + 2) * every) + 1, num)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        # Point of the current bucket forming the largest triangle with the last selected point and the average point
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        areas = np.abs((x[selected] - avg_x) * (y[start:end] - y[selected]) - (x[selected] - x[start:end]) * (avg_y - y[selected]))
+        selected = start + int(np.argmax(areas))
+
+        indexes[i + 1] = selected
+
+    return indexes
+
+'''
+Description: Return a WebGL line trace of the series downsampled to the number of points that can actually be displayed
+Args:
+    x: Timestamps of the series
+    y: Values of the series
+    name: Name of the trace
+    max_points: Maximum number of points of the trace
+Return:
+    trace: Plotly trace
+'''
+def line_trace(x, y, name, max_points=PLOT_MAX_POINTS):
+    x = pd.to_datetime(pd.Series(x)).to_numpy()
+    y = np.asarray(y, dtype=float)
+
+    # Missing values can't be plotted
+    valid = ~np.isnan(y)
+    x = x[valid]
+    y = y[valid]
+
+    # Downsample the series
+    indexes = lttb(x.astype("int64").astype(float), y, max_points)
+
+    trace = go.Scattergl(
+        x = x[indexes],
+        y = y[indexes],
+        mode = 'lines',
+        name = name
+    )
+
+    return trace
+
+'''
+Description: Return the line trace of a column of the source
+Args:
+    source: Spark or Pandas dataset
+    column: Column to be plotted
+    name: Name of the trace
+Return:
+    trace: Plotly trace
+'''
+def source_trace(source, column, name):
+    dataset = collect(source, ['timestamp', column])
+
+    return line_trace(dataset['timestamp'], dataset[column], name)
+
+###################
+# --- FIGURES --- #
+###################
+
+'''
+Description: Return the layout of the time series plots
+Args:
+    title: Chart title
+Return:
+    layout: Plotly layout
+'''
+def time_series_layout(title):
+    layout = go.Layout(
+        title=title,
+        xaxis=dict(
+            rangeselector=dict(
+                buttons=list([
+                    # Change the count to desired amount of months.
+                    dict(count=1,
+                        label='1m',
+                        step='month',
+                        stepmode='backward'),
+                    dict(count=6,
+                        label='6m',
+                        step='month',
+                        stepmode='backward'),
+                    dict(count=12,
+                        label='1y',
+                        step='month',
+                        stepmode='backward'),
+                    dict(count=36,
+                        label='3y',
+                        step='month',
+                        stepmode='backward'),
+                    dict(step='all')
+                ])
+            ),
+            rangeslider=dict(
+                visible = True
+            ),
+            type='date'
+        )
+    )
+
+    return layout
+
+'''
+Description: Show a time series plot
+Args:
+    traces: List of (source, column, name) of the series to be plotted
+    title: Chart title
+Return: None
+'''
+def show_time_series(traces, title):
+    data = [source_trace(source, column, name) for source, column, name in traces]
+
+    fig = go.Figure(data=data, layout=time_series_layout(title))
+    fig.show()
+
+##################
+# --- EXPORT --- #
+##################
+
+# Figures waiting to be exported as (figure json, path)
+export_queue = []
+
+'''
+Description: Add a figure to the images to be exported by export_images
+Args:
+    fig: Plotly figure
+    path: Path of the image
+Return: None
+'''
+def queue_image(fig, path):
+    export_queue.append((fig.to_json(), path))
+
+'''
+Description: Start the image renderer of a worker process (it is then reused by all the images rendered by the worker)
+Args: None
+Return: None
+'''
+def start_renderer():
+    pio.to_image(go.Figure(), format="png")
+
+'''
+Description: Render a figure as an image
+Args:
+    spec: Tuple (figure json, path)
+Return:
+    path: Path of the image
+'''
+def render_image(spec):
+    fig_json, path = spec
+    pio.write_image(pio.from_json(fig_json), path)
+
+    return path
+
+'''
+Description: Export all the queued figures in parallel. A figure is rendered again only if its content (data and layout) has changed
+             since the last export, the hashes of the exported figures are saved in a manifest in the directory of the images
+Args:
+    workers: Number of renderer processes
+Return: None
+'''
+def export_images(workers=EXPORT_WORKERS):
+    # Keep only the last figure queued for each path
+    specs = dict((path, fig_json) for fig_json, path in export_queue)
+    export_queue.clear()
+
+    manifests = {}
+    to_render = []
+    for path, fig_json in specs.items():
+        # Load the manifest of the directory
+        directory = os.path.dirname(path)
+        if directory not in manifests:
+            manifest_path = os.path.join(directory, EXPORT_MANIFEST_NAME)
+            manifests[directory] = {}
+            if os.path.exists(manifest_path):
+                with open(manifest_path) as file:
+                    manifests[directory] = json.load(file)
+
+        # Skip the figures that have not changed
+        fig_hash = hashlib.sha256(fig_json.encode()).hexdigest()
+        if manifests[directory].get(os.path.basename(path)) == fig_hash and os.path.exists(path):
+            continue
+
+        manifests[directory][os.path.basename(path)] = fig_hash
+        to_render.append((fig_json, path))
+
+    # Render the images
+    if to_render:
+        with ProcessPoolExecutor(max_workers=builtins.min(workers, len(to_render)), initializer=start_renderer) as executor:
+            for path in executor.map(render_image, to_render):
+                print("Image saved:", path)
+
+    # Save the manifests
+    for directory, manifest in manifests.items():
+        with open(os.path.join(directory, EXPORT_MANIFEST_NAME), 'w') as file:
+            json.dump(manifest, file, indent=4)
+
+    print(f"Exported {len(to_render)} images ({len(specs) - len(to_render)} unchanged)")
@@ -0,0 +1,253 @@
+from imports import *
+from config import *
+
+#################
+# --- INDEX --- #
+#################
+
+# Registries already read (models dir -> registry)
+loaded_registries = {}
+
+'''
+Description: Return the registry of the saved models. The registry is read from disk only the first time, the next lookups use the copy in memory
+Args:
+    models_dir: Directory containing the models and the registry
+    reload: Read the registry from disk again
+Return:
+    registry: List of the registered models (one dictionary for each saved model)
+'''
+def load_registry(models_dir, reload=False):
+    if reload or models_dir not in loaded_registries:
+        registry_path = models_dir + "/" + MODEL_REGISTRY_NAME
+        loaded_registries[models_dir] = []
+        if os.path.exists(registry_path):
+            with open(registry_path) as file:
+                loaded_registries[models_dir] = json.load(file)["models"]
+
+    return loaded_registries[models_dir]
+
+'''
+Description: Save the registry, writing a temporary file first so that the registry is never left half written
+Args:
+    models_dir: Directory containing the models and the registry
+    registry: List of the registered models
+Return: None
+'''
+def save_registry(models_dir, registry):
+    registry_path = models_dir + "/" + MODEL_REGISTRY_NAME
+
+    with open(registry_path + ".tmp", 'w') as file:
+        json.dump({"models": registry}, file, indent=4)
+    os.replace(registry_path + ".tmp", registry_path)
+
+    loaded_registries[models_dir] = registry
+
+'''
+Description: Convert a value to a type that can be saved in the registry
+Args:
+    value: Value to be converted
+Return:
+    value: Converted value
+'''
+def to_json_value(value):
+    if isinstance(value, (list, tuple, np.ndarray)):
+        value = value[0] # Parameters are given as the single value grid of the model
+    if isinstance(value, np.generic):
+        return value.item()
+
+    return value
+
+'''
+Description: Return the fingerprint of the training data (schema, number of rows, time interval and sum of the target),
+             which changes whenever the model would be trained on different data
+Args:
+    dataset: Dataset used to train the model
+    target_label: The column name of target variable
+Return:
+    fingerprint: Hash of the dataset
+'''
+def data_fingerprint(dataset, target_label):
+    stats = dataset.agg(F.count("*"), F.min("timestamp"), F.max("timestamp"), F.sum(target_label)).collect()[0]
+
+    return hashlib.sha256((dataset.schema.json() + str(list(stats))).encode()).hexdigest()
+
+####################
+# --- REGISTER --- #
+####################
+
+'''
+Description: Save a trained model in a new version directory (models/<model name>/v<version>) and record it in the registry
+Args:
+    models_dir: Directory containing the models and the registry
+    pipeline_model: Trained pipeline model
+    model_name: Name of the model
+    params: Parameters of the model (dictionary of single value lists, as returned by get_best_model_params)
+    features_label: Name of the features used (with the "_norm" suffix if they are normalized)
+    features: List of the features used
+    features_normalization: Indicates whether features are normalized or not
+    dataset: Dataset used to train the model
+    results: Pandas dataset containing the metrics of the model (RMSE, MSE, MAE, MAPE, R2, Adjusted_R2)
+Return:
+    entry: Registered model
+'''
+def register_model(models_dir, pipeline_model, model_name, params, features_label, features, features_normalization, dataset, results):
+    registry = list(load_registry(models_dir, reload=True))
+
+    version = builtins.max([entry["Version"] for entry in registry if entry["Model_name"] == model_name], default=0) + 1
+    path = model_name + "/v" + str(version)
+
+    pipeline_model.write().overwrite().save(models_dir + "/" + path)
+
+    entry = {
+        "Model_name": model_name,
+        "Version": version,
+        "Path": path,
+        "Parameters": {param: to_json_value(value) for param, value in params.items()},
+        "Features_label": features_label,
+        "Features": list(features),
+        "Normalization": bool(features_normalization),
+        "Data_fingerprint": data_fingerprint(dataset, TARGET_LABEL),
+        "Metrics": {metric: to_json_value(results[metric].iloc[-1]) for metric in ['RMSE', 'MSE', 'MAE', 'MAPE', 'R2', 'Adjusted_R2']},
+        "Created": datetime.now().isoformat(timespec='seconds')
+    }
+
+    registry.append(entry)
+    save_registry(models_dir, registry)
+
+    print(f"Model saved: {model_name} v{version} ({path})")
+
+    return entry
+
+'''
+Description: Record in the registry the models saved by the previous versions directly in models/<model name>, only for the models
+             which are not already registered. Parameters, features and metrics are taken from the tuned results
+Args:
+    models_dir: Directory containing the models and the registry
+    tuned_results: Pandas dataset containing the results of the tuned models (one row per model)
+    features_dict: Dictionary (features label -> list of features)
+Return: None
+'''
+def import_saved_models(models_dir, tuned_results, features_dict):
+    registry = list(load_registry(models_dir, reload=True))
+    registered = set(entry["Model_name"] for entry in registry)
+
+    for row in tuned_results.to_dict("records"):
+        model_name = row["Model"]
+        if model_name in registered or not os.path.isdir(models_dir + "/" + model_name + "/metadata"):
+            continue
+
+        features_normalization = row["Features"].endswith("_norm")
+        parameters = {param: to_json_value(row[param]) for param in MODEL_PARAMETERS[model_name] if param in row}
+
+        registry.append({
+            "Model_name": model_name,
+            "Version": 0,
+            "Path": model_name,
+            "Parameters": parameters,
+            "Features_label": row["Features"],
+            "Features": features_dict[row["Features"].replace("_norm", "")],
+            "Normalization": features_normalization,
+            "Data_fingerprint": None,
+            "Metrics": {metric: to_json_value(row[metric]) for metric in ['RMSE', 'MSE', 'MAE', 'MAPE', 'R2', 'Adjusted_R2']},
+            "Created": None
+        })
+        registered.add(model_name)
+        print("Model imported:", model_name)
+
+    save_registry(models_dir, registry)
+
+##################
+# --- LOOKUP --- #
+##################
+
+'''
+Description: Return the registered models matching the filters
+Args:
+    models_dir: Directory containing the models and the registry
+    filters: Keys to be filtered (e.g. Model_name="LinearRegression", Features_label="base_features")
+Return:
+    models: Pandas dataset of the registered models (one row per model)
+'''
+def list_models(models_dir, **filters):
+    entries = [entry for entry in load_registry(models_dir) if all(entry[key] == value for key, value in filters.items())]
+
+    return pd.DataFrame(entries)
+
+'''
+Description: Return the best registered model matching the filters (e.g. the best model for a features set) without loading any model
+Args:
+    models_dir: Directory containing the models and the registry
+    metric: Metric used to compare the models
+    filters: Keys to be filtered (e.g. Model_name="LinearRegression", Features_label="base_features")
+Return:
+    entry: Best registered model (the latest one in case of ties)
+'''
+def best_model(models_dir, metric="RMSE", **filters):
+    entries = [entry for entry in load_registry(models_dir) if all(entry[key] == value for key, value in filters.items())]
+    if not entries:
+        raise ValueError(f"No registered model matches {filters}")
+
+    # The higher the R2 the better, the lower the errors the better
+    sign = -1 if metric in ['R2', 'Adjusted_R2'] else 1
+
+    return builtins.min(reversed(entries), key=lambda entry: sign * entry["Metrics"][metric])
+
+'''
+Description: Return the latest registered model matching the filters without loading any model
+Args:
+    models_dir: Directory containing the models and the registry
+    filters: Keys to be filtered (e.g. Model_name="LinearRegression")
+Return:
+    entry: Latest registered model
+'''
+def latest_model(models_dir, **filters):
+    entries = [entry for entry in load_registry(models_dir) if all(entry[key] == value for key, value in filters.items())]
+    if not entries:
+        raise ValueError(f"No registered model matches {filters}")
+
+    return builtins.max(entries, key=lambda entry: entry["Version"])
+
+'''
+Description: Return the parameters needed to make predictions with a registered model (the model is loaded only when it is used)
+Args:
+    models_dir: Directory containing the models and the registry
+    entry: Registered model
+Return:
+    model_params: Dictionary with the name, the path, the features and the normalization of the model
+'''
+def get_model_params(models_dir, entry):
+    model_params = {
+        "Model_name": entry["Model_name"],
+        "Model_path": models_dir + "/" + entry["Path"],
+        "Features_label": entry["Features_label"],
+        "Features": entry["Features"],
+        "Normalization": entry["Normalization"]
+    }
+
+    return model_params
+
+#################
+# --- CACHE --- #
+#################
+
+# Models already loaded (least recently used first)
+loaded_models = OrderedDict()
+
+'''
+Description: Return the pipeline model saved in the path. Models are loaded on first use and only the most recently used ones are kept in memory
+Args:
+    model_path: Path of the model
+Return:
+    model: Pipeline model
+'''
+def load_model(model_path):
+    if model_path in loaded_models:
+        loaded_models.move_to_end(model_path)
+    else:
+        loaded_models[model_path] = PipelineModel.load(model_path)
+
+        # Keep only the most recent models
+        if len(loaded_models) > MODEL_CACHE_SIZE:
+            loaded_models.popitem(last=False)
+
+    return loaded_models[model_path]
@@ -0,0 +1,296 @@
+from imports import *
+from config import *
+
+##################
+# --- SCHEMA --- #
+##################
+
+# Columns describing each result
+info_columns = [
+    ("Model", "TEXT NOT NULL"),
+    ("Type", "TEXT NOT NULL"),
+    ("Dataset", "TEXT NOT NULL"),
+    ("Splitting", "TEXT NOT NULL"),
+    ("Features", "TEXT NOT NULL"),
+    ("Normalization", "INTEGER NOT NULL"),
+    ("Scope", "TEXT NOT NULL"), # all: all the results of the phase | rel: results of the best default model and of the tuned model | horizon: results of the multiple horizons | timeout: configurations of the tuning stopped by the time budgets
+    ("Horizon", "TEXT"), # Horizon of the target (NULL for the next bar)
+    ("Status", "TEXT") # timeout or skipped for the configurations stopped by the time budgets (NULL for the evaluated ones)
+]
+
+# Parameters of all the models (those not used by a model are NULL)
+parameters_columns = [
+    ("maxIter", "INTEGER"),
+    ("regParam", "REAL"),
+    ("elasticNetParam", "REAL"),
+    ("family", "TEXT"),
+    ("link", "TEXT"),
+    ("numTrees", "INTEGER"),
+    ("maxDepth", "INTEGER"),
+    ("stepSize", "REAL"),
+    ("seed", "INTEGER")
+]
+
+# Evaluation metrics
+metrics_columns = [
+    ("RMSE", "REAL"),
+    ("MSE", "REAL"),
+    ("MAE", "REAL"),
+    ("MAPE", "REAL"),
+    ("R2", "REAL"),
+    ("Adjusted_R2", "REAL"),
+    ("Time", "REAL")
+]
+
+# Columns of the accuracy table
+accuracy_columns = [
+    ("Model", "TEXT NOT NULL"),
+    ("Features", "TEXT NOT NULL"),
+    ("Normalization", "INTEGER NOT NULL"),
+    ("Splitting", "TEXT NOT NULL"),
+    ("Accuracy (default)", "REAL"),
+    ("Accuracy (tuned)", "REAL")
+]
+
+tables = {
+    "results": info_columns + parameters_columns + metrics_columns,
+    "accuracy": accuracy_columns
+}
+
+# Indexed columns of each table
+indexes = {
+    "results": ["Model", "Splitting", "Features", "Type"],
+    "accuracy": ["Model", "Splitting", "Features"]
+}
+
+'''
+Description: Open the results warehouse, creating its tables and indexes if they don't exist and adding the columns missing
+             in the warehouses created by the previous versions
+Args:
+    path: Path of the warehouse
+Return:
+    connection: SQLite connection
+'''
+def connect(path):
+    connection = sqlite3.connect(path)
+
+    for table, columns in tables.items():
+        definition = ", ".join(f'"{name}" {sql_type}' for name, sql_type in columns)
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ({definition})")
+
+        existing_columns = set(row[1] for row in connection.execute(f"PRAGMA table_info({table})"))
+        for name, sql_type in columns:
+            if name not in existing_columns:
+                connection.execute(f'ALTER TABLE {table} ADD COLUMN "{name}" {sql_type}')
+
+        for column in indexes[table]:
+            connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_{column.lower()} ON {table} ("{column}")')
+
+    return connection
+
+#################
+# --- WRITE --- #
+#################
+
+'''
+Description: Convert a value to a type that can be saved in the warehouse
+Args:
+    value: Value to be converted
+Return:
+    value: Converted value
+'''
+def to_sql_value(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (bool, np.bool_)):
+        return int(value)
+
+    return value
+
+'''
+Description: Return the parameters of a result as a dictionary (parameter -> value)
+Args:
+    model_name: Name of the model
+    parameters: List of the parameter values (or its string representation)
+Return:
+    parameters: Dictionary of the parameters
+'''
+def parameters_dict(model_name, parameters):
+    if isinstance(parameters, str):
+        parameters = ast.literal_eval(parameters)
+
+    return dict(zip(MODEL_PARAMETERS[model_name], parameters))
+
+'''
+Description: Insert some rows in a table of the warehouse, replacing the ones previously saved for the same models and splitting methods
+Args:
+    path: Path of the warehouse
+    table: Table to be updated [results | accuracy]
+    rows: List of dictionaries (column -> value)
+    scope: Scope of the rows of the results table [all | rel | horizon | timeout], None for the accuracy table
+    keys: List of (model, splitting method) whose previous rows are replaced even if there are no new rows for them
+          (e.g. a tuning without timeouts removes the timeouts of the previous run)
+Return: None
+'''
+def insert_rows(path, table, rows, scope=None, keys=()):
+    columns = [name for name, _ in tables[table]]
+    column_names = ", ".join(f'"{name}"' for name in columns)
+    placeholders = ", ".join("?" for _ in columns)
+
+    connection = connect(path)
+    with connection:
+        # Remove the results of the previous runs
+        for model, splitting in set((row["Model"], row["Splitting"]) for row in rows) | set(keys):
+            if scope is None:
+                connection.execute(f'DELETE FROM {table} WHERE "Model" = ? AND "Splitting" = ?', (model, splitting))
+            else:
+                connection.execute(f'DELETE FROM {table} WHERE "Model" = ? AND "Splitting" = ? AND "Scope" = ?', (model, splitting, scope))
+
+        connection.executemany(
+            f"INSERT INTO {table} ({column_names}) VALUES ({placeholders})",
+            [tuple(to_sql_value(row.get(column)) for column in columns) for row in rows]
+        )
+    connection.close()
+
+'''
+Description: Save the results of a train / validation phase in the warehouse
+Args:
+    path: Path of the warehouse
+    results: Pandas dataset with the columns Model, Type, Dataset, Splitting, Features, Parameters (Horizon optional) and the evaluation metrics
+    scope: Scope of the results [all | rel | horizon | timeout]
+    keys: List of (model, splitting method) whose previous results are replaced even if there are no new results for them
+Return: None
+'''
+def save_results(path, results, scope, keys=()):
+    rows = []
+    for row in results.to_dict("records"):
+        parameters = parameters_dict(row["Model"], row.pop("Parameters"))
+        rows.append({**row, **parameters, "Normalization": row["Features"].endswith("_norm"), "Scope": scope})
+
+    insert_rows(path, "results", rows, scope, keys)
+
+'''
+Description: Save the accuracy of a train / validation phase in the warehouse
+Args:
+    path: Path of the warehouse
+    accuracy: Pandas dataset with the columns Model, Features, Splitting, Accuracy (default) and Accuracy (tuned)
+Return: None
+'''
+def save_accuracy(path, accuracy):
+    rows = [{**row, "Normalization": row["Features"].endswith("_norm")} for row in accuracy.to_dict("records")]
+
+    insert_rows(path, "accuracy", rows)
+
+'''
+Description: Load in the warehouse the results saved as CSV files by the previous versions, only for the models and splitting methods
+             which are not already in the warehouse
+Args:
+    path: Path of the warehouse
+    result_dir: Directory containing the results
+    splits_list: List of splitting methods
+    models_list: List of models
+Return: None
+'''
+def import_csv_results(path, result_dir, splits_list, models_list):
+    connection = connect(path)
+    saved = set(connection.execute('SELECT DISTINCT "Splitting", "Model" FROM results').fetchall())
+    connection.close()
+
+    for split in splits_list:
+        for model in models_list:
+            prefix = result_dir + "/" + split + "/" + model
+            if (split, model) in saved or not os.path.exists(prefix + "_all.csv"):
+                continue
+
+            save_results(path, pd.read_csv(prefix + "_all.csv"), "all")
+            save_results(path, pd.read_csv(prefix + "_rel.csv"), "rel")
+            save_accuracy(path, pd.read_csv(prefix + "_accuracy.csv"))
+            print("Results imported:", prefix)
+
+################
+# --- READ --- #
+################
+
+'''
+Description: Return the WHERE clause and its arguments for the selected filters
+Args:
+    table: Table to be queried [results | accuracy]
+    filters: Dictionary (column -> value or list of values)
+Return:
+    where: WHERE clause (empty if there are no filters)
+    args: Arguments of the clause
+'''
+def where_clause(table, filters):
+    columns = [name for name, _ in tables[table]]
+    conditions = []
+    args = []
+
+    for column, value in filters.items():
+        if column not in columns:
+            raise ValueError(f"Unknown column of the {table} table: {column}")
+
+        values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+        conditions.append(f'"{column}" IN ({", ".join("?" for _ in values)})')
+        args += [to_sql_value(value) for value in values]
+
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+
+    return where, args
+
+'''
+Description: Return the train / validation results matching the filters, e.g. query_results(path, "all", Dataset="valid", Type=["default", "default_norm"])
+Args:
+    path: Path of the warehouse
+    scope: Scope of the results [all | rel | horizon | timeout]
+    filters: Columns to be filtered (column=value or column=list of values)
+Return:
+    results: Pandas dataset with the selected results
+'''
+def query_results(path, scope, **filters):
+    where, args = where_clause("results", {"Scope": scope, **filters})
+
+    connection = connect(path)
+    results = pd.read_sql_query(f"SELECT * FROM results {where} ORDER BY rowid", connection, params=args)
+    connection.close()
+
+    return results.drop(columns="Scope")
+
+'''
+Description: Return the train / validation accuracy matching the filters
+Args:
+    path: Path of the warehouse
+    filters: Columns to be filtered (column=value or column=list of values)
+Return:
+    accuracy: Pandas dataset with the selected accuracy
+'''
+def query_accuracy(path, **filters):
+    where, args = where_clause("accuracy", filters)
+
+    connection = connect(path)
+    accuracy = pd.read_sql_query(f"SELECT * FROM accuracy {where} ORDER BY rowid", connection, params=args)
+    connection.close()
+
+    return accuracy
+
+'''
+Description: Return the metrics of the train / validation results matching the filters aggregated by the selected columns
+Args:
+    path: Path of the warehouse
+    scope: Scope of the results [all | rel | horizon | timeout]
+    by: Columns to group by
+    aggregations: Dictionary (metric -> SQL aggregate function, e.g. {"RMSE": "MIN"})
+    filters: Columns to be filtered (column=value or column=list of values)
+Return:
+    summary: Pandas dataset with the aggregated metrics
+'''
+def summarize_results(path, scope, by, aggregations, **filters):
+    where, args = where_clause("results", {"Scope": scope, **filters})
+
+    group_columns = ", ".join(f'"{column}"' for column in by)
+    aggregated_columns = ", ".join(f'{function}("{metric}") AS "{metric}"' for metric, function in aggregations.items())
+
+    connection = connect(path)
+    summary = pd.read_sql_query(f"SELECT {group_columns}, {aggregated_columns} FROM results {where} GROUP BY {group_columns} ORDER BY {group_columns}", connection, params=args)
+    connection.close()
+
+    return summary
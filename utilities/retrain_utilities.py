@@ -0,0 +1,289 @@
+from imports import *
+from config import *
+from dataset_utilities import read_dataset, filter_by_timestamp
+from train_validation_utilities import get_best_model_params, select_features, model_selection, model_evaluation
+from registry_utilities import latest_model, register_model
+
+#################
+# --- STATE --- #
+#################
+
+'''
+Description: Return the state of the scheduler (id of the last bar and time of the last retrain)
+Args:
+    models_dir: Directory containing the models and the registry
+Return:
+    state: Dictionary with the keys Last_id and Last_time (None if no retrain has been done yet)
+'''
+def load_state(models_dir):
+    state_path = models_dir + "/" + RETRAIN_STATE_NAME
+
+    if not os.path.exists(state_path):
+        return {"Last_id": None, "Last_time": None}
+
+    with open(state_path) as file:
+        return json.load(file)
+
+'''
+Description: Save the state of the scheduler, writing a temporary file first so that the state is never left half written
+Args:
+    models_dir: Directory containing the models and the registry
+    state: Dictionary with the keys Last_id and Last_time
+Return: None
+'''
+def save_state(models_dir, state):
+    state_path = models_dir + "/" + RETRAIN_STATE_NAME
+
+    with open(state_path + ".tmp", 'w') as file:
+        json.dump(state, file, indent=4)
+    os.replace(state_path + ".tmp", state_path)
+
+'''
+Description: Append the outcome of a retrain to the retrain log (one JSON object per line)
+Args:
+    models_dir: Directory containing the models and the registry
+    record: Dictionary describing the retrain of a model
+Return: None
+'''
+def log_retrain(models_dir, record):
+    with open(models_dir + "/" + RETRAIN_LOG_NAME, 'a') as file:
+        file.write(json.dumps(record) + "\n")
+
+'''
+Description: Return the retrain log
+Args:
+    models_dir: Directory containing the models and the registry
+Return:
+    log: Pandas dataset with one row per retrained model
+'''
+def load_retrain_log(models_dir):
+    log_path = models_dir + "/" + RETRAIN_LOG_NAME
+    if not os.path.exists(log_path):
+        return pd.DataFrame()
+
+    return pd.read_json(log_path, lines=True)
+
+###################
+# --- TRIGGER --- #
+###################
+
+'''
+Description: Check whether a retrain is due: enough new bars have arrived or enough time has passed since the previous retrain (with at least one new bar)
+Args:
+    state: State of the scheduler
+    last_id: Id of the last bar of the dataset
+    now: Current time
+Return:
+    due: True if the models should be retrained
+'''
+def retrain_due(state, last_id, now):
+    if state["Last_id"] is None:
+        return True
+    if last_id <= state["Last_id"]:
+        return False
+
+    new_bars = last_id - state["Last_id"]
+    elapsed_seconds = (now - datetime.fromisoformat(state["Last_time"])).total_seconds()
+
+    return new_bars >= RETRAIN_EVERY_BARS or elapsed_seconds >= RETRAIN_EVERY_SECONDS
+
+'''
+Description: Return the maximum duration of a retrain, which is never longer than the interval between two retrains so that they never overlap
+Args: None
+Return:
+    seconds: Maximum duration of a retrain
+'''
+def retrain_deadline():
+    bar_seconds = 24 * 60 * 60 // BARS_PER_DAY[DATASET_RESOLUTION]
+
+    return builtins.min(RETRAIN_DEADLINE_SECONDS, RETRAIN_EVERY_SECONDS, RETRAIN_EVERY_BARS * bar_seconds)
+
+####################
+# --- FEATURES --- #
+####################
+
+# Assembled windows ((features, normalization) -> (window, dataset)), shared by the models using the same features
+cached_windows = {}
+
+'''
+Description: Return the assembled features of the rolling window. Only the rows of the window are assembled and the result is cached,
+             so the models using the same features are trained on the same cached dataset
+Args:
+    dataset: The whole dataset
+    window: Interval (start, end] of the timestamps of the window
+    features: Features to be used
+    features_normalization: Indicates whether features should be normalized or not
+Return:
+    dataset: Cached dataset of the window with the assembled features
+'''
+def window_features(dataset, window, features, features_normalization):
+    key = (tuple(features), bool(features_normalization))
+    if key in cached_windows:
+        cached_window, cached_dataset = cached_windows[key]
+        if cached_window == window:
+            return cached_dataset
+        cached_dataset.unpersist()
+
+    start, end = window
+    assembled = select_features(filter_by_timestamp(dataset, start, end), features_normalization, features, FEATURES_LABEL, TARGET_LABEL)
+    assembled.cache()
+    cached_windows[key] = (window, assembled)
+
+    return assembled
+
+'''
+Description: Release the cached windows
+Args: None
+Return: None
+'''
+def release_windows():
+    for _, cached_dataset in cached_windows.values():
+        cached_dataset.unpersist()
+    cached_windows.clear()
+
+###################
+# --- RETRAIN --- #
+###################
+
+'''
+Description: Retrain a registered model on the rolling window with its tuned parameters and publish it as a new version of the registry.
+             The Spark jobs run in their own job group, which is cancelled when the deadline is reached: in that case the model is not
+             published and the previous version stays the latest one
+Args:
+    spark: Spark session
+    models_dir: Directory containing the models and the registry
+    dataset: The whole dataset
+    entry: Registered model to be retrained
+    window: Interval (start, end] of the timestamps of the window
+    deadline: Time (as returned by time.time()) by which the retrain must end
+Return:
+    record: Dictionary describing the retrain (status, version, fit latency)
+'''
+def retrain_model(spark, models_dir, dataset, entry, window, deadline):
+    model_name = entry["Model_name"]
+    record = {
+        "Model_name": model_name,
+        "Version": None,
+        "Window_start": window[0].isoformat(),
+        "Window_end": window[1].isoformat(),
+        "Rows": None,
+        "Fit_seconds": None,
+        "Total_seconds": None,
+        "Status": "skipped",
+        "Time": datetime.now().isoformat(timespec='seconds')
+    }
+
+    if time.time() >= deadline:
+        return record
+
+    # Tuned parameters of the latest version
+    params = get_best_model_params([entry["Parameters"][param] for param in MODEL_PARAMETERS[model_name]], model_name)
+    pipeline = Pipeline(stages=[model_selection(model_name, {param: values[0] for param, values in params.items()}, FEATURES_LABEL, TARGET_LABEL)])
+
+    group = "retrain-" + model_name
+    spark.sparkContext.setJobGroup(group, "Rolling retrain of " + model_name, interruptOnCancel=True)
+    spark.sparkContext.setLocalProperty(FIT_DEADLINE_PROPERTY, str(deadline))
+    timer = threading.Timer(deadline - time.time(), spark.sparkContext.cancelJobGroup, args=[group])
+    timer.start()
+
+    start = time.time()
+    try:
+        train_data = window_features(dataset, window, entry["Features"], entry["Normalization"])
+        record["Rows"] = train_data.count()
+
+        # Train the model and calculate running time
+        fit_start = time.time()
+        pipeline_model = pipeline.fit(train_data)
+        record["Fit_seconds"] = time.time() - fit_start
+
+        # Metrics on the window, saved in the registry
+        predictions = pipeline_model.transform(train_data).select(TARGET_LABEL, "market-price", "prediction", 'timestamp')
+        eval_res = model_evaluation(TARGET_LABEL, predictions)
+        results = pd.DataFrame([{"RMSE": eval_res['rmse'], "MSE": eval_res['mse'], "MAE": eval_res['mae'], "MAPE": eval_res['mape'], "R2": eval_res['r2'], "Adjusted_R2": eval_res['adj_r2']}])
+    except (Py4JJavaError, TimeoutError):
+        if time.time() < deadline:
+            raise
+        record["Status"] = "timeout"
+        record["Total_seconds"] = time.time() - start
+        return record
+    finally:
+        timer.cancel()
+        spark.sparkContext.setLocalProperty("spark.jobGroup.id", None)
+        spark.sparkContext.setLocalProperty(FIT_DEADLINE_PROPERTY, None)
+
+    if time.time() >= deadline:
+        record["Status"] = "timeout"
+    else:
+        # The model is saved in a new version directory and the registry is replaced atomically, so readers never see a partial model
+        published = register_model(models_dir, pipeline_model, model_name, params, entry["Features_label"], entry["Features"], entry["Normalization"], train_data, results)
+        record["Version"] = published["Version"]
+        record["Status"] = "published"
+
+    record["Total_seconds"] = time.time() - start
+
+    return record
+
+'''
+Description: Retrain the latest registered version of each model on the rolling window ending at the last bar of the dataset
+Args:
+    spark: Spark session
+    models_dir: Directory containing the models and the registry
+    dataset: The whole dataset
+    models_list: List of models to be retrained
+Return:
+    records: Pandas dataset with the outcome of the retrain of each model
+'''
+def retrain_models(spark, models_dir, dataset, models_list):
+    deadline = time.time() + retrain_deadline()
+
+    last_timestamp = dataset.agg(F.max("timestamp")).collect()[0][0]
+    window = (last_timestamp - relativedelta(days=RETRAIN_WINDOW_DAYS), last_timestamp)
+
+    # Models using the same features are retrained one after the other, while their window is cached
+    entries = sorted((latest_model(models_dir, Model_name=model_name) for model_name in models_list), key=lambda entry: (entry["Features"], entry["Normalization"]))
+
+    records = []
+    try:
+        for entry in entries:
+            record = retrain_model(spark, models_dir, dataset, entry, window, deadline)
+            log_retrain(models_dir, record)
+            records.append(record)
+            print(f"{record['Model_name']}: {record['Status']} (fit: {record['Fit_seconds']} s)")
+    finally:
+        release_windows()
+
+    return pd.DataFrame(records)
+
+#####################
+# --- SCHEDULER --- #
+#####################
+
+'''
+Description: Retrain the models on a rolling window whenever enough new bars have arrived or enough time has passed (checked every poll_seconds)
+Args:
+    spark: Spark session
+    dataset_path: Path of the dataset (read again at each check to see the new bars)
+    models_dir: Directory containing the models and the registry
+    models_list: List of models to be retrained
+    poll_seconds: Seconds between two checks
+    max_retrains: Number of retrains after which the scheduler stops (None to run forever)
+Return: None
+'''
+def run_scheduler(spark, dataset_path, models_dir, models_list, poll_seconds=RETRAIN_POLL_SECONDS, max_retrains=None):
+    state = load_state(models_dir)
+    retrains = 0
+
+    while max_retrains is None or retrains < max_retrains:
+        dataset = read_dataset(spark, dataset_path)
+        last_id = dataset.agg(F.max("id")).collect()[0][0]
+        now = datetime.now()
+
+        if retrain_due(state, last_id, now):
+            retrain_models(spark, models_dir, dataset, models_list)
+
+            state = {"Last_id": last_id, "Last_time": now.isoformat(timespec='seconds')}
+            save_state(models_dir, state)
+            retrains += 1
+            continue
+
+        time.sleep(poll_seconds)
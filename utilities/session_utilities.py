@@ -0,0 +1,193 @@
+from imports import *
+from config import *
+
+##################
+# --- SERVER --- #
+##################
+
+'''
+Description: Check whether the Spark Connect server is listening
+Args:
+    port: Port of the server
+Return:
+    running: True if the server accepts connections
+'''
+def server_running(port=SPARK_CONNECT_PORT):
+    try:
+        with socket.create_connection(("localhost", port), timeout=1):
+            return True
+    except OSError:
+        return False
+
+'''
+Description: Return the file containing the process id of the server started by start_server
+Args:
+    port: Port of the server
+Return:
+    path: Path of the file
+'''
+def server_pid_path(port=SPARK_CONNECT_PORT):
+    return os.path.join(tempfile.gettempdir(), f"spark-connect-{port}.pid")
+
+'''
+Description: Start the Spark Connect server in the background (if it is not already running) with the configuration of the notebooks.
+             The server keeps running after the process which started it ends, so all the notebooks and workers attach to the same
+             warm JVM and share its cached tables
+Args:
+    port: Port of the server
+    timeout: Seconds waited for the server to accept connections
+Return:
+    started: True if the server has been started, False if it was already running
+'''
+def start_server(port=SPARK_CONNECT_PORT, timeout=SPARK_CONNECT_TIMEOUT):
+    if server_running(port):
+        return False
+
+    # The Spark installation of the SPARK_HOME variable or the one of the pyspark package
+    spark_home = os.environ.get("SPARK_HOME") or os.path.dirname(pyspark.__file__)
+    spark_submit = os.path.join(spark_home, "bin", "spark-submit.cmd" if os.name == "nt" else "spark-submit")
+
+    command = [spark_submit, "--class", "org.apache.spark.sql.connect.service.SparkConnectServer", "--packages", SPARK_CONNECT_PACKAGE,
+               "--master", SPARK_MASTER, "--name", SPARK_APP_NAME, "--conf", f"spark.connect.grpc.binding.port={port}"]
+    for key, value in SPARK_CONF.items():
+        command += ["--conf", f"{key}={value}"]
+
+    log_path = os.path.join(tempfile.gettempdir(), f"spark-connect-{port}.log")
+    with open(log_path, 'a') as log:
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, start_new_session=True)
+    with open(server_pid_path(port), 'w') as file:
+        file.write(str(process.pid))
+
+    deadline = time.time() + timeout
+    while not server_running(port):
+        if process.poll() is not None:
+            raise RuntimeError(f"The Spark Connect server exited with code {process.returncode}, see {log_path}")
+        if time.time() > deadline:
+            raise TimeoutError(f"The Spark Connect server did not start in {timeout} seconds, see {log_path}")
+        time.sleep(1)
+
+    return True
+
+'''
+Description: Stop the Spark Connect server started by start_server
+Args:
+    port: Port of the server
+Return: None
+'''
+def stop_server(port=SPARK_CONNECT_PORT):
+    pid_path = server_pid_path(port)
+    if not os.path.exists(pid_path):
+        return
+
+    with open(pid_path) as file:
+        pid = int(file.read())
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except OSError:
+        pass # Already stopped
+    os.remove(pid_path)
+
+###################
+# --- SESSION --- #
+###################
+
+'''
+Description: Return the Spark configuration of the notebooks
+Args: None
+Return:
+    conf: SparkConf
+'''
+def spark_conf():
+    conf = SparkConf().setAppName(SPARK_APP_NAME).setMaster(SPARK_MASTER)
+    for key, value in SPARK_CONF.items():
+        conf.set(key, value)
+
+    return conf
+
+'''
+Description: Return a Spark session: attached to the shared Spark Connect server (started if needed) or a local one. The local session is
+             reused if this process has already started it (e.g. the notebooks run in the same kernel by run_notebooks), so only the first one
+             pays the startup of the JVM. The startup time is printed (cold if the JVM has been started, warm otherwise)
+Args:
+    remote: Attach to the Spark Connect server instead of starting a local session
+Return:
+    spark: Spark session
+'''
+def get_session(remote=SPARK_REMOTE):
+    start = time.time()
+
+    if remote:
+        warm = not start_server()
+        spark = SparkSession.builder.remote(f"sc://localhost:{SPARK_CONNECT_PORT}").getOrCreate()
+    else:
+        warm = SparkContext._active_spark_context is not None
+        spark = SparkSession.builder.config(conf=spark_conf()).getOrCreate()
+
+    print(f"{'Warm' if warm else 'Cold'} {'Spark Connect' if remote else 'local'} session ready in {time.time() - start:.1f} seconds")
+
+    return spark
+
+##################
+# --- TABLES --- #
+##################
+
+'''
+Description: Return a dataset shared by all the sessions of the same Spark application: the Spark Connect server or the long-lived local session
+             of a kernel (see run_notebooks). The first session loads it, registers it as a global view and caches it, the next ones (e.g. the next
+             notebooks) read the cached table. If the dataset is written again, it must be released (see release_dataset) to be loaded again
+Args:
+    spark: Spark session
+    name: Name of the shared table
+    load: Function returning the dataset, called only if the table is not shared yet
+Return:
+    dataset: The shared dataset
+'''
+def shared_dataset(spark, name, load):
+    if name not in [table.name for table in spark.catalog.listTables("global_temp")]:
+        load().createOrReplaceGlobalTempView(name)
+        spark.catalog.cacheTable("global_temp." + name)
+
+    return spark.table("global_temp." + name)
+
+'''
+Description: Release a shared dataset (its cache and its global view)
+Args:
+    spark: Spark session
+    name: Name of the shared table
+Return: None
+'''
+def release_dataset(spark, name):
+    if name in [table.name for table in spark.catalog.listTables("global_temp")]:
+        spark.catalog.uncacheTable("global_temp." + name)
+        spark.catalog.dropGlobalTempView(name)
+
+##################
+# --- RUNNER --- #
+##################
+
+'''
+Description: Run notebooks one after the other in the current kernel (e.g. from a notebook of the notebooks dir:
+             session_utilities.run_notebooks(["3-block-split_LinearRegression.ipynb", "3-block-split_RandomForestRegressor.ipynb"])),
+             so that they all use the same warm local session and the datasets shared with shared_dataset are loaded and cached only once.
+             The notebooks are run in the namespace of the kernel and the first error stops the run
+Args:
+    paths: Paths of the notebooks
+Return:
+    report: Pandas dataset with the running time of each notebook
+'''
+def run_notebooks(paths):
+    shell = get_ipython()
+    if shell is None:
+        raise RuntimeError("The notebooks can only be run from an IPython kernel")
+
+    runs = []
+    for path in paths:
+        # IPython only warns about the missing files
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Notebook not found: {path}")
+
+        start = time.time()
+        shell.safe_execfile_ipy(path, raise_exceptions=True)
+        runs.append({"Notebook": os.path.basename(path), "Seconds": time.time() - start})
+
+    return pd.DataFrame(runs)
@@ -0,0 +1,148 @@
+'''
+Startup benchmark of the utilities: import time and peak memory (RSS) of a training-only and a scoring-only process,
+with the lazy imports and with all the packages loaded at startup (EAGER_IMPORTS=1).
+With --session: time to get a usable Spark session and to read a shared dataset, the first time (cold: the JVM is started, the dataset is read
+from Parquet and cached) and the next time in the same process (warm: as the next notebooks run in the same kernel). With --connect the same
+is measured on the Spark Connect server too.
+Usage (from the utilities dir): python startup_benchmark.py [--session [--connect]]
+'''
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules imported by each entry point
+ENTRY_POINTS = {
+    "training": ["train_validation_utilities", "results_utilities", "registry_utilities"],
+    "scoring": ["final_scores_utilities", "registry_utilities", "results_utilities"]
+}
+
+# Number of runs of each entry point (each one in a new process)
+REPEATS = 5
+
+# Code run in the new process
+MEASURE_CODE = '''
+import json, sys, time
+start = time.perf_counter()
+for module in {modules}:
+    __import__(module)
+seconds = time.perf_counter() - start
+
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_mb = rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024 # Bytes on macOS, kilobytes on Linux
+except ImportError:
+    rss_mb = None # Not available on Windows
+
+print(json.dumps({{"seconds": seconds, "rss_mb": rss_mb, "modules": len(sys.modules)}}))
+'''
+
+# Rows of the dataset read by the session benchmark (about the size of the 15 minutes train / validation set)
+SESSION_ROWS = 150000
+
+# Code run in the new process to get a session twice and read a shared dataset twice (each time with a first job)
+SESSION_CODE = '''
+import json, tempfile, time
+from session_utilities import get_session, shared_dataset
+measures = {{}}
+
+for name in ["session_cold", "session_warm"]:
+    start = time.perf_counter()
+    spark = get_session(remote={remote})
+    spark.range(1).count()
+    measures[name] = time.perf_counter() - start
+
+path = tempfile.mkdtemp() + "/dataset.parquet"
+spark.range({rows}).selectExpr("id", "rand() * 30000 as price", "rand() as volume").write.parquet(path)
+for name in ["dataset_cold", "dataset_warm"]:
+    start = time.perf_counter()
+    shared_dataset(spark, "benchmark", lambda: spark.read.parquet(path)).agg({{"price": "avg", "volume": "max"}}).collect()
+    measures[name] = time.perf_counter() - start
+
+print(json.dumps(measures))
+'''
+
+'''
+Description: Import the modules of an entry point in a new process and return its import time and peak memory
+Args:
+    modules: Modules to be imported
+    eager: Load all the packages at startup
+Return:
+    measure: Dictionary with the import time (seconds), the peak memory (MB) and the number of loaded modules
+'''
+def measure_startup(modules, eager):
+    env = dict(os.environ, EAGER_IMPORTS="1" if eager else "0")
+    output = subprocess.run([sys.executable, "-c", MEASURE_CODE.format(modules=modules)], env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+'''
+Description: Run the benchmark of all the entry points and print the median of the runs
+Args: None
+Return:
+    results: Dictionary (entry point, imports -> median measures)
+'''
+def run_benchmark():
+    results = {}
+    for entry_point, modules in ENTRY_POINTS.items():
+        for eager in [True, False]:
+            measures = [measure_startup(modules, eager) for _ in range(REPEATS)]
+            rss = [measure["rss_mb"] for measure in measures if measure["rss_mb"] is not None]
+
+            results[(entry_point, "eager" if eager else "lazy")] = {
+                "seconds": statistics.median(measure["seconds"] for measure in measures),
+                "rss_mb": statistics.median(rss) if rss else None,
+                "modules": statistics.median(measure["modules"] for measure in measures)
+            }
+
+    print(f"{'Entry point':<12}{'Imports':<9}{'Time (s)':>10}{'RSS (MB)':>10}{'Modules':>9}")
+    for (entry_point, imports), measure in results.items():
+        rss = f"{measure['rss_mb']:.1f}" if measure['rss_mb'] is not None else "n/a"
+        print(f"{entry_point:<12}{imports:<9}{measure['seconds']:>10.2f}{rss:>10}{measure['modules']:>9.0f}")
+
+    return results
+
+'''
+Description: Get a Spark session twice and read a shared dataset twice in a new process, and return the time of each step
+Args:
+    remote: Attach to the Spark Connect server instead of starting a local session
+Return:
+    measure: Dictionary (session_cold | session_warm | dataset_cold | dataset_warm -> seconds)
+'''
+def measure_session(remote):
+    output = subprocess.run([sys.executable, "-c", SESSION_CODE.format(remote=remote, rows=SESSION_ROWS)], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+'''
+Description: Run the benchmark of the cold and warm session startup and shared dataset reads and print the median of the runs.
+             With the Spark Connect server, the server is started before the runs, so its own startup is not counted
+Args:
+    connect: Measure the Spark Connect server too
+Return:
+    results: Dictionary (session type -> median measures)
+'''
+def run_session_benchmark(connect=False):
+    if connect:
+        subprocess.run([sys.executable, "-c", "from session_utilities import start_server; start_server()"], cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+
+    results = {}
+    for remote in [False, True] if connect else [False]:
+        measures = [measure_session(remote) for _ in range(REPEATS)]
+        results["connect" if remote else "local"] = {name: statistics.median(measure[name] for measure in measures) for name in measures[0]}
+
+    print(f"{'Session':<10}{'Session cold (s)':>18}{'Session warm (s)':>18}{'Dataset cold (s)':>18}{'Dataset warm (s)':>18}")
+    for session, measure in results.items():
+        print(f"{session:<10}{measure['session_cold']:>18.2f}{measure['session_warm']:>18.2f}{measure['dataset_cold']:>18.2f}{measure['dataset_warm']:>18.2f}")
+
+    return results
+
+if __name__ == "__main__":
+    if "--session" in sys.argv:
+        run_session_benchmark(connect="--connect" in sys.argv)
+    else:
+        run_benchmark()
@@ -1,5 +1,9 @@
 from imports import *
 from config import *
+from dataset_utilities import filter_by_timestamp, timestamp_bounds, rescale_bars, horizon_targets
+from plotting_utilities import show_time_series
+from collection_utilities import collect_pandas
+from boosting_utilities import HistGradientBoostingRegressor
 
 ######################
 # --- PARAMETERS --- #
@@ -18,10 +22,10 @@ def get_splitting_params(split_type):
         params = {'split_type': BS,
                   'splits': 5} # Number of splits to be performed
     elif split_type == WFS:
-        # Walk forward splits time series
+        # Walk forward splits time series (sizes are given in 15 minutes bars and rescaled to the dataset resolution)
         params = {'split_type': WFS,
-                  'min_obser': 20000, # Minimum number of observations 
-                  'sliding_window': 5000} # Sliding window size 
+                  'min_obser': rescale_bars(20000), # Minimum number of observations 
+                  'sliding_window': rescale_bars(5000)} # Sliding window size 
     elif split_type == SS:
         # Single split time series
         params = {'split_type': SS,
@@ -57,7 +61,7 @@ def get_defaults_model_params(model_name):
             'maxDepth': [5],
             'seed': [RANDOM_SEED]
         }
-    elif model_name == GBTR:
+    elif model_name == GBTR or model_name == HGBT:
         params = {
             'maxIter': [20],
             'maxDepth': [5],
@@ -94,7 +98,7 @@ def get_model_grid_params(model_name):
             'maxDepth' : [3, 5, 10], # Maximum depth of the tree (>= 0)
             'seed' : [RANDOM_SEED]
         }
-    elif (model_name == GBTR):
+    elif (model_name == GBTR or model_name == HGBT):
         params = {
             'maxIter' : [3, 5, 10, 20, 30], # Number of trees to train (>= 1)
             'maxDepth' : [3, 5, 10], # Maximum depth of the tree (>= 0)
@@ -179,7 +183,7 @@ def get_best_model_params(parameters, model_name):
             'maxDepth' : [parameters[1]],
             'seed' : [parameters[2]]
             }
-    elif (model_name == GBTR):
+    elif (model_name == GBTR or model_name == HGBT):
         params = {
             'maxIter' : [parameters[0]],
             'maxDepth' : [parameters[1]],
@@ -189,6 +193,70 @@ def get_best_model_params(parameters, model_name):
         
     return params
 
+'''
+Description: Return a key which is the same for all the parameters giving the same model
+Args:
+    model_name: Name of the selected model
+    param: Dictionary of the parameters (parameter -> value)
+Return:
+    key: Tuple of the parameters, without the ones which have no effect
+'''
+def equivalence_key(model_name, param):
+    key = dict(param)
+
+    if model_name == LR and key['regParam'] == 0:
+        # Without regularization the ElasticNet mixing parameter has no effect
+        key['elasticNetParam'] = None
+    elif model_name == GLR and key['family'] == 'gaussian' and key['link'] == 'identity':
+        # Solved directly by weighted least squares, the maximum number of iterations is not used
+        key['maxIter'] = None
+
+    return tuple(key.items())
+
+'''
+Description: Check whether the parameters can be fitted (e.g. the link function is supported by the family)
+Args:
+    model_name: Name of the selected model
+    param: Dictionary of the parameters (parameter -> value)
+Return:
+    valid: True if the model can be fitted with the parameters
+'''
+def valid_params(model_name, param):
+    if model_name == GLR:
+        family, link = param['family'], param['link']
+        return link in GLR_FAMILY_LINKS.get(family, []) and (family, link) not in GLR_INVALID_COMBINATIONS
+
+    return True
+
+'''
+Description: Compile the parameters grid into the fits to be done: the invalid combinations are removed and the equivalent ones
+             are fitted once, their results are then shared by all of them
+Args:
+    params: Parameters grid of the model (as returned by get_model_grid_params)
+    model_name: Name of the selected model
+Return:
+    grid: List of (parameters to be fitted, list of the equivalent parameters of the grid), in the order of the grid
+'''
+def compile_grid(params, model_name):
+    fits = OrderedDict()
+    invalid = 0
+
+    for values in product(*params.values()):
+        param = dict(zip(params, values))
+        if not valid_params(model_name, param):
+            invalid += 1
+            continue
+
+        fits.setdefault(equivalence_key(model_name, param), []).append(param)
+
+    grid = [(equivalent_params[0], equivalent_params) for equivalent_params in fits.values()]
+
+    num_params = builtins.sum(len(equivalent_params) for _, equivalent_params in grid)
+    if invalid or num_params > len(grid):
+        print(f"Parameters grid: {num_params + invalid} combinations, {invalid} invalid, {len(grid)} fits")
+
+    return grid
+
 ###################
 # --- COMMONS --- #
 ###################
@@ -222,111 +290,56 @@ Args:
     features_normalization: Indicates whether features should be normalized (True) or not (False)
     features: list of features to be extracted
     features_label: The column name of features
-    target_label: The column name of target variable
+    target_label: The column name of target variable (or a list of target columns)
 Return: 
     dataset: Dataset with the selected features
 '''
 def select_features(dataset, features_normalization, features, features_label, target_label):
+    # Keep the partition column (if any) so that time filters can still skip the unneeded files
+    partition_columns = [PARTITION_COLUMN] if PARTITION_COLUMN in dataset.columns else []
+    target_labels = target_label if isinstance(target_label, list) else [target_label]
+
     if features_normalization:
         # Assemble the columns into a vector column
         assembler = VectorAssembler(inputCols = features, outputCol = "raw_features")
-        df_vector  = assembler.transform(dataset).select("timestamp", "id", "market-price", "raw_features", target_label)
+        df_vector  = assembler.transform(dataset).select("timestamp", "id", "market-price", "raw_features", *target_labels, *partition_columns)
 
         # Create a Normalizer instance using L2 norm
         normalizer = Normalizer(inputCol="raw_features", outputCol=features_label, p=2.0)
 
         # Fit and transform the data
-        dataset = normalizer.transform(df_vector).select("timestamp", "id", "market-price", features_label, target_label)
+        dataset = normalizer.transform(df_vector).select("timestamp", "id", "market-price", features_label, *target_labels, *partition_columns)
     else:
         # Assemble the columns into a vector column
         assembler = VectorAssembler(inputCols = features, outputCol = features_label)
-        dataset = assembler.transform(dataset).select("timestamp", "id", "market-price", features_label, target_label)
+        dataset = assembler.transform(dataset).select("timestamp", "id", "market-price", features_label, *target_labels, *partition_columns)
 
     return dataset
 
 '''
-Description: Plot the results obtained
+Description: Plot the results obtained (the datasets can be Spark or Pandas datasets, each one is collected only once)
 Args:
-    results: Results to be displayed
+    dataset: The whole dataset
+    train: Train predictions
+    valid: Validation predictions
     title: Chart title
+    onlyTrain: Indicates whether only the train predictions should be displayed
 Return: None
 '''
 def show_results(dataset, train, valid, title, onlyTrain):
-    if not onlyTrain:     
-        trace1 = go.Scatter(
-            x = dataset['timestamp'],
-            y = dataset['next-market-price'].astype(float),
-            mode = 'lines',
-            name = 'Next Market price (usd)'
-        )
-
-        trace2 = go.Scatter(
-            x = train['timestamp'],
-            y = train['prediction'].astype(float),
-            mode = 'lines',
-            name = '(Train) Predicted next makert price (usd)'
-        )
-
-        trace3 = go.Scatter(
-            x = valid['timestamp'],
-            y = valid['prediction'].astype(float),
-            mode = 'lines',
-            name = '(Valid) Next Market price (usd)'
-        )
-    else:
-        trace1 = go.Scatter(
-            x = train['timestamp'],
-            y = train['next-market-price'].astype(float),
-            mode = 'lines',
-            name = 'Next Market price (usd)'
-        )
-
-        trace2 = go.Scatter(
-            x = train['timestamp'],
-            y = train['prediction'].astype(float),
-            mode = 'lines',
-            name = 'Predicted next makert price (usd)'
-        )
-        
-    layout = go.Layout(
-        title=title,
-        xaxis=dict(
-            rangeselector=dict(
-                buttons=list([
-                    # Change the count to desired amount of months.
-                    dict(count=1,
-                        label='1m',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=6,
-                        label='6m',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=12,
-                        label='1y',
-                        step='month',
-                        stepmode='backward'),
-                    dict(count=36,
-                        label='3y',
-                        step='month',
-                        stepmode='backward'),
-                    dict(step='all')
-                ])
-            ),
-            rangeslider=dict(
-                visible = True
-            ),
-            type='date'
-        )
-    )
-
-    if not onlyTrain:     
-        data = [trace1,trace2,trace3]
+    if not onlyTrain:
+        traces = [
+            (dataset, 'next-market-price', 'Next Market price (usd)'),
+            (train, 'prediction', '(Train) Predicted next makert price (usd)'),
+            (valid, 'prediction', '(Valid) Next Market price (usd)')
+        ]
     else:
-        data = [trace1,trace2]
+        traces = [
+            (train, 'next-market-price', 'Next Market price (usd)'),
+            (train, 'prediction', 'Predicted next makert price (usd)')
+        ]
 
-    fig = go.Figure(data=data, layout=layout)
-    fig.show()   
+    show_time_series(traces, title)
 
 '''
 Description: Returns the average of the results obtained
@@ -371,7 +384,9 @@ def model_selection(model_name, param, features_label, target_label):
         model = GeneralizedLinearRegression(featuresCol=features_label, \
                                             labelCol=target_label, \
                                             maxIter=param['maxIter'], \
-                                            regParam=param['regParam'])
+                                            regParam=param['regParam'], \
+                                            family=param.get('family', 'gaussian'), \
+                                            link=param.get('link', 'identity'))
 
     elif model_name == RF:
         model = RandomForestRegressor(featuresCol=features_label, \
@@ -388,6 +403,14 @@ def model_selection(model_name, param, features_label, target_label):
                                 stepSize = param['stepSize'], \
                                 seed=param['seed'])
 
+    elif model_name == HGBT:
+        model = HistGradientBoostingRegressor(featuresCol=features_label, \
+                                                labelCol=target_label, \
+                                                maxIter = param['maxIter'], \
+                                                maxDepth = param['maxDepth'], \
+                                                stepSize = param['stepSize'], \
+                                                seed=param['seed'])
+
     return model
 
 '''
@@ -404,7 +427,8 @@ def model_evaluation(target_label, predictions):
     mae_evaluator = RegressionEvaluator(labelCol=target_label, predictionCol="prediction", metricName='mae')
     r2_evaluator = RegressionEvaluator(labelCol=target_label, predictionCol="prediction", metricName='r2')
 
-    mape = mean_absolute_percentage_error(predictions.toPandas()[target_label], predictions.toPandas()["prediction"])
+    # Same definition as sklearn's mean_absolute_percentage_error, computed by Spark instead of collecting the predictions
+    mape = predictions.agg(F.avg(F.abs(col(target_label) - col("prediction")) / F.greatest(F.abs(col(target_label)), F.lit(np.finfo(np.float64).eps)))).collect()[0][0]
 
     mse = mse_evaluator.evaluate(predictions)
     rmse = rmse_evaluator.evaluate(predictions)
@@ -449,6 +473,178 @@ def model_accuracy(predictions):
         
     return accuracy
 
+##############################
+# --- SAMPLED EVALUATION --- #
+##############################
+
+# Sampled estimates of the tuning candidates (one dictionary per candidate and split)
+sampled_estimates = []
+
+'''
+Description: Return a deterministic time stratified sample of the rows: the rows are divided into blocks of 1 / fraction consecutive bars
+             and one row of each block is kept, chosen by a hash of the block, so the sample covers the whole period and is the same at every run
+Args:
+    dataset: Dataset to be sampled (with consecutive ids)
+    first_id: Id of the first row of the dataset
+    fraction: Fraction of the rows in the sample
+    seed: Seed of the hash
+Return:
+    sample: Sampled dataset
+'''
+def time_stratified_sample(dataset, first_id, fraction=TUNING_SAMPLE_FRACTION, seed=RANDOM_SEED):
+    step = builtins.max(1, int(builtins.round(1 / fraction)))
+
+    position = col("id") - F.lit(first_id)
+    offset = F.pmod(F.xxhash64(F.floor(position / step), F.lit(seed)), F.lit(step))
+
+    return dataset.filter(F.pmod(position, F.lit(step)) == offset)
+
+'''
+Description: Estimate the metrics of the whole validation set from the predictions of a sample, with one Spark job. RMSE, MSE, MAE and MAPE
+             are reported with their confidence interval (normal approximation, with the finite population correction)
+Args:
+    target_label: The column name of target variable
+    predictions: Predictions made by the model on the sample
+    population: Number of rows of the whole validation set
+    confidence: Confidence level of the intervals
+Return:
+    results: Estimated metrics (as model_evaluation) and their intervals (rmse_ci, mse_ci, mae_ci, mape_ci as (low, high)), rows of the sample
+'''
+def sampled_evaluation(target_label, predictions, population, confidence=TUNING_CONFIDENCE):
+    error = col("prediction") - col(target_label)
+    squared_error = error * error
+    absolute_error = F.abs(error)
+    percentage_error = absolute_error / F.greatest(F.abs(col(target_label)), F.lit(np.finfo(np.float64).eps))
+
+    n, mse, mse_std, mae, mae_std, mape, mape_std, target_var = predictions.agg(
+        F.count(F.lit(1)),
+        F.avg(squared_error), F.stddev_samp(squared_error),
+        F.avg(absolute_error), F.stddev_samp(absolute_error),
+        F.avg(percentage_error), F.stddev_samp(percentage_error),
+        F.var_pop(col(target_label))
+    ).collect()[0]
+
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    correction = np.sqrt(builtins.max(0.0, 1 - n / population))
+    interval = lambda mean, std: (builtins.max(mean - z * std / np.sqrt(n) * correction, 0.0), mean + z * std / np.sqrt(n) * correction)
+
+    mse_ci = interval(mse, mse_std)
+    r2 = 1 - mse / target_var
+
+    # Adjusted R-squared (as model_evaluation, on the size of the whole validation set)
+    p = len(predictions.columns)
+    adj_r2 = 1-(1-r2)*(population-1)/(population-p-1)
+
+    return {
+        'rmse': np.sqrt(mse), 'mse': mse, 'mae': mae, 'mape': mape, 'r2': r2, 'adj_r2': adj_r2,
+        'rmse_ci': (np.sqrt(mse_ci[0]), np.sqrt(mse_ci[1])), 'mse_ci': mse_ci, 'mae_ci': interval(mae, mae_std), 'mape_ci': interval(mape, mape_std),
+        'rows': n
+    }
+
+'''
+Description: Return the candidates which must be evaluated on all the rows: the one with the best estimated RMSE and the ones whose
+             RMSE interval overlaps its interval (the sample cannot tell which of them is the best)
+Args:
+    estimates: Sampled metrics of each candidate (as returned by sampled_evaluation)
+Return:
+    indexes: Indexes of the candidates to be evaluated on all the rows
+'''
+def overlapping_candidates(estimates):
+    best = builtins.min(range(len(estimates)), key=lambda i: estimates[i]['rmse'])
+    best_high = estimates[best]['rmse_ci'][1]
+
+    return [i for i, estimate in enumerate(estimates) if estimate['rmse_ci'][0] <= best_high]
+
+'''
+Description: Return the sampled estimates of the candidates of the last hyperparameter tuning
+Args: None
+Return:
+    report: Pandas dataset with one row per candidate and split (estimated metrics, intervals, exact RMSE of the candidates evaluated on all the rows)
+'''
+def sampled_tuning_report():
+    return pd.DataFrame(sampled_estimates)
+
+###################
+# --- BUDGETS --- #
+###################
+
+# Configurations of the last hyperparameter tuning stopped by the time budgets (one dictionary per configuration and split)
+timed_out_results = []
+
+'''
+Description: Run the Spark jobs of a block in their own job group, cancelled when the deadline is reached (as the rolling retrain).
+             The deadline is also set as a local property, so the models fitted on the driver stop at it too. The errors of the
+             cancelled jobs are not raised: the block is interrupted and the outcome is marked as timed out
+Args:
+    spark_context: Spark context
+    group: Id of the job group
+    deadline: Time (as returned by time.time()) by which the block must end (None to run it without a deadline)
+Return:
+    outcome: Dictionary whose Timed_out key is True if the block has been interrupted by the deadline
+'''
+@contextmanager
+def job_deadline(spark_context, group, deadline):
+    outcome = {"Timed_out": False}
+    if deadline is None:
+        yield outcome
+        return
+
+    spark_context.setJobGroup(group, group, interruptOnCancel=True)
+    spark_context.setLocalProperty(FIT_DEADLINE_PROPERTY, str(deadline))
+    timer = threading.Timer(builtins.max(deadline - time.time(), 0.0), spark_context.cancelJobGroup, args=[group])
+    timer.start()
+
+    try:
+        yield outcome
+    except (Py4JJavaError, TimeoutError):
+        if time.time() < deadline:
+            raise
+        outcome["Timed_out"] = True
+    finally:
+        timer.cancel()
+        spark_context.setLocalProperty("spark.jobGroup.id", None)
+        spark_context.setLocalProperty(FIT_DEADLINE_PROPERTY, None)
+
+'''
+Description: Record a configuration of the hyperparameter tuning stopped by the time budgets (each equivalent parameters map is recorded,
+             as for the evaluated ones)
+Args:
+    model_name: Model name
+    model_type: Model type
+    split_type: Splitting method
+    features_name: Features name
+    split: Number of the split
+    sizes: Train and validation size
+    equivalent_params: Equivalent parameters maps of the configuration
+    status: timeout if the configuration has been cancelled, skipped if the tuning budget was over before it started
+    elapsed: Seconds spent on the configuration before it was cancelled
+Return: None
+'''
+def record_timed_out(model_name, model_type, split_type, features_name, split, sizes, equivalent_params, status, elapsed):
+    for param in equivalent_params:
+        timed_out_results.append({
+            "Model": model_name,
+            "Type": model_type,
+            "Dataset": 'valid',
+            "Splitting": split_type,
+            "Features": features_name,
+            "Splits": split,
+            "Train / Validation": sizes,
+            "Parameters": list(param.values()),
+            "Status": status,
+            "Time": elapsed
+        })
+
+'''
+Description: Return the configurations of the last hyperparameter tuning stopped by the time budgets
+Args: None
+Return:
+    report: Pandas dataset with one row per configuration and split (Status: timeout if it was cancelled, skipped if the tuning budget
+            was over before it started), in the format of the results so that it can be saved in the warehouse
+'''
+def tuning_timeouts_report():
+    return pd.DataFrame(timed_out_results)
+
 ###########################
 # --- MULTIPLE SPLITS --- #
 ###########################
@@ -502,7 +698,10 @@ def walk_forward_splits(num, min_obser, sliding_window):
     return split_position_df
 
 '''
-Description: Perform train / validation using multiple splitting methods
+Description: Perform train / validation using multiple splitting methods. With TUNING_SAMPLED_EVALUATION the candidates of the hyperparameter tuning
+             are scored on a time stratified sample of each validation set and only the best ones are evaluated on all its rows (see sampled_tuning_report).
+             Each configuration of the tuning is fitted and scored within TUNING_CONFIG_BUDGET_SECONDS and the whole tuning within TUNING_BUDGET_SECONDS,
+             the configurations over budget are cancelled and recorded (see tuning_timeouts_report)
 Args:
     dataset: The dataset which needs to be splited
     params: Model's parameters to use
@@ -548,6 +747,17 @@ def multiple_splits(dataset, params, splitting_info, model_name, model_type, fea
         split_position_df = walk_forward_splits(num, splitting_info['min_obser'], splitting_info['sliding_window'])
     num_splits = split_position_df.shape[0]
 
+    # Valid combinations of params, the equivalent ones are fitted once
+    grid = compile_grid(params, model_name)
+
+    # No configuration of the tuning runs after its deadline
+    spark_context = dataset.sparkSession.sparkContext
+    tuning_deadline = time.time() + TUNING_BUDGET_SECONDS if model_type == "hyp_tuning" else None
+
+    if model_type == "hyp_tuning":
+        sampled_estimates.clear()
+        timed_out_results.clear()
+
     for position in split_position_df.itertuples():
         best_result = {"RMSE": float('inf')}
 
@@ -568,22 +778,41 @@ def multiple_splits(dataset, params, splitting_info, model_name, model_type, fea
         # Cache them
         train_data.cache()
         valid_data.cache()
-        
-        # All combination of params
-        param_lst = [dict(zip(params, param)) for param in product(*params.values())]
 
-        for param in tqdm(param_lst):
+        # The tuning candidates are scored on a sample of the validation set, if it is large enough
+        sampled = model_type == "hyp_tuning" and TUNING_SAMPLED_EVALUATION and valid_size * TUNING_SAMPLE_FRACTION >= TUNING_SAMPLE_MIN_ROWS
+        candidates = []
+        if sampled:
+            valid_sample = time_stratified_sample(valid_data, splits)
+            valid_sample.cache()
+
+        for i, (param, equivalent_params) in enumerate(tqdm(grid)):
             # Chosen Model
             model = model_selection(model_name, param, features_label, target_label)
 
             # Chain assembler and model in a Pipeline
             pipeline = Pipeline(stages=[model])
 
+            # Each configuration of the tuning runs in its own job group, cancelled at the end of its budget
+            group = f"tuning-{model_name}-{idx + 1}-{i}"
+            deadline = None
+            if model_type == "hyp_tuning":
+                if time.time() >= tuning_deadline:
+                    record_timed_out(model_name, model_type, splitting_info['split_type'], features_name, idx + 1, (train_size,valid_size), equivalent_params, "skipped", 0.0)
+                    continue
+                deadline = builtins.min(time.time() + TUNING_CONFIG_BUDGET_SECONDS, tuning_deadline)
+
             # Train a model and calculate running time
             start = time.time()
-            pipeline_model = pipeline.fit(train_data)
+            with job_deadline(spark_context, group, deadline) as outcome:
+                pipeline_model = pipeline.fit(train_data)
             end = time.time()
 
+            if outcome["Timed_out"]:
+                # The configuration is over budget: it is recorded and the tuning goes on with the next one
+                record_timed_out(model_name, model_type, splitting_info['split_type'], features_name, idx + 1, (train_size,valid_size), equivalent_params, "timeout", time.time() - start)
+                continue
+
             # Make predictions
             train_predictions = pipeline_model.transform(train_data).select(target_label, "market-price", "prediction", 'timestamp')
             valid_predictions = pipeline_model.transform(valid_data).select(target_label, "market-price", "prediction", 'timestamp')
@@ -593,78 +822,176 @@ def multiple_splits(dataset, params, splitting_info, model_name, model_type, fea
                 if (model_type != "hyp_tuning"):
                     title = model_name + " predictions on split " +  str(idx + 1) + " with " + features_name
                     if splitting_info['split_type'] == BS: # Show all the plots (for BS)
-                        show_results(dataset.toPandas(), train_predictions.toPandas(), valid_predictions.toPandas(), title, False)    
+                        show_results(dataset, train_predictions, valid_predictions, title, False)    
                     elif splitting_info['split_type'] == WFS: # Show only the first, the middle and the last split
                         if idx+1 == num_splits//2 or idx+1 == (num_splits//2) + 1: # Show only the middle plots (for WFS), uncomment this to show all of them (WARNING: you cannot save the notebook due to it's size)
-                            show_results(dataset.toPandas(), train_predictions.toPandas(), valid_predictions.toPandas(), title, False)  
+                            show_results(dataset, train_predictions, valid_predictions, title, False)  
                     print("Split [" + str(idx + 1) + "/" + str(num_splits) +  "]")
 
-            if model_type == "default" or model_type == "default_norm" or model_type == "cross_val":
-                # Append predictions to the list
-                all_train_predictions.append(train_predictions) 
-                all_valid_predictions.append(valid_predictions)
-
-            # Compute validation error by several evaluators
-            train_eval_res = model_evaluation(target_label, train_predictions)
-            valid_eval_res = model_evaluation(target_label, valid_predictions)
-
-            # Use dict to store each result
-            train_results = {
-                "Model": model_name,
-                "Type": model_type,
-                "Dataset": 'train',
-                "Splitting": splitting_info['split_type'],
-                "Features": features_name,
-                "Splits": idx + 1,
-                "Train / Validation": (train_size,valid_size),                
-                "Parameters": list(param.values()),
-                "RMSE": train_eval_res['rmse'],
-                "MSE": train_eval_res['mse'],
-                "MAE": train_eval_res['mae'],
-                "MAPE": train_eval_res['mape'],
-                "R2": train_eval_res['r2'],
-                "Adjusted_R2": train_eval_res['adj_r2'],
-                "Time": end - start,
-            }
+            if sampled:
+                # Only the estimate on the sample is computed now, the model is kept until all the candidates are scored (if it can still be the best)
+                sample_predictions = pipeline_model.transform(valid_sample).select(target_label, "market-price", "prediction", 'timestamp')
+                with job_deadline(spark_context, group, deadline) as outcome:
+                    estimate = sampled_evaluation(target_label, sample_predictions, valid_size)
 
-            valid_results = {
-                "Model": model_name,
-                "Type": model_type,
-                "Dataset": 'valid',
-                "Splitting": splitting_info['split_type'],
-                "Features": features_name,
-                "Splits": idx + 1,
-                "Train / Validation": (train_size,valid_size),                
-                "Parameters": list(param.values()),
-                "RMSE": valid_eval_res['rmse'],
-                "MSE": valid_eval_res['mse'],
-                "MAE": valid_eval_res['mae'],
-                "MAPE": valid_eval_res['mape'],
-                "R2": valid_eval_res['r2'],
-                "Adjusted_R2": valid_eval_res['adj_r2'],
-                "Time": end - start,
-            }
+                if outcome["Timed_out"]:
+                    record_timed_out(model_name, model_type, splitting_info['split_type'], features_name, idx + 1, (train_size,valid_size), equivalent_params, "timeout", time.time() - start)
+                else:
+                    candidates.append({"Model": pipeline_model, "Parameters": equivalent_params, "Time": end - start, "Estimate": estimate})
 
-            if model_type == "hyp_tuning":
-                # Store the result with the lowest RMSE and the associated parameters
-                if valid_results['RMSE'] < best_result['RMSE']:
-                    best_result = valid_results
+                    # Only the models whose RMSE interval reaches the one of the best estimate so far are kept, the others are released
+                    best_high = builtins.min(candidates, key=lambda candidate: candidate["Estimate"]["rmse"])["Estimate"]["rmse_ci"][1]
+                    for candidate in candidates:
+                        if candidate["Estimate"]["rmse_ci"][0] > best_high:
+                            candidate["Model"] = None
+                continue
 
             if model_type == "default" or model_type == "default_norm" or model_type == "cross_val":
-                # Store results for each split
-                all_train_results.append(train_results)
-                all_valid_results.append(valid_results)
-        
+                # Append predictions to the list (each split in chronological order, the splits one after the other)
+                all_train_predictions.append(train_predictions.orderBy('timestamp'))
+                all_valid_predictions.append(valid_predictions.orderBy('timestamp'))
+
+            # Compute validation error by several evaluators (the tuning only uses the validation error)
+            train_eval_res = model_evaluation(target_label, train_predictions) if model_type != "hyp_tuning" else None
+            with job_deadline(spark_context, group, deadline) as outcome:
+                valid_eval_res = model_evaluation(target_label, valid_predictions)
+
+            if outcome["Timed_out"]:
+                record_timed_out(model_name, model_type, splitting_info['split_type'], features_name, idx + 1, (train_size,valid_size), equivalent_params, "timeout", time.time() - start)
+                continue
+
+            for param in equivalent_params:
+                # Use dict to store each result (the results of the fit are shared by all the equivalent parameters)
+                valid_results = {
+                    "Model": model_name,
+                    "Type": model_type,
+                    "Dataset": 'valid',
+                    "Splitting": splitting_info['split_type'],
+                    "Features": features_name,
+                    "Splits": idx + 1,
+                    "Train / Validation": (train_size,valid_size),                
+                    "Parameters": list(param.values()),
+                    "RMSE": valid_eval_res['rmse'],
+                    "MSE": valid_eval_res['mse'],
+                    "MAE": valid_eval_res['mae'],
+                    "MAPE": valid_eval_res['mape'],
+                    "R2": valid_eval_res['r2'],
+                    "Adjusted_R2": valid_eval_res['adj_r2'],
+                    "Time": end - start,
+                }
+
+                if model_type == "hyp_tuning":
+                    # Store the result with the lowest RMSE and the associated parameters
+                    if valid_results['RMSE'] < best_result['RMSE']:
+                        best_result = valid_results
+
+                if model_type == "default" or model_type == "default_norm" or model_type == "cross_val":
+                    train_results = {
+                        "Model": model_name,
+                        "Type": model_type,
+                        "Dataset": 'train',
+                        "Splitting": splitting_info['split_type'],
+                        "Features": features_name,
+                        "Splits": idx + 1,
+                        "Train / Validation": (train_size,valid_size),
+                        "Parameters": list(param.values()),
+                        "RMSE": train_eval_res['rmse'],
+                        "MSE": train_eval_res['mse'],
+                        "MAE": train_eval_res['mae'],
+                        "MAPE": train_eval_res['mape'],
+                        "R2": train_eval_res['r2'],
+                        "Adjusted_R2": train_eval_res['adj_r2'],
+                        "Time": end - start,
+                    }
+
+                    # Store results for each split
+                    all_train_results.append(train_results)
+                    all_valid_results.append(valid_results)
+
+        if sampled and candidates:
+            # The sample cannot rank the candidates whose interval overlaps the one of the best estimate, so they are evaluated on all the rows
+            # (the released models were already outside the interval of a previous best estimate, so they can't be the best)
+            exact = set(i for i in overlapping_candidates([candidate["Estimate"] for candidate in candidates]) if candidates[i]["Model"] is not None)
+
+            for i, candidate in enumerate(candidates):
+                estimate = candidate["Estimate"]
+                valid_eval_res = None
+
+                if i in exact:
+                    start = time.time()
+                    valid_predictions = candidate["Model"].transform(valid_data).select(target_label, "market-price", "prediction", 'timestamp')
+                    with job_deadline(spark_context, f"tuning-{model_name}-{idx + 1}-exact-{i}", tuning_deadline) as outcome:
+                        valid_eval_res = model_evaluation(target_label, valid_predictions)
+
+                    if outcome["Timed_out"]:
+                        # The exact evaluation is over the tuning budget: the candidate is recorded and only its estimate is reported
+                        record_timed_out(model_name, model_type, splitting_info['split_type'], features_name, idx + 1, (train_size,valid_size), candidate["Parameters"], "timeout", time.time() - start)
+
+                for param in candidate["Parameters"]:
+                    if valid_eval_res is not None:
+                        valid_results = {
+                            "Model": model_name,
+                            "Type": model_type,
+                            "Dataset": 'valid',
+                            "Splitting": splitting_info['split_type'],
+                            "Features": features_name,
+                            "Splits": idx + 1,
+                            "Train / Validation": (train_size,valid_size),
+                            "Parameters": list(param.values()),
+                            "RMSE": valid_eval_res['rmse'],
+                            "MSE": valid_eval_res['mse'],
+                            "MAE": valid_eval_res['mae'],
+                            "MAPE": valid_eval_res['mape'],
+                            "R2": valid_eval_res['r2'],
+                            "Adjusted_R2": valid_eval_res['adj_r2'],
+                            "Time": candidate["Time"],
+                        }
+
+                        # Store the result with the lowest RMSE and the associated parameters
+                        if valid_results['RMSE'] < best_result['RMSE']:
+                            best_result = valid_results
+
+                    sampled_estimates.append({
+                        "Splits": idx + 1,
+                        "Parameters": list(param.values()),
+                        "Rows": estimate['rows'],
+                        "RMSE": estimate['rmse'],
+                        "RMSE_low": estimate['rmse_ci'][0],
+                        "RMSE_high": estimate['rmse_ci'][1],
+                        "MAE": estimate['mae'],
+                        "MAE_low": estimate['mae_ci'][0],
+                        "MAE_high": estimate['mae_ci'][1],
+                        "MAPE": estimate['mape'],
+                        "MAPE_low": estimate['mape_ci'][0],
+                        "MAPE_high": estimate['mape_ci'][1],
+                        "Exact_RMSE": valid_eval_res['rmse'] if valid_eval_res is not None else None
+                    })
+
+            print(f"Split [{idx + 1}/{num_splits}]: {len(candidates)} candidates scored on {candidates[0]['Estimate']['rows']} sampled rows, {len(exact)} evaluated on all the {valid_size} rows")
+
+        if sampled:
+            valid_sample.unpersist()
+
         # Release Cache
         train_data.unpersist()
         valid_data.unpersist()
 
         if model_type == "hyp_tuning":
+            if "Parameters" not in best_result:
+                print("No configuration evaluated within the time budgets for split [" + str(idx + 1) + "/" + str(num_splits) +  "]")
+                continue
+
             # Store the best result for each split
-            best_split_result.append(best_result) 
+            best_split_result.append(best_result)
             print("Best parameters chosen for split [" + str(idx + 1) + "/" + str(num_splits) +  "]: " + str(best_result["Parameters"]))
 
     if model_type == "hyp_tuning":
+        if not best_split_result:
+            raise TimeoutError(f"No configuration of {model_name} has been evaluated within the time budgets")
+
+        if timed_out_results:
+            print(f"Configurations stopped by the time budgets: {len(timed_out_results)} (see tuning_timeouts_report)")
+
         # Transform dict to pandas dataset
         best_split_result_df = pd.DataFrame(best_split_result)
 
@@ -675,14 +1002,9 @@ def multiple_splits(dataset, params, splitting_info, model_name, model_type, fea
         all_train_results_df = pd.DataFrame(all_train_results)
         all_valid_results_df = pd.DataFrame(all_valid_results)
 
-        # Iterate for each train and validation predictions and concatenate it with the final one
-        all_train_predictions_df = pd.DataFrame()
-        for pred in all_train_predictions:
-            all_train_predictions_df = pd.concat([all_train_predictions_df, pred.select("*").toPandas()], ignore_index=True)
-
-        all_valid_predictions_df = pd.DataFrame()
-        for pred in all_valid_predictions:
-            all_valid_predictions_df = pd.concat([all_valid_predictions_df, pred.select("*").toPandas()], ignore_index=True)
+        # Concatenate the train and validation predictions of all the splits and collect them once
+        all_train_predictions_df = collect_pandas(functools.reduce(DataFrame.unionByName, all_train_predictions), "train predictions")
+        all_valid_predictions_df = collect_pandas(functools.reduce(DataFrame.unionByName, all_valid_predictions), "valid predictions")
 
         return all_train_results_df, all_valid_results_df, all_train_predictions_df, all_valid_predictions_df
 
@@ -702,7 +1024,7 @@ Return:
 '''
 def short_term_split(dataset, split_label, split_value):
     # Retrieve the last timestamp value
-    last_value = dataset.agg(last("timestamp")).collect()[0][0]
+    _, last_value = timestamp_bounds(dataset)
 
     # Subtract the value from the last timestamp based on the split label
     match split_label:
@@ -716,8 +1038,8 @@ def short_term_split(dataset, split_label, split_value):
             return 
 
     # Split the dataset based on the desired date
-    train_data = dataset[dataset['timestamp'] <= split_date]
-    test_df = dataset[dataset['timestamp'] > split_date]
+    train_data = filter_by_timestamp(dataset, end=split_date)
+    test_df = filter_by_timestamp(dataset, start=split_date)
 
     return train_data, test_df
 
@@ -787,7 +1109,7 @@ def single_split(dataset, params, splitting_info, model_name, model_type, featur
         # Show plots
         title = model_name + " predictions with " + features_name
         if slow_operations:
-            show_results(dataset.toPandas(), train_predictions.toPandas(), valid_predictions.toPandas(), title, False)
+            show_results(dataset, train_predictions, valid_predictions, title, False)
 
         # Compute validation error by several evaluators
         train_eval_res = model_evaluation(target_label, train_predictions)
@@ -836,7 +1158,7 @@ def single_split(dataset, params, splitting_info, model_name, model_type, featur
     train_results_df = pd.DataFrame.from_dict(train_results, orient='index').T
     valid_results_df = pd.DataFrame.from_dict(valid_results, orient='index').T
 
-    return train_results_df, valid_results_df, train_predictions.toPandas(), valid_predictions.toPandas()
+    return train_results_df, valid_results_df, collect_pandas(train_predictions.orderBy('timestamp'), "train predictions"), collect_pandas(valid_predictions.orderBy('timestamp'), "valid predictions")
         
 '''
 Description: Evaluation of the final trained model
@@ -850,12 +1172,13 @@ Args:
     features_name: Name of features used
     features_label: The column name of features
     target_label: The column name of target variable
+    slow_operations: Indicates whether the predictions should be plotted
 Return: 
     results_df: Results obtained from the evaluation
     pipeline_model: Final trained model
     predictions: Predictions obtained from the model
 '''
-def evaluate_trained_model(dataset, params, model_name, model_type, features_normalization, features, features_name, features_label, target_label):    
+def evaluate_trained_model(dataset, params, model_name, model_type, features_normalization, features, features_name, features_label, target_label, slow_operations=True):    
     # Select the type of features to be used
     dataset = select_features(dataset, features_normalization, features, features_label, target_label)
 
@@ -906,6 +1229,124 @@ def evaluate_trained_model(dataset, params, model_name, model_type, features_nor
     results_df = pd.DataFrame(results)
 
     # Show plots
-    show_results(None, predictions.toPandas(), None, model_name + " prediction on the whole train / validation set", True)
+    if slow_operations:
+        show_results(None, predictions, None, model_name + " prediction on the whole train / validation set", True)
         
-    return results_df, pipeline_model, predictions.toPandas()
\ No newline at end of file
+    return results_df, pipeline_model, collect_pandas(predictions.orderBy('timestamp'), "final predictions")
+
+#############################
+# --- MULTIPLE HORIZONS --- #
+#############################
+
+'''
+Description: Perform train / validation of the model on several horizons (e.g. the price in 1 hour, 1 day and 1 week) in one pass:
+             the features are assembled once with all the targets and each split is cached once and shared by all the horizons.
+             The last rows of each training split are purged for each horizon (their target is a price of the validation period)
+Args:
+    dataset: The dataset which needs to be splited (with the target columns of the horizons)
+    params: Model's parameters to use
+    splitting_info: The splitting method selected (as returned by get_splitting_params)
+    model_name: Name of the model selected
+    model_type: Model type [multi_horizon]
+    features_normalization: Indicates whether features should be normalized or not
+    features: Features to be used to make predictions
+    features_name: Name of features used
+    features_label: The column name of features
+    horizons: Dictionary (horizon -> target column), e.g. {"1h": "next-market-price-1h"}
+Return: 
+    train_results_df: The train performances of each horizon and split in a pandas dataset
+    valid_results_df: The validation performances of each horizon and split in a pandas dataset
+'''
+def multi_horizon_splits(dataset, params, splitting_info, model_name, model_type, features_normalization, features, features_name, features_label, horizons):
+    # Select the type of features to be used, keeping all the targets
+    dataset = select_features(dataset, features_normalization, features, features_label, list(horizons.values()))
+
+    # Shows whether features are normalised or not
+    if features_normalization:
+        features_name = features_name + "_norm"
+
+    # Get training data and validation data of each split
+    if splitting_info['split_type'] == SS:
+        split_data = [short_term_split(dataset, splitting_info['split_label'], splitting_info['split_value'])]
+    else:
+        if splitting_info['split_type'] == BS:
+            split_position_df = block_splits(dataset.count(), splitting_info['splits'])
+        elif splitting_info['split_type'] == WFS:
+            split_position_df = walk_forward_splits(dataset.count(), splitting_info['min_obser'], splitting_info['sliding_window'])
+        split_data = [
+            (dataset.filter(dataset['id'].between(start, split - 1)), dataset.filter(dataset['id'].between(split, end - 1)))
+            for start, split, end in split_position_df.itertuples(index=False)
+        ]
+
+    # Valid combinations of params, the equivalent ones are fitted once
+    grid = compile_grid(params, model_name)
+
+    # Number of bars ahead of each horizon
+    horizon_bars = {horizon: bars for horizon, (_, bars) in horizon_targets().items()}
+
+    # Save results in a list
+    all_train_results = []
+    all_valid_results = []
+
+    for idx, (train_data, valid_data) in enumerate(split_data):
+        # The split is read once and shared by all the horizons
+        train_data.cache()
+        valid_data.cache()
+
+        first_valid_id = valid_data.agg(F.min("id")).collect()[0][0]
+
+        for horizon, target_label in horizons.items():
+            # The last rows have no price at the end of the horizon, the last rows of the training split have a price of the validation period
+            has_target = col(target_label).isNotNull() & ~F.isnan(col(target_label))
+            horizon_train = train_data.filter(has_target & (col("id") + horizon_bars[horizon] < first_valid_id))
+            horizon_valid = valid_data.filter(has_target)
+
+            # Train / validation size
+            train_size = horizon_train.count()
+            valid_size = horizon_valid.count()
+
+            for param, equivalent_params in grid:
+                # Chosen Model
+                model = model_selection(model_name, param, features_label, target_label)
+
+                # Chain assembler and model in a Pipeline
+                pipeline = Pipeline(stages=[model])
+
+                # Train a model and calculate running time
+                start = time.time()
+                pipeline_model = pipeline.fit(horizon_train)
+                end = time.time()
+
+                # Make predictions
+                train_predictions = pipeline_model.transform(horizon_train).select(target_label, "market-price", "prediction", 'timestamp')
+                valid_predictions = pipeline_model.transform(horizon_valid).select(target_label, "market-price", "prediction", 'timestamp')
+
+                # Compute validation error by several evaluators (the results of the fit are shared by all the equivalent parameters)
+                for dataset_name, predictions, results_lst in [('train', train_predictions, all_train_results), ('valid', valid_predictions, all_valid_results)]:
+                    eval_res = model_evaluation(target_label, predictions)
+                    results_lst.extend({
+                        "Model": model_name,
+                        "Type": model_type,
+                        "Dataset": dataset_name,
+                        "Splitting": splitting_info['split_type'],
+                        "Horizon": horizon,
+                        "Features": features_name,
+                        "Splits": idx + 1,
+                        "Train / Validation": (train_size, valid_size),
+                        "Parameters": list(param.values()),
+                        "RMSE": eval_res['rmse'],
+                        "MSE": eval_res['mse'],
+                        "MAE": eval_res['mae'],
+                        "MAPE": eval_res['mape'],
+                        "R2": eval_res['r2'],
+                        "Adjusted_R2": eval_res['adj_r2'],
+                        "Time": end - start,
+                    } for param in equivalent_params)
+
+            print(horizon + " horizon done on split [" + str(idx + 1) + "/" + str(len(split_data)) + "]")
+
+        # Release Cache
+        train_data.unpersist()
+        valid_data.unpersist()
+
+    return pd.DataFrame(all_train_results), pd.DataFrame(all_valid_results)
@@ -0,0 +1,180 @@
+from imports import *
+from config import *
+from train_validation_utilities import get_splitting_params, compile_grid, select_features, model_selection, block_splits, walk_forward_splits, short_term_split
+
+# Spark ML internals used by the cross validator (not included in the wildcard imports of imports.py)
+from multiprocessing.pool import ThreadPool
+from pyspark import keyword_only
+from pyspark.ml import Estimator
+from pyspark.ml.param import Param, Params, TypeConverters
+from pyspark.ml.param.shared import HasParallelism
+from pyspark.ml.tuning import CrossValidatorModel, _ValidatorParams, _parallelFitTasks
+from pyspark.util import inheritable_thread_target
+
+############################
+# --- CROSS VALIDATION --- #
+############################
+
+'''
+Description: Cross validator which keeps the time order of the rows. The folds are the ones of multiple_splits (block splits, walk forward splits)
+             and single_split (short term split), each fold is cached once and shared by all the parameter maps, which are evaluated in parallel.
+             The result is a CrossValidatorModel (best model refitted on the whole dataset, avgMetrics and stdMetrics), so it can be saved and loaded as usual.
+             Without refit only the metrics are computed (bestModel is None), e.g. to check parameters already chosen
+Args:
+    estimator: Estimator to be tuned (e.g. a Pipeline)
+    estimatorParamMaps: Parameter maps (e.g. built with ParamGridBuilder)
+    evaluator: Evaluator of the validation folds
+    splitType: Splitting method [block_splits | walk_forward_splits | single_split]
+    numSplits: Number of block splits
+    minObser: Minimum number of observations of the walk forward splits
+    slidingWindow: Sliding window size of the walk forward splits
+    splitLabel: Unit of the validation period of the single split [weeks | months | years]
+    splitValue: Length of the validation period of the single split
+    refit: Refit the best parameter map on the whole dataset
+    parallelism: Number of parameter maps evaluated at the same time
+'''
+class TimeSeriesCrossValidator(Estimator, _ValidatorParams, HasParallelism):
+    splitType = Param(Params._dummy(), "splitType", "splitting method [block_splits | walk_forward_splits | single_split]", typeConverter=TypeConverters.toString)
+    numSplits = Param(Params._dummy(), "numSplits", "number of block splits", typeConverter=TypeConverters.toInt)
+    minObser = Param(Params._dummy(), "minObser", "minimum number of observations of the walk forward splits", typeConverter=TypeConverters.toInt)
+    slidingWindow = Param(Params._dummy(), "slidingWindow", "sliding window size of the walk forward splits", typeConverter=TypeConverters.toInt)
+    splitLabel = Param(Params._dummy(), "splitLabel", "unit of the validation period of the single split [weeks | months | years]", typeConverter=TypeConverters.toString)
+    splitValue = Param(Params._dummy(), "splitValue", "length of the validation period of the single split", typeConverter=TypeConverters.toInt)
+    refit = Param(Params._dummy(), "refit", "refit the best parameter map on the whole dataset", typeConverter=TypeConverters.toBoolean)
+
+    @keyword_only
+    def __init__(self, *, estimator=None, estimatorParamMaps=None, evaluator=None, splitType=BS, numSplits=None, minObser=None, slidingWindow=None, splitLabel=None, splitValue=None, refit=True, parallelism=1):
+        super().__init__()
+
+        # Defaults of the splitting methods
+        bs_params = get_splitting_params(BS)
+        wfs_params = get_splitting_params(WFS)
+        ss_params = get_splitting_params(SS)
+        self._setDefault(splitType=BS, numSplits=bs_params['splits'], minObser=wfs_params['min_obser'], slidingWindow=wfs_params['sliding_window'],
+                         splitLabel=ss_params['split_label'], splitValue=ss_params['split_value'], refit=True, parallelism=1)
+
+        kwargs = {name: value for name, value in self._input_kwargs.items() if value is not None}
+        self._set(**kwargs)
+
+    '''
+    Description: Return the (train, validation) datasets of each fold
+    Args:
+        dataset: Dataset to be splitted (with the "id" and "timestamp" columns)
+    Return:
+        folds: List of (train, validation) datasets
+    '''
+    def _folds(self, dataset):
+        split_type = self.getOrDefault(self.splitType)
+
+        if split_type == SS:
+            return [short_term_split(dataset, self.getOrDefault(self.splitLabel), self.getOrDefault(self.splitValue))]
+
+        if split_type == BS:
+            split_position_df = block_splits(dataset.count(), self.getOrDefault(self.numSplits))
+        elif split_type == WFS:
+            split_position_df = walk_forward_splits(dataset.count(), self.getOrDefault(self.minObser), self.getOrDefault(self.slidingWindow))
+        else:
+            raise ValueError("Invalid split type")
+
+        return [
+            (dataset.filter(dataset['id'].between(start, split - 1)), dataset.filter(dataset['id'].between(split, end - 1)))
+            for start, split, end in split_position_df.itertuples(index=False)
+        ]
+
+    def _fit(self, dataset):
+        estimator = self.getOrDefault(self.estimator)
+        param_maps = self.getOrDefault(self.estimatorParamMaps)
+        evaluator = self.getOrDefault(self.evaluator)
+        num_models = len(param_maps)
+
+        folds = self._folds(dataset)
+        fold_metrics = np.zeros((len(folds), num_models))
+
+        with ThreadPool(processes=builtins.min(self.getParallelism(), num_models)) as pool:
+            for i, (train, valid) in enumerate(folds):
+                # The fold is read once and shared by all the parameter maps
+                train.cache()
+                valid.cache()
+
+                tasks = map(inheritable_thread_target, _parallelFitTasks(estimator, train, evaluator, valid, param_maps, False))
+                for j, metric, _ in pool.imap_unordered(lambda task: task(), tasks):
+                    fold_metrics[i, j] = metric
+
+                train.unpersist()
+                valid.unpersist()
+
+        avg_metrics = fold_metrics.mean(axis=0)
+        std_metrics = fold_metrics.std(axis=0)
+
+        # Refit the best parameters on the whole dataset
+        best_model = None
+        if self.getOrDefault(self.refit):
+            best_index = int(np.argmax(avg_metrics) if evaluator.isLargerBetter() else np.argmin(avg_metrics))
+            best_model = estimator.fit(dataset, param_maps[best_index])
+
+        model = self._copyValues(CrossValidatorModel(best_model, avg_metrics.tolist(), None, std_metrics.tolist()))
+        model._set(numFolds=len(folds))
+
+        return model
+
+'''
+Description: Return the parameter maps of the model, one for each combination of parameters
+Args:
+    model: Model whose parameters are tuned
+    param_lst: List of dictionaries (parameter -> value)
+Return:
+    param_maps: List of parameter maps
+'''
+def get_param_maps(model, param_lst):
+    return [{model.getParam(name): value for name, value in param.items()} for param in param_lst]
+
+'''
+Description: Tune the selected model with the time series cross validator
+Args:
+    dataset: The dataset to be used
+    params: Parameters grid of the model (as returned by get_model_grid_params)
+    splitting_info: Splitting method selected (as returned by get_splitting_params)
+    model_name: Name of the model selected
+    features_normalization: Indicates whether features should be normalized or not
+    features: Features to be used to make predictions
+    features_label: The column name of features
+    target_label: The column name of target variable
+    refit: Refit the best parameters on the whole dataset (without it only the metrics are computed)
+    parallelism: Number of parameter maps evaluated at the same time
+Return:
+    cv_model: CrossValidatorModel (best pipeline model refitted on the whole dataset or None without refit, avgMetrics in the order of param_maps)
+    param_maps: Parameter maps of the valid combinations (the equivalent ones share the metrics of the same fit)
+'''
+def time_series_cross_validation(dataset, params, splitting_info, model_name, features_normalization, features, features_label, target_label, refit=True, parallelism=TUNING_PARALLELISM):
+    # Select the type of features to be used
+    dataset = select_features(dataset, features_normalization, features, features_label, target_label)
+
+    # Model initialized with the first value of each parameter (the grid sets all of them)
+    model = model_selection(model_name, {name: values[0] for name, values in params.items()}, features_label, target_label)
+    pipeline = Pipeline(stages=[model])
+
+    # Valid combinations of params, the equivalent ones are fitted once
+    grid = compile_grid(params, model_name)
+    fit_maps = get_param_maps(model, [param for param, _ in grid])
+
+    evaluator = RegressionEvaluator(labelCol=target_label, predictionCol="prediction", metricName='rmse')
+
+    splitting_params = {
+        BS: {'numSplits': splitting_info.get('splits')},
+        WFS: {'minObser': splitting_info.get('min_obser'), 'slidingWindow': splitting_info.get('sliding_window')},
+        SS: {'splitLabel': splitting_info.get('split_label'), 'splitValue': splitting_info.get('split_value')}
+    }[splitting_info['split_type']]
+
+    validator = TimeSeriesCrossValidator(estimator=pipeline, estimatorParamMaps=fit_maps, evaluator=evaluator,
+                                         splitType=splitting_info['split_type'], refit=refit, parallelism=parallelism, **splitting_params)
+
+    cv_model = validator.fit(dataset)
+
+    # Share the metrics of each fit with all its equivalent parameters
+    fit_index = [i for i, (_, equivalent_params) in enumerate(grid) for _ in equivalent_params]
+    param_maps = get_param_maps(model, [param for _, equivalent_params in grid for param in equivalent_params])
+    cv_model.avgMetrics = [cv_model.avgMetrics[i] for i in fit_index]
+    cv_model.stdMetrics = [cv_model.stdMetrics[i] for i in fit_index]
+    cv_model._set(estimatorParamMaps=param_maps)
+
+    return cv_model, param_maps
@@ -0,0 +1,155 @@
+from imports import *
+from config import *
+
+##################
+# --- WRITER --- #
+##################
+
+# Artifacts waiting to be written, as (future, function, args, kwargs, label, submission time)
+writer_queue = queue.Queue(maxsize=WRITER_QUEUE_SIZE)
+
+# Threads writing the artifacts (started by the first submit)
+writer_threads = []
+
+# Errors of the writes not reported yet, as (label, exception)
+writer_errors = []
+
+# Time spent by each artifact waiting and being written (one dictionary per artifact)
+writer_log = []
+
+'''
+Description: Write the artifacts of the queue, one after the other, until the process ends. The errors are recorded and raised to the caller
+             by its next submit or flush
+Args: None
+Return: None
+'''
+def writer_loop():
+    while True:
+        future, function, args, kwargs, label, submitted = writer_queue.get()
+        start = time.time()
+        failed = False
+        try:
+            if future.set_running_or_notify_cancel():
+                future.set_result(function(*args, **kwargs))
+        except BaseException as error:
+            failed = True
+            future.set_exception(error)
+            writer_errors.append((label, error))
+        finally:
+            writer_log.append({"Label": label, "Queued_seconds": start - submitted, "Write_seconds": time.time() - start, "Failed": failed})
+            writer_queue.task_done()
+
+'''
+Description: Start the writer threads (if they are not running) and flush the queue when the process exits
+Args: None
+Return: None
+'''
+def start_writer():
+    if any(thread.is_alive() for thread in writer_threads):
+        return
+
+    writer_threads.clear()
+    for i in range(WRITER_THREADS):
+        thread = threading.Thread(target=writer_loop, name=f"writer-{i}", daemon=True)
+        thread.start()
+        writer_threads.append(thread)
+
+    atexit.register(flush_writes)
+
+'''
+Description: Raise the first error of the writes done in the background (the other ones are printed)
+Args: None
+Return: None
+'''
+def raise_write_errors():
+    if not writer_errors:
+        return
+
+    errors = list(writer_errors)
+    writer_errors.clear()
+    for label, error in errors[1:]:
+        print(f"Background write failed: {label} ({error!r})")
+
+    label, error = errors[0]
+    raise RuntimeError(f"Background write failed: {label}") from error
+
+'''
+Description: Write an artifact in the background, so that the caller can go on (e.g. with the next fit) while it is written. If the queue is full
+             the caller waits until there is room for it. The Pandas datasets of the arguments are copied, so the caller can keep modifying them
+Args:
+    function: Function writing the artifact (e.g. results_utilities.save_results)
+    args: Arguments of the function
+    label: Name of the artifact shown in the errors and in the report (the name of the function by default)
+    kwargs: Keyword arguments of the function
+Return:
+    future: Future of the result of the function
+'''
+def submit_write(function, *args, label=None, **kwargs):
+    raise_write_errors()
+    start_writer()
+
+    args = tuple(arg.copy() if isinstance(arg, pd.DataFrame) else arg for arg in args)
+    future = Future()
+    writer_queue.put((future, function, args, kwargs, label or function.__name__, time.time()))
+
+    return future
+
+'''
+Description: Wait until all the submitted artifacts have been written and raise the first error of the writes, if any
+Args: None
+Return: None
+'''
+def flush_writes():
+    if writer_threads:
+        writer_queue.join()
+
+    raise_write_errors()
+
+'''
+Description: Return the time spent by each artifact waiting in the queue and being written
+Args: None
+Return:
+    report: Pandas dataset with one row per artifact
+'''
+def writer_report():
+    return pd.DataFrame(writer_log)
+
+###################
+# --- DURABLE --- #
+###################
+
+'''
+Description: Replace a file with a new version written to a temporary file: the temporary file is synced to disk before the replacement
+             (and the directory after it), so after a crash the file is either the old or the new version, never a partial one
+Args:
+    tmp_path: Path of the new version
+    path: Path of the file
+Return: None
+'''
+def durable_replace(tmp_path, path):
+    with open(tmp_path, 'rb+') as file:
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+    # The directory entry is synced only where directories can be opened (not on Windows)
+    if hasattr(os, "O_DIRECTORY"):
+        directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+'''
+Description: Save a Pandas dataset as a CSV file durably (see durable_replace)
+Args:
+    dataset: Pandas dataset
+    path: Path of the file
+    kwargs: Arguments of to_csv (e.g. index=False)
+Return:
+    path: Path of the file
+'''
+def write_csv(dataset, path, **kwargs):
+    dataset.to_csv(path + ".tmp", **kwargs)
+    durable_replace(path + ".tmp", path)
+
+    return path